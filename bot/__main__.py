@@ -15,7 +15,7 @@ client = Bot(
 )
 
 db = SQLite()
-db.create_init_tables()
+db.migrate()
 db.close()
 
 
@@ -34,6 +34,9 @@ client.load_extension("bot.cogs.clean")
 client.load_extension("bot.cogs.announcements")
 client.load_extension("bot.cogs.embeds")
 client.load_extension("bot.cogs.fun")
+client.load_extension("bot.cogs.backups")
+client.load_extension("bot.cogs.dbstats")
+client.load_extension("bot.cogs.schedulerstats")
 
 if constants.Bot.token:
     client.run(constants.Bot.token)
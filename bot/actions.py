@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+import typing as t
+from enum import IntEnum
+
+from bot.constants import Actions
+
+log = logging.getLogger(__name__)
+
+ActionFactory = t.Callable[[], t.Awaitable[t.Any]]
+
+
+class Priority(IntEnum):
+    """Lanes of the action executor, actions of a lower value are executed first"""
+
+    STAFF = 0       # Actions of commands invoked by the staff
+    AUTOMATIC = 1   # Actions the bot takes on its own, e.g. expirations
+    BACKGROUND = 2  # Routine actions which can wait, e.g. the guest role of new members
+
+
+# Priority of the actions submitted without an explicit one, staff commands set it for their whole invocation
+current_priority: contextvars.ContextVar = contextvars.ContextVar("action_priority", default=Priority.AUTOMATIC)
+
+
+class TokenBucket:
+    """Allows `rate` actions per `per` seconds, refilling continuously"""
+
+    __slots__ = ("rate", "per", "tokens", "updated")
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Seconds until a token is available, 0 if one is available right away"""
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) * self.per / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class ActionExecutor:
+    """
+    Executes Discord actions, keeping every route below its rate limit.
+
+    Actions are submitted for a route (e.g. `ban`) and the ID its rate limit is bound to (the guild or
+    the channel). Every route and ID has its own token bucket and queue, which is ordered by `Priority`,
+    so staff actions are started before the automatic ones waiting for the same bucket. Actions with
+    the same `key` which haven't started yet are coalesced, they're executed only once.
+
+    Actions are started as soon as their bucket has a token, without waiting for the previous ones to
+    finish, and their results (or exceptions) are passed to whoever submitted them.
+    """
+
+    def __init__(self, rate: int = None, per: float = None, routes: t.Dict[str, t.Dict[str, float]] = None):
+        self.rate = rate if rate is not None else Actions.rate
+        self.per = per if per is not None else Actions.per
+        # Per route overrides of the rate and period
+        self.routes = routes if routes is not None else Actions.routes
+
+        self._buckets: t.Dict[t.Tuple[str, int], TokenBucket] = {}
+        # Heaps of [priority, sequence, key, action, future] entries, per bucket
+        self._queues: t.Dict[t.Tuple[str, int], t.List[list]] = {}
+        self._workers: t.Dict[t.Tuple[str, int], asyncio.Task] = {}
+        # Queued entries with a key, by their key
+        self._pending: t.Dict[t.Hashable, list] = {}
+        self._running: t.Set[asyncio.Task] = set()
+        self._sequence = itertools.count()
+
+    def _get_bucket(self, bucket_key: t.Tuple[str, int]) -> TokenBucket:
+        if bucket_key not in self._buckets:
+            limits = self.routes.get(bucket_key[0], {})
+            self._buckets[bucket_key] = TokenBucket(limits.get("rate", self.rate), limits.get("per", self.per))
+        return self._buckets[bucket_key]
+
+    def submit(
+        self,
+        route: str,
+        major_id: int,
+        action: ActionFactory,
+        priority: Priority = None,
+        key: t.Hashable = None
+    ) -> asyncio.Future:
+        """
+        Queue the coroutine function `action` and return a future of its result.
+
+        If an action with the same `key` is still queued, its future is returned instead, and the queued
+        action is moved up if this one has a higher priority. The priority defaults to `current_priority`.
+        """
+        priority = priority if priority is not None else current_priority.get()
+        bucket_key = (route, major_id)
+
+        if key is not None and key in self._pending:
+            log.debug(f"Coalescing action {key} with the queued one")
+            entry = self._pending[key]
+            if priority < entry[0]:
+                entry[0] = priority
+                heapq.heapify(self._queues[bucket_key])
+            return entry[4]
+
+        future = asyncio.get_event_loop().create_future()
+        entry = [priority, next(self._sequence), key, action, future]
+        heapq.heappush(self._queues.setdefault(bucket_key, []), entry)
+        if key is not None:
+            self._pending[key] = entry
+
+        if bucket_key not in self._workers:
+            self._workers[bucket_key] = asyncio.create_task(self._work(bucket_key))
+        return future
+
+    async def run(
+        self,
+        route: str,
+        major_id: int,
+        action: ActionFactory,
+        priority: Priority = None,
+        key: t.Hashable = None
+    ) -> t.Any:
+        """Submit the action and wait for its result, see `submit`."""
+        # Shielded, so a cancelled caller doesn't cancel the action for the others it was coalesced with
+        return await asyncio.shield(self.submit(route, major_id, action, priority, key))
+
+    async def _work(self, bucket_key: t.Tuple[str, int]) -> None:
+        """Start the queued actions of a bucket as its tokens allow, until its queue is empty"""
+        queue = self._queues[bucket_key]
+        bucket = self._get_bucket(bucket_key)
+        try:
+            while queue:
+                delay = bucket.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                    continue
+
+                entry = heapq.heappop(queue)
+                _, _, key, action, future = entry
+                if key is not None and self._pending.get(key) is entry:
+                    del self._pending[key]
+                if future.done():
+                    continue
+
+                bucket.take()
+                task = asyncio.create_task(self._execute(action, future))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+        finally:
+            self._workers.pop(bucket_key, None)
+            if not queue:
+                self._queues.pop(bucket_key, None)
+
+    @staticmethod
+    async def _execute(action: ActionFactory, future: asyncio.Future) -> None:
+        try:
+            result = await action()
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    def queued(self) -> t.Dict[Priority, int]:
+        """Amount of actions waiting for a token, per priority"""
+        counts = {priority: 0 for priority in Priority}
+        for queue in self._queues.values():
+            for entry in queue:
+                counts[entry[0]] += 1
+        return counts
+
+    async def close(self) -> None:
+        """Stop the workers and cancel the queued actions, the running ones are left to finish."""
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        for queue in self._queues.values():
+            for entry in queue:
+                entry[4].cancel()
+        self._queues.clear()
+        self._pending.clear()
+        if self._running:
+            await asyncio.wait(list(self._running))
@@ -1,13 +1,23 @@
 import asyncio
 import logging
+import typing as t
 
 import discord
 from discord.ext import commands
 
 from bot import constants
+from bot.actions import ActionExecutor
+from bot.database import AsyncSQLite, ShardedDatabase
+from bot.leadership import Lease
 
 log = logging.getLogger("bot")
 
+# Events a standby instance still handles, all of the others could have side effects which only the leader may have
+STANDBY_EVENTS = frozenset((
+    "connect", "disconnect", "ready", "resumed", "shard_ready", "error",
+    "guild_available", "guild_unavailable", "leadership_acquired", "leadership_lost",
+))
+
 
 class Bot(commands.Bot):
     """A subclass of `discord.ext.commands.Bot` with some added functionality"""
@@ -17,11 +27,64 @@ class Bot(commands.Bot):
 
         self._guild_available = asyncio.Event()
 
+        # Long-lived database connections, one per guild shard, cogs get the one of a guild with `get_db`
+        self.databases = ShardedDatabase()
+        self.db = self.databases.home
+
+        # Moderation actions on Discord go through the executor, which keeps them within the rate limits
+        self.actions = ActionExecutor()
+
+        # Only one of the running instances is active, see `dispatch`
+        self.lease = Lease(self.db, self.dispatch)
+
     def add_cog(self, cog: commands.Cog) -> None:
         """Adds a "cog" to the bot and logs the operation."""
         super().add_cog(cog)
         log.info(f"Cog loaded: {cog.qualified_name}")
 
+    async def start(self, *args, **kwargs) -> None:
+        """Start competing for the lease, then connect to Discord."""
+        self.lease.start()
+        await super().start(*args, **kwargs)
+
+    async def close(self) -> None:
+        """Close the connection to Discord, hand the lease over and close all of the database connections."""
+        await super().close()
+        await self.actions.close()
+        await self.lease.close()
+        await self.databases.close()
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether this instance holds the lease, only the leader handles events and runs the schedulers"""
+        return self.lease.is_leader
+
+    async def wait_until_leader(self) -> None:
+        """Wait until this instance holds the lease."""
+        await self.lease.wait_until_leader()
+
+    def dispatch(self, event_name: str, *args, **kwargs) -> None:
+        """
+        Dispatch the event to its listeners, unless this instance is a standby.
+
+        A standby stays connected and keeps its cache up to date, but ignores the events (and so
+        the commands) which would make it duplicate the work of the leader.
+        """
+        if event_name in STANDBY_EVENTS or self.lease.is_leader:
+            super().dispatch(event_name, *args, **kwargs)
+
+    async def get_db(self, guild_id: int) -> AsyncSQLite:
+        """Get the database holding the infractions of the guild with `guild_id`."""
+        return await self.databases.get(guild_id)
+
+    async def get_guild_dbs(self) -> t.Dict[int, AsyncSQLite]:
+        """Get the database of every guild which has its own, keyed by the guild ID, the home guild first."""
+        guild_ids = [constants.Guild.id, *(guild.id for guild in self.guilds if guild.id != constants.Guild.id)]
+        return {
+            guild_id: await self.get_db(guild_id)
+            for guild_id in guild_ids if self.databases.has_own_database(guild_id)
+        }
+
     def clear(self) -> None:
         """
         Clears the internal state of the bot and recreates the connector and sessions.
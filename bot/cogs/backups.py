@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import typing as t
+from datetime import timedelta
+from pathlib import Path
+
+from discord.ext import tasks
+from discord.ext.commands import Cog, Context, command
+
+from bot.bot import Bot
+from bot.constants import STAFF_ROLES, Database, Emojis
+from bot.decorators import with_role
+from bot.utils.backups import BackupResult, create_backup, get_last_backup_time
+from bot.utils.time import wait_until
+
+log = logging.getLogger(__name__)
+
+
+class Backups(Cog):
+    """Scheduled and on-demand backups of the database"""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        # Scheduled and manual backups would otherwise race for the same file names and rotation
+        self._lock = asyncio.Lock()
+        self.scheduled_backup.start()
+
+    def cog_unload(self) -> None:
+        """Stop the scheduled backups when the cog is unloaded."""
+        self.scheduled_backup.cancel()
+
+    async def backup(self) -> t.List[BackupResult]:
+        """Back up the home database and all of the open guild shards, waiting for a backup which is already running"""
+        async with self._lock:
+            # One after another, so the snapshots don't compete for the disk
+            return [await create_backup(db) for db in self.bot.databases.databases]
+
+    @tasks.loop(hours=Database.backup_interval)
+    async def scheduled_backup(self) -> None:
+        """Periodically back the database up"""
+        # The leader backs up for everyone, the databases are shared
+        if not self.bot.is_leader:
+            return
+
+        try:
+            await self.backup()
+        except Exception:
+            log.exception("Scheduled database backup failed")
+
+    @scheduled_backup.before_loop
+    async def before_scheduled_backup(self) -> None:
+        """Don't take the first backup while the bot is still starting up, or before the interval since the last one passed"""
+        await self.bot.wait_until_ready()
+
+        # Otherwise every restart takes a backup, and a few deploys rotate the older ones out
+        last_backup = get_last_backup_time(Path(Database.backup_dir), Path(self.bot.db.db_name).stem)
+        if last_backup is not None:
+            await wait_until(last_backup + timedelta(hours=Database.backup_interval))
+
+    @command(name="backup", aliases=["backup_db"])
+    @with_role(*STAFF_ROLES)
+    async def backup_command(self, ctx: Context) -> None:
+        """Back the database up right away"""
+        async with ctx.typing():
+            try:
+                results = await self.backup()
+            except Exception:
+                log.exception(f"Database backup requested by {ctx.author} failed")
+                await ctx.send(f"{Emojis.cross_mark}Database backup failed, check the logs")
+                return
+
+        size = sum(result.size for result in results) / 1024
+        duration = sum(result.duration for result in results)
+        if len(results) == 1:
+            target = f"into `{results[0].path.name}`"
+        else:
+            target = f"with {len(results) - 1} guild shards"
+        await ctx.send(f"{Emojis.check_mark}Database backed up {target} ({size:.1f} KiB) in {duration:.2f}s")
+
+
+def setup(bot: Bot) -> None:
+    """Load the Backups cog."""
+    bot.add_cog(Backups(bot))
@@ -0,0 +1,63 @@
+import textwrap
+
+from discord import Colour, Embed
+from discord.ext.commands import Cog, Context, group
+
+from bot.bot import Bot
+from bot.constants import STAFF_ROLES, Emojis
+from bot.decorators import with_role
+from bot.pagination import LinePaginator
+from bot.utils.infractions import UserInfractionCache, get_cache
+
+
+def format_bound(milliseconds: float) -> str:
+    return "∞" if milliseconds == float("inf") else f"{milliseconds:g}ms"
+
+
+class DBStats(Cog):
+    """Statistics of the statements executed by the database"""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+
+    @group(name="dbstats", aliases=["querystats"], invoke_without_command=True)
+    @with_role(*STAFF_ROLES)
+    async def dbstats_group(self, ctx: Context, amount: int = 10) -> None:
+        """Show the `amount` statements which took the most time in total since the bot started, in all guild shards"""
+        lines = []
+        for position, (sql, stats) in enumerate(self.bot.databases.stats.top(amount), start=1):
+            caller, _ = stats.callers.most_common(1)[0]
+            lines.append("\n".join((
+                f"**{position}.** {stats.total:.1f}ms total, {stats.calls} calls",
+                f"avg {stats.average:.2f}ms, p95 ≤ {format_bound(stats.percentile(95))}, max {stats.max:.1f}ms",
+                f"Mostly from `{caller}`",
+                f"```sql\n{textwrap.shorten(sql, width=300, placeholder='...')}```",
+            )))
+
+        if not lines:
+            lines.append("No statements were executed yet.")
+
+        cache = UserInfractionCache.combine(get_cache(db).info() for db in self.bot.databases.databases)
+        lookups = cache.hits + cache.misses
+        hit_rate = f"{cache.hits / lookups:.0%}" if lookups else "-"
+
+        embed = Embed(title="Slowest database statements", colour=Colour.blurple())
+        await LinePaginator.paginate(
+            lines, ctx, embed, max_lines=5, max_size=2000, restrict_to_user=ctx.author,
+            footer_text=(
+                f"Infraction cache: {cache.hits} hits, {cache.misses} misses ({hit_rate}), "
+                f"{cache.currsize}/{cache.maxsize} users"
+            )
+        )
+
+    @dbstats_group.command(name="reset")
+    @with_role(*STAFF_ROLES)
+    async def reset_command(self, ctx: Context) -> None:
+        """Forget the statistics collected so far"""
+        self.bot.databases.reset_stats()
+        await ctx.send(f"{Emojis.check_mark}Database statistics were reset")
+
+
+def setup(bot: Bot) -> None:
+    """Load the DBStats cog."""
+    bot.add_cog(DBStats(bot))
@@ -2,11 +2,12 @@ import colorsys
 import logging
 import random
 import textwrap
-from collections import Counter, defaultdict
+from collections import Counter
+from datetime import datetime, timedelta
 from string import Template
-from typing import Union
+from typing import List, Optional, Union
 
-from discord import Colour, Embed, Guild, Member, Role, Status, utils
+from discord import Colour, Embed, Forbidden, Guild, Member, Role, Status, utils
 from discord.ext.commands import Cog, Context, command
 from discord.utils import escape_markdown
 
@@ -15,7 +16,7 @@ from bot.bot import Bot
 from bot.constants import (MODERATION_ROLES, NEGATIVE_REPLIES,
                            POSITIVE_REPLIES, STAFF_CHANNELS, STAFF_ROLES,
                            Channels, Colours, Emojis, Rules)
-from bot.converters import FetchedMember
+from bot.converters import Duration, FetchedMember, InfractionType
 from bot.decorators import in_whitelist, with_role
 from bot.pagination import LinePaginator
 from bot.utils.checks import has_higher_role_check, with_role_check
@@ -23,6 +24,8 @@ from bot.utils.time import time_since
 
 log = logging.getLogger(__name__)
 
+INFRACTIONS_PER_PAGE = 5
+
 
 class Information(Cog):
     """A cog with commands for generating embeds with server info, such as server stats and user info."""
@@ -167,9 +170,6 @@ class Information(Cog):
     @command(name="infractions", aliases=["show_infractions"])
     async def infractions(self, ctx: Context, user: FetchedMember = None) -> None:
         """Return user's infractions"""
-
-        # TODO: Handle too long message
-
         if user is None:
             user = ctx.author
 
@@ -190,19 +190,97 @@ class Information(Cog):
 
         embed = await self.create_infractions_embed(ctx, user)
 
+        db = await self.bot.get_db(ctx.guild.id)
+        counts = await infractions.get_infraction_counts(db, user)
+        total = sum(counts.values())
+        active = sum(count for (_, is_active), count in counts.items() if is_active)
+
+        # Only the viewed page is fetched, using keyset queries, so long infraction lists stay cheap
+        pages = infractions.UserInfractionPages(db, user, total, INFRACTIONS_PER_PAGE)
+
+        async def get_page(page: int) -> List[str]:
+            if not total:
+                return ["This user has never received an infraction."]
+            lines = []
+            for infraction in await pages.get(page):
+                lines.extend(self.format_infraction(ctx.guild, infraction))
+            return lines
+
         # Send infractions as DM, if user has any (bypass for staff members)
-        if not with_role_check(ctx, *STAFF_ROLES) and not len(infractions.get_infractions(user)) == 0:
-            msg = f"Your infraction list was sent to you by DM, {user.mention}"
-            await user.send(embed=embed)
-            await ctx.send(msg)
-        else:
-            await ctx.send(embed=embed)
+        destination = None
+        if not with_role_check(ctx, *STAFF_ROLES) and total:
+            destination = user
+
+        try:
+            await LinePaginator.paginate_lazily(
+                get_page, pages.page_count, ctx, embed,
+                prefix="```yaml\n", suffix="```",
+                restrict_to_user=ctx.author,
+                footer_text=f"Infractions: {total} total, {active} active",
+                destination=destination
+            )
+        except Forbidden:
+            if destination is None:
+                raise
+            await ctx.send(f"{Emojis.cross_mark} I couldn't send your infraction list by DM, {user.mention}")
+            return
+
+        if destination is not None:
+            await ctx.send(f"Your infraction list was sent to you by DM, {user.mention}")
+
+    @with_role(*STAFF_ROLES)
+    @command(name="infsearch", aliases=["search_infractions"])
+    async def infraction_search(
+        self,
+        ctx: Context,
+        inf_type: Optional[InfractionType] = None,
+        since: Optional[Duration] = None,
+        *,
+        query: str
+    ) -> None:
+        """
+        Search infractions by the words in their reason, best matches first
+
+        Optionally filter by infraction type and by how long ago the infraction was given,
+        e.g. `infsearch bans 30d scam link`.
+        """
+        since_time = datetime.now() - timedelta(seconds=since) if since is not None else None
+        db = await self.bot.get_db(ctx.guild.id)
+        total = await infractions.count_search_results(db, query, inf_type, since_time)
+
+        async def get_page(page: int) -> List[str]:
+            if not total:
+                return ["No infractions match this search."]
+            lines = []
+            results = await infractions.search_infractions(
+                db, query, inf_type, since_time,
+                limit=INFRACTIONS_PER_PAGE, offset=page * INFRACTIONS_PER_PAGE
+            )
+            for infraction, snippet in results:
+                state = "active" if infraction.is_active else "inactive"
+                lines.append(
+                    f"**#{infraction.id}** {infraction.type} ({state}) to <@{infraction.user_id}>, "
+                    f"{infraction.time_since_start}"
+                )
+                lines.append(f"{Emojis.bullet} {snippet}")
+            return lines
+
+        filters = [f"type: {inf_type}"] if inf_type else []
+        if since_time is not None:
+            filters.append(f"since: {since_time:%Y-%m-%d}")
+        embed = Embed(title=f"Infractions matching \"{escape_markdown(query)}\"", colour=Colour.blurple())
+
+        await LinePaginator.paginate_lazily(
+            get_page, -(-total // INFRACTIONS_PER_PAGE), ctx, embed,
+            restrict_to_user=ctx.author,
+            footer_text=", ".join([f"{total} results", *filters])
+        )
 
     @with_role(*STAFF_ROLES)
     @command()
     async def infraction(self, ctx: Context, infraction_id: int) -> None:
         """Provide detailed info about single infraction"""
-        infraction = infractions.get_infraction_by_row(infraction_id)
+        infraction = await infractions.get_infraction_by_row(await self.bot.get_db(ctx.guild.id), infraction_id)
 
         if infraction:
             user = ctx.guild.get_member(infraction.user_id)
@@ -320,9 +398,9 @@ class Information(Cog):
         if has_higher_role_check(ctx, user):
             # Show more verbose output in staff channels for infractions
             if ctx.channel.id in STAFF_CHANNELS and with_role_check(ctx, *STAFF_ROLES):
-                description.append(await self.expanded_user_infraction_counts(user))
+                description.append(await self.expanded_user_infraction_counts(ctx.guild, user))
             else:
-                description.append(await self.basic_user_infraction_counts(user))
+                description.append(await self.basic_user_infraction_counts(ctx.guild, user))
 
         # Let's build the embed now
         embed = Embed(
@@ -336,7 +414,7 @@ class Information(Cog):
         return embed
 
     async def create_infractions_embed(self, ctx: Context, user: FetchedMember) -> Embed:
-        """Create an embed containing information on user's infractions"""
+        """Create an embed for the paginated list of user's infractions"""
 
         name = str(user)
         if isinstance(user, Member):
@@ -347,59 +425,43 @@ class Information(Cog):
         else:
             roles = []
 
-        description = await self.full_user_infraction_counts(ctx, user)
-
-        embed = Embed(
-            title=name,
-            description=description
-        )
+        embed = Embed(title=name)
 
         embed.set_thumbnail(url=user.avatar_url_as(format="png"))
         embed.colour = user.top_role.colour if roles else Colour.blurple()
 
         return embed
 
-    async def basic_user_infraction_counts(self, member: FetchedMember) -> str:
-        """Gets the total and active infraction counts for the given `member`."""
-        infs = infractions.get_infractions(member)
-        active_infs = infractions.get_active_infractions(member)
+    async def basic_user_infraction_counts(self, guild: Guild, member: FetchedMember) -> str:
+        """Gets the total and active infraction counts for the given `member` in `guild`."""
+        counts = await infractions.get_infraction_counts(await self.bot.get_db(guild.id), member)
 
-        total_infractions = len(infs)
-        active_infractions = len(active_infs)
+        total_infractions = sum(counts.values())
+        active_infractions = sum(count for (_, active), count in counts.items() if active)
 
         infraction_output = f"**Infractions**\nTotal: {total_infractions}\nActive: {active_infractions}"
 
         return infraction_output
 
-    async def expanded_user_infraction_counts(self, member: FetchedMember) -> str:
+    async def expanded_user_infraction_counts(self, guild: Guild, member: FetchedMember) -> str:
         """
-        Gets expanded infraction counts for the given `member`.
+        Gets expanded infraction counts for the given `member` in `guild`.
 
         The counts will be split by infraction type and the number of active infractions for each type will indicated
         in the output as well.
         """
-        infs = infractions.get_infractions(member)
+        # Counts split by `type` and `active` status for this user
+        counts = await infractions.get_infraction_counts(await self.bot.get_db(guild.id), member)
 
         infraction_output = ["**Infractions**"]
-        if not infs:
+        if not counts:
             infraction_output.append(
                 "This user has never received an infraction.")
         else:
-            # Count infractions split by `type` and `active` status for this user
-            infraction_types = set()
-            infraction_counter = defaultdict(int)
-            for infraction in infs:
-                infraction_type = infraction.type
-                infraction_active = "active" if infraction.is_active else "inactive"
-
-                infraction_types.add(infraction_type)
-                infraction_counter[f"{infraction_active} {infraction_type}"] += 1
-
             # Format the output of the infraction counts
-            for infraction_type in sorted(infraction_types):
-                active_count = infraction_counter[f"active {infraction_type}"]
-                total_count = active_count + \
-                    infraction_counter[f"inactive {infraction_type}"]
+            for infraction_type in sorted({infraction_type for infraction_type, _ in counts}):
+                active_count = counts[(infraction_type, True)]
+                total_count = active_count + counts[(infraction_type, False)]
 
                 line = f"{infraction_type.capitalize()}s: {total_count}"
                 if active_count:
@@ -409,76 +471,25 @@ class Information(Cog):
 
         return "\n".join(infraction_output)
 
-    async def full_user_infraction_counts(self, ctx: Context, member: FetchedMember) -> str:
-        """
-        Gets full infraction info with descriptions for the given member
-
-        The counts will be split by `active` status and infraction `type`
-        """
-
-        def get_infractions_by_type(guild: Guild, all_infractions: list) -> dict:
-            infraction_types = set()
-            infractions_dict = defaultdict(list)
-
-            # Loop through all given infractions
-            for infraction in all_infractions:
-                # Add infraction type to infraction_types set
-                infraction_type = infraction.type
-                infraction_types.add(infraction_type)
-                # Append the infraction to infractions_dict with type as key
-                infractions_dict[infraction_type].append(infraction)
-
-            line = "```yaml\n"
-            for infraction_type in sorted(infraction_types):
-                # Get total infraction amount
-                infractions_amt = len(infractions_dict[infraction_type])
-                line += f"{infraction_type}s: {infractions_amt}\n"
-                # Print details about infractions with current type
-                for infraction in infractions_dict[infraction_type]:
-                    # Get actors name if possible
-                    actor = guild.get_member(infraction.actor_id)
-                    if not isinstance(actor, Member):
-                        actor = infraction.actor_id
-                    else:
-                        actor = f"{actor.name}#{actor.discriminator}"
-
-                    line += f"  - {(infraction.reason)}\n"
-                    line += f"      ID: {infraction.id}\n"
-                    line += f"      duration: {infraction.str_duration}\n"
-                    line += f"      given: {infraction.time_since_start}\n"
-                    line += f"      actor: {actor}\n"
-            line = line[:-1]
-            line += "```"
-
-            return line
-
-        active_infs = infractions.get_active_infractions(member)
-        inactive_infs = infractions.get_inactive_infractions(member)
-        guild = ctx.guild
-
-        if not active_infs and not inactive_infs:
-            infraction_output = ["**Infractions**"]
-            infraction_output.append(
-                "This user has never received an infraction.")
+    def format_infraction(self, guild: Guild, infraction: "infractions.Infraction") -> List[str]:
+        """Format a single infraction as lines of the paginated infraction list"""
+        # Get actors name if possible
+        actor = guild.get_member(infraction.actor_id)
+        if not isinstance(actor, Member):
+            actor = infraction.actor_id
         else:
-            infraction_output = ["**Active Infractions**"]
-            if not active_infs:
-                infraction_output.append(
-                    "This user has no active infractions.")
-            else:
-                infraction_output.append(f"TOTAL: {len(active_infs)}")
-                infraction_output.append(
-                    get_infractions_by_type(guild, active_infs))
-            infraction_output.append("**Inactive Infractions**")
-            if not inactive_infs:
-                infraction_output.append(
-                    "This user has no inactive infractions.")
-            else:
-                infraction_output.append(f"TOTAL: {len(inactive_infs)}")
-                infraction_output.append(
-                    get_infractions_by_type(guild, inactive_infs))
+            actor = f"{actor.name}#{actor.discriminator}"
 
-        return "\n".join(infraction_output)
+        state = "active" if infraction.is_active else "inactive"
+        reason = textwrap.shorten(infraction.reason, width=200, placeholder="...")
+
+        return [
+            f"{infraction.type} #{infraction.id} ({state}):",
+            f"  reason: {reason}",
+            f"  duration: {infraction.str_duration}",
+            f"  given: {infraction.time_since_start}",
+            f"  actor: {actor}",
+        ]
 
     # endregion: Infractions sub-functions
 
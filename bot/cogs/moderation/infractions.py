@@ -2,6 +2,7 @@ import logging
 import random
 import typing as t
 from datetime import datetime
+from functools import partial
 
 import discord
 from dateutil.relativedelta import relativedelta
@@ -10,6 +11,7 @@ from discord.ext import commands
 from discord.ext.commands import Context, command
 
 from bot import constants
+from bot.actions import Priority, current_priority
 from bot.bot import Bot
 from bot.constants import Event
 from bot.converters import Expiry, FetchedMember
@@ -35,6 +37,14 @@ class Infractions(InfractionScheduler, commands.Cog):
         """Get currently loaded ModLog cog instance."""
         return self.bot.get_cog("ModLog")
 
+    async def cog_before_invoke(self, ctx: Context) -> None:
+        """Give the Discord actions of the staff commands priority over the automatic ones."""
+        current_priority.set(Priority.STAFF)
+
+    def cog_check(self, ctx: Context) -> bool:
+        """Only moderate guilds whose infractions are stored apart from those of the other guilds."""
+        return ctx.guild is not None and self.bot.databases.has_own_database(ctx.guild.id)
+
     # region: Checks
 
     async def check_bot(self, ctx: Context, user: Member, command: str) -> bool:
@@ -149,8 +159,13 @@ class Infractions(InfractionScheduler, commands.Cog):
     async def unmute(self, ctx: Context, user: Member, *, reason: str = None) -> None:
         """Prematurely end the active mute infraction for the user."""
 
-        infraction_list = infractions.get_active_infractions(user, "mute")
-        infraction = max(infraction_list, key=lambda o: o.stop)
+        db = await self.bot.get_db(ctx.guild.id)
+        state = await infractions.get_user_state(db, user.id)
+        if state is None or state.muted_id is None:
+            await ctx.send(f"{constants.Emojis.cross_mark} This user isn't muted")
+            return
+
+        infraction = await infractions.get_infraction_by_row(db, state.muted_id)
         await self.pardon_infraction(ctx, infraction)
 
     @with_role(*constants.MODERATION_ROLES)
@@ -158,8 +173,13 @@ class Infractions(InfractionScheduler, commands.Cog):
     async def unban(self, ctx: Context, user: FetchedMember, *, reason: str = None) -> None:
         """Prematurely end the active ban infraction for the user."""
 
-        infraction_list = infractions.get_active_infractions(user, "ban")
-        infraction = max(infraction_list, key=lambda o: o.stop)
+        db = await self.bot.get_db(ctx.guild.id)
+        state = await infractions.get_user_state(db, user.id)
+        if state is None or state.banned_id is None:
+            await ctx.send(f"{constants.Emojis.cross_mark} This user isn't banned")
+            return
+
+        infraction = await infractions.get_infraction_by_row(db, state.banned_id)
         await self.pardon_infraction(ctx, infraction)
 
     @with_role(constants.Roles.owners)
@@ -167,7 +187,8 @@ class Infractions(InfractionScheduler, commands.Cog):
     async def pardon(self, ctx: Context, infraction_id: int) -> None:
         """Pardon any infraction by its ID"""
 
-        infraction = infractions.get_infraction_by_row(infraction_id)
+        db = await self.bot.get_db(ctx.guild.id)
+        infraction = await infractions.get_infraction_by_row(db, infraction_id)
 
         await self.pardon_infraction(ctx, infraction)
 
@@ -176,7 +197,8 @@ class Infractions(InfractionScheduler, commands.Cog):
     async def delete_infraction(self, ctx: Context, infraction_id: int) -> None:
         """Remove infraction by its ID"""
 
-        infraction = infractions.get_infraction_by_row(infraction_id)
+        db = await self.bot.get_db(ctx.guild.id)
+        infraction = await infractions.get_infraction_by_row(db, infraction_id)
 
         await self.remove_infraction(ctx, infraction)
 
@@ -187,16 +209,14 @@ class Infractions(InfractionScheduler, commands.Cog):
     async def apply_ban(self, ctx: Context, user: UserSnowflake, reason: str = None, duration: int = 1_000_000_000, hidden: bool = False) -> None:
         """Apply a ban infraction"""
 
+        db = await self.bot.get_db(ctx.guild.id)
         infraction = infractions.Infraction(
             user.id, "ban", reason, ctx.author.id, datetime.now(), duration)
 
-        # Get current user's active bans
-        infs = infractions.get_active_infractions(
-            user, inf_type="ban")
-
-        # Determine if the user has any active ban infractions that override the current one
-        for inf in infs:
-            if inf.duration == 1_000_000_000:
+        # Determine if the user's longest active ban overrides the current one
+        state = await infractions.get_user_state(db, user.id)
+        if state is not None and state.is_banned:
+            if state.banned_until is None:
                 embed = Embed(
                     title=random.choice(constants.NEGATIVE_REPLIES),
                     description="This user is already banned permanently",
@@ -204,10 +224,11 @@ class Infractions(InfractionScheduler, commands.Cog):
                 )
                 await ctx.send(embed=embed)
                 return
-            if inf.stop > (datetime.now() + relativedelta(seconds=duration)):
+            stop = datetime.fromtimestamp(state.banned_until)
+            if stop > (datetime.now() + relativedelta(seconds=duration)):
                 embed = Embed(
                     title=random.choice(constants.NEGATIVE_REPLIES),
-                    description=f"This user is already banned\n(Currents ban ends at: {inf.stop})",
+                    description=f"This user is already banned\n(Currents ban ends at: {stop})",
                     color=constants.Colours.soft_red
                 )
                 await ctx.send(embed=embed)
@@ -217,38 +238,41 @@ class Infractions(InfractionScheduler, commands.Cog):
         if ctx.guild.get_member(user.id):
             self.mod_log.ignore(Event.member_remove, user.id)
 
-        action = ctx.guild.ban(user, reason=reason)
-        infraction.add_to_database()
+        action = self.bot.actions.run(
+            "ban", ctx.guild.id, partial(ctx.guild.ban, user, reason=reason), key=("ban", ctx.guild.id, user.id)
+        )
+        await infraction.add_to_database(db)
         await self.apply_infraction(ctx, infraction, user, action, hidden)
 
     @respect_role_hierarchy()
     async def apply_kick(self, ctx: Context, user: Member, reason: str = None, hidden: bool = False) -> None:
         """Apply a kick infraction"""
 
+        db = await self.bot.get_db(ctx.guild.id)
         infraction = infractions.Infraction(
             user.id, "kick", reason, ctx.author.id, datetime.now(), 0)
 
         # Do not send member_remove message to mod_log
         self.mod_log.ignore(Event.member_remove, user.id)
 
-        action = user.kick(reason=reason)
-        infraction.add_to_database()
+        action = self.bot.actions.run(
+            "kick", ctx.guild.id, partial(user.kick, reason=reason), key=("kick", ctx.guild.id, user.id)
+        )
+        await infraction.add_to_database(db)
         await self.apply_infraction(ctx, infraction, user, action, hidden)
 
     @respect_role_hierarchy()
     async def apply_mute(self, ctx: Context, user: Member, reason: str = None, duration: int = 1_000_000_000, hidden: bool = False) -> None:
         """Apply a mute infraction"""
 
+        db = await self.bot.get_db(ctx.guild.id)
         infraction = infractions.Infraction(
             user.id, "mute", reason, ctx.author.id, datetime.now(), duration)
 
-        # Get current user's active mutes
-        infs = infractions.get_active_infractions(
-            user, inf_type="mute")
-
-        # Determine if the user has any active mute infractions that override the current one
-        for inf in infs:
-            if inf.duration == 1_000_000_000:
+        # Determine if the user's longest active mute overrides the current one
+        state = await infractions.get_user_state(db, user.id)
+        if state is not None and state.is_muted:
+            if state.muted_until is None:
                 embed = Embed(
                     title=random.choice(constants.NEGATIVE_REPLIES),
                     description="This user is already muted permanently",
@@ -256,10 +280,11 @@ class Infractions(InfractionScheduler, commands.Cog):
                 )
                 await ctx.send(embed=embed)
                 return
-            if inf.stop > (datetime.now() + relativedelta(seconds=duration)):
+            stop = datetime.fromtimestamp(state.muted_until)
+            if stop > (datetime.now() + relativedelta(seconds=duration)):
                 embed = Embed(
                     title=random.choice(constants.NEGATIVE_REPLIES),
-                    description=f"This user is already muted\n(Currents mute ends at: {inf.stop})",
+                    description=f"This user is already muted\n(Currents mute ends at: {stop})",
                     color=constants.Colours.soft_red
                 )
                 await ctx.send(embed=embed)
@@ -269,9 +294,12 @@ class Infractions(InfractionScheduler, commands.Cog):
         self.mod_log.ignore(Event.member_update, user.id)
 
         async def action() -> None:
-            await user.add_roles(discord.Object(constants.Roles.muted), reason=reason)
-            await user.move_to(None, reason=reason)
-        infraction.add_to_database()
+            await self.bot.actions.run(
+                "roles", ctx.guild.id, partial(user.add_roles, discord.Object(constants.Roles.muted), reason=reason),
+                key=("add_role", user.id, constants.Roles.muted)
+            )
+            await self.bot.actions.run("member", ctx.guild.id, partial(user.move_to, None, reason=reason))
+        await infraction.add_to_database(db)
 
         await self.apply_infraction(ctx, infraction, user, action(), hidden)
 
@@ -279,10 +307,11 @@ class Infractions(InfractionScheduler, commands.Cog):
     async def apply_warn(self, ctx: Context, user: UserSnowflake, reason: str = None, hidden: bool = False) -> None:
         """Apply a warn infraction"""
 
+        db = await self.bot.get_db(ctx.guild.id)
         infraction = infractions.Infraction(
             user.id, "warn", reason, ctx.author.id, datetime.now(), 0)
 
-        infraction.add_to_database()
+        await infraction.add_to_database(db)
         await self.apply_infraction(ctx, infraction, user, hidden=hidden)
 
     # endregion
@@ -296,7 +325,10 @@ class Infractions(InfractionScheduler, commands.Cog):
 
         if user:
             self.mod_log.ignore(Event.member_update, user.id)
-            await user.remove_roles(Object(constants.Roles.muted), reason=reason)
+            await self.bot.actions.run(
+                "roles", guild.id, partial(user.remove_roles, Object(constants.Roles.muted), reason=reason),
+                key=("remove_role", user.id, constants.Roles.muted)
+            )
 
             # DM the user about the expiration
             notified = await utils.notify_pardon(
@@ -323,7 +355,9 @@ class Infractions(InfractionScheduler, commands.Cog):
         self.mod_log.ignore(Event.member_unban, user_id)
 
         try:
-            await guild.unban(user, reason=reason)
+            await self.bot.actions.run(
+                "unban", guild.id, partial(guild.unban, user, reason=reason), key=("unban", guild.id, user_id)
+            )
         except discord.NotFound:
             log.info(
                 f"Failed to unban user {user_id} no active ban found on Discord")
@@ -331,13 +365,12 @@ class Infractions(InfractionScheduler, commands.Cog):
 
         return log_text
 
-    async def _pardon_action(self, infraction: infractions.Infraction) -> t.Optional[t.Dict[str, str]]:
+    async def _pardon_action(self, infraction: infractions.Infraction, guild: discord.Guild) -> t.Optional[t.Dict[str, str]]:
         """
-        Execute deactivation steps specific to the infraction's type and return a log dict.
+        Execute deactivation steps specific to the infraction's type in `guild` and return a log dict.
 
         If an infraction type is unsupported, return None instead.
         """
-        guild = self.bot.get_guild(constants.Guild.id)
         user_id = infraction.user_id
         reason = f"Infraction #{infraction.id} expired or was pardoned."
 
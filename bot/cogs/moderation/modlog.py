@@ -4,6 +4,7 @@ import itertools
 import logging
 import typing as t
 from datetime import datetime
+from functools import partial
 
 import discord
 from dateutil.relativedelta import relativedelta
@@ -12,6 +13,7 @@ from discord import Colour
 from discord.ext.commands import Cog, Context
 from discord.utils import escape_markdown
 
+from bot.actions import Priority
 from bot.constants import Channels, Colours, Emojis, Event
 from bot.constants import Guild as GuildConstant
 from bot.constants import Icons, Roles
@@ -285,12 +287,13 @@ class ModLog(Cog, name="ModLog"):
             self._ignored[Event.member_ban].remove(member.id)
             return
 
-        infs = infractions.get_active_infractions(
-            member, inf_type="ban")
         # Check if there are no infractions for this ban, if there aren't log it
-        if len(infs) == 0:
-            infractions.Infraction(
-                member.id, "ban", "Unknown/Server banned", self.bot.user.id, datetime.now(), 1_000_000_000, write_to_db=True)
+        db = await self.bot.get_db(guild.id)
+        state = await infractions.get_user_state(db, member.id)
+        if state is None or state.banned_id is None:
+            infraction = infractions.Infraction(
+                member.id, "ban", "Unknown/Server banned", self.bot.user.id, datetime.now(), 1_000_000_000)
+            await infraction.add_to_database(db)
 
         await self.send_log_message(
             Icons.user_ban, Colours.soft_red,
@@ -315,8 +318,22 @@ class ModLog(Cog, name="ModLog"):
         if difference.days < 1 and difference.months < 1 and difference.years < 1:  # New user account!
             message = f"{Emojis.new} {message}"
 
+        # Waits for the moderation actions during raids, which makes the raid accounts wait for the role
         guest_role = member.guild.get_role(Roles.guests)
-        await member.add_roles(guest_role, reason="AutoRole")
+        await self.bot.actions.run(
+            "roles", member.guild.id, partial(member.add_roles, guest_role, reason="AutoRole"),
+            Priority.BACKGROUND, key=("add_role", member.id, Roles.guests)
+        )
+
+        # Leaving and joining again must not get rid of an active mute
+        state = await infractions.get_user_state(await self.bot.get_db(member.guild.id), member.id)
+        if state is not None and state.is_muted:
+            self.ignore(Event.member_update, member.id)
+            await self.bot.actions.run(
+                "roles", member.guild.id, partial(member.add_roles, discord.Object(Roles.muted), reason="Active mute"),
+                Priority.AUTOMATIC, key=("add_role", member.id, Roles.muted)
+            )
+            message += f"\n\n**Muted** (infraction #{state.muted_id})"
 
         log.info(f"User {member} has joined")
 
@@ -358,8 +375,8 @@ class ModLog(Cog, name="ModLog"):
             return
 
         # Pardon active ban infraction(s)
-        infs = infractions.get_active_infractions(
-            member, inf_type="ban")
+        infs = await infractions.get_active_infractions(
+            await self.bot.get_db(guild.id), member, inf_type="ban")
         for infraction in infs:
             await infraction.pardon(guild, self.bot, force=True)
 
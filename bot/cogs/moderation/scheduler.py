@@ -3,17 +3,20 @@ import logging
 import textwrap
 import typing as t
 from abc import abstractmethod
+from datetime import datetime, timedelta
 from gettext import ngettext
 
 import discord
-from discord.ext.commands import Context
+from discord.ext import tasks
+from discord.ext.commands import Cog, Context
 
 from bot import constants
 from bot.bot import Bot
-from bot.constants import STAFF_CHANNELS, Colours, Emojis
-from bot.utils import time
-from bot.utils.infractions import (Infraction, get_active_infractions,
-                                   get_all_active_infractions, get_infractions,
+from bot.constants import STAFF_CHANNELS, Colours, Emojis, Scheduling
+from bot.utils.infractions import (Infraction, clear_caches,
+                                   get_active_infractions,
+                                   get_expiring_infractions,
+                                   get_infraction_counts, prefetch_infractions,
                                    remove_infraction)
 from bot.utils.scheduling import Scheduler
 
@@ -25,28 +28,120 @@ log = logging.getLogger(__name__)
 
 
 class InfractionScheduler(Scheduler):
+    """
+    Applies, pardons and expires infractions.
+
+    Infraction IDs are only unique within a database, so the expirations are scheduled with
+    `(guild ID, infraction ID)` as their task ID and lifted in the guild of their database.
+    """
+
     def __init__(self, bot: Bot):
         super().__init__()
 
         self.bot = bot
-        self.bot.loop.create_task(self.reschedule_infractions())
+        # Expirations up to this time are scheduled in memory, the later ones are only in the database
+        self._loaded_until = datetime.min
+        self.load_expirations.start()
+
+        # Expired infractions waiting to be expired together by guild ID, see `_scheduled_task`
+        self._expired: t.Dict[int, t.List[Infraction]] = {}
+        self._expire_task: t.Optional[asyncio.Task] = None
+        # Batches are expired one after another, so they never pardon the same infractions at once
+        self._expire_lock = asyncio.Lock()
+
+    def cog_unload(self) -> None:
+        """Stop loading expirations and unschedule the loaded ones."""
+        self.load_expirations.cancel()
+        self.cancel_all()
+        if self._expire_task is not None:
+            self._expire_task.cancel()
+
+    def _is_waiting(self, guild_id: int, infraction_id: int) -> bool:
+        """Whether the infraction already fell due and waits to be expired with its batch"""
+        return any(infraction.id == infraction_id for infraction in self._expired.get(guild_id, []))
+
+    def schedule_task(self, task_id: t.Tuple[int, int], task_data: t.Any, at: t.Optional[datetime] = None) -> None:
+        """Schedule the expiration of the infraction `task_id`, unless it's already waiting for its batch."""
+        if self._is_waiting(*task_id):
+            log.debug(f"{self.cog_name}: did not schedule task #{task_id}; it's waiting for its batch.")
+            return
+
+        super().schedule_task(task_id, task_data, at)
+
+    def cancel_task(self, task_id: t.Tuple[int, int], ignore_missing: bool = False) -> None:
+        """Unschedule the expiration of the infraction `task_id`, including one waiting for its batch."""
+        guild_id, infraction_id = task_id
+        if self._is_waiting(guild_id, infraction_id):
+            self._expired[guild_id] = [
+                infraction for infraction in self._expired[guild_id] if infraction.id != infraction_id
+            ]
+            log.debug(f"{self.cog_name}: unscheduled expired task #{task_id} waiting for its batch.")
+            return
+
+        super().cancel_task(task_id, ignore_missing)
 
     def mod_log(self) -> ModLog:
         """Get the currently loaded ModLog cog instance"""
         return self.bot.get_cog("ModLog")
 
-    async def reschedule_infractions(self) -> None:
-        """Schedule expiration for previous infractions."""
-        await self.bot.wait_until_guild_available()
+    @Cog.listener()
+    async def on_leadership_acquired(self) -> None:
+        """Take the expirations over from the previous leader right away, instead of at the next refill."""
+        # The previous leader may have changed the infractions since this instance last led
+        for db in self.bot.databases.databases:
+            clear_caches(db)
+        if self.load_expirations.is_running():
+            self.load_expirations.restart()
+
+    @Cog.listener()
+    async def on_leadership_lost(self) -> None:
+        """Leave the expirations to the new leader."""
+        self.cancel_all()
+        self._loaded_until = datetime.min
+        # A batch which is already being expired is finished, the waiting ones are dropped
+        self._expired.clear()
+        if self._expire_task is not None:
+            self._expire_task.cancel()
+            self._expire_task = None
+
+    @tasks.loop(hours=Scheduling.refill_interval)
+    async def load_expirations(self) -> None:
+        """Schedule the expirations due within the horizon, the later ones are left to the next refills."""
+        # Standbys don't expire anything, they load the expirations once they become the leader
+        if not self.bot.is_leader:
+            return
 
-        log.debug("Rescheduling infractions")
+        previous = self._loaded_until
+        until = datetime.now() + timedelta(hours=Scheduling.horizon)
+        # Moved before the query, so an infraction applied while it runs is scheduled by `apply_infraction`
+        # if the query misses it. Already scheduled infractions are skipped by `schedule_task`.
+        self._loaded_until = until
+
+        try:
+            # Permanent and instant infractions have no expiry, so they aren't included
+            infractions = [
+                (guild_id, infraction)
+                for guild_id, db in (await self.bot.get_guild_dbs()).items()
+                for infraction in await get_expiring_infractions(db, before=until)
+            ]
+        except Exception:
+            self._loaded_until = previous
+            log.exception("Failed to load the infraction expirations")
+            return
 
-        infractions = get_all_active_infractions()
+        # The lease may have been lost during the query, the new leader loads the expirations itself
+        if not self.bot.is_leader:
+            self._loaded_until = previous
+            return
 
-        for infraction in infractions:
-            # Do not schedule abort on permanent/instant infractions
-            if not (infraction.duration == 1_000_000_000 or infraction.duration == 0):
-                self.schedule_task(infraction.id, infraction)
+        for guild_id, infraction in infractions:
+            self.schedule_task((guild_id, infraction.id), (guild_id, infraction), at=infraction.stop)
+        log.debug(f"Loaded {len(infractions)} infraction expirations due before {until}")
+
+    @load_expirations.before_loop
+    async def before_load_expirations(self) -> None:
+        """Only schedule expirations once the guild is available"""
+        await self.bot.wait_until_guild_available()
 
     async def apply_infraction(
         self,
@@ -104,16 +199,21 @@ class InfractionScheduler(Scheduler):
         if ctx.channel.id not in STAFF_CHANNELS:
             end_msg = ""
         else:
-            total = len(get_infractions(user))
+            db = await self.bot.get_db(ctx.guild.id)
+            total = sum((await get_infraction_counts(db, user)).values())
             end_msg = f"({total} infraction{ngettext('', 's', total)} total)"
 
         # Execute necessary actions to apply the infraction on Discord
         if action_coro:
             try:
                 await action_coro
-                # Do not schedule abort on permanent/instant infractions
+                # Do not schedule abort on permanent/instant infractions, nor on those beyond the loaded horizon,
+                # which are picked up by `load_expirations` later
                 if not (infraction.duration == 1_000_000_000 or infraction.duration == 0):
-                    self.schedule_task(infraction.id, infraction)
+                    if infraction.stop <= self._loaded_until:
+                        self.schedule_task(
+                            (ctx.guild.id, infraction.id), (ctx.guild.id, infraction), at=infraction.stop
+                        )
             except discord.HTTPException as e:
                 confirm_msg = f"{Emojis.cross_mark} (Failed to apply) User {user.mention} haven't been"
                 expiry_msg = ""
@@ -159,7 +259,7 @@ class InfractionScheduler(Scheduler):
                 await ctx.send(f"{Emojis.cross_mark} This infraction is not active")
             return False
 
-        log_text = await self.deactivate_infraction(infraction, send_log=False)
+        log_text = await self.deactivate_infraction(infraction, send_log=False, guild=ctx.guild)
 
         log_text["Pardoned"] = str(ctx.message.author)
         log_content = None
@@ -168,7 +268,8 @@ class InfractionScheduler(Scheduler):
         user = await self.bot.fetch_user(infraction.user_id)
 
         # If multiple active infractions with shorter end_time were found, get their IDs
-        infractions = get_active_infractions(user, inf_type=infraction.type)
+        db = await self.bot.get_db(ctx.guild.id)
+        infractions = await get_active_infractions(db, user, inf_type=infraction.type)
         ids = []
         for inf in infractions:
             if inf.stop <= infraction.stop:
@@ -220,15 +321,32 @@ class InfractionScheduler(Scheduler):
                 content=log_content
             )
 
+    async def _fetch_user(self, user_id: int, users: t.Optional[t.Dict[int, asyncio.Future]] = None) -> discord.User:
+        """Fetch a user, sharing a single request between all the lookups of the user in `users`"""
+        if users is None:
+            return await self.bot.fetch_user(user_id)
+        if user_id not in users:
+            users[user_id] = asyncio.ensure_future(self.bot.fetch_user(user_id))
+        return await users[user_id]
+
     async def deactivate_infraction(
         self,
         infraction: Infraction,
-        send_log: bool = True
+        send_log: bool = True,
+        users: t.Optional[t.Dict[int, asyncio.Future]] = None,
+        guild: t.Optional[discord.Guild] = None
     ) -> t.Dict[str, str]:
-        """Deactivate an active infraction and return a dictionary of lines to send in a mod log"""
+        """
+        Deactivate an active infraction and return a dictionary of lines to send in a mod log
+
+        Users are fetched through `users`, so the deactivations of a batch share their lookups. The
+        infraction is looked up in the database of `guild`, which defaults to the home guild.
+        """
 
-        guild = self.bot.get_guild(constants.Guild.id)
-        staff_role = guild.get_role(constants.Roles.staff)
+        home_guild = self.bot.get_guild(constants.Guild.id)
+        guild = guild or home_guild
+        db = await self.bot.get_db(guild.id)
+        staff_role = home_guild.get_role(constants.Roles.staff)
         user_id = infraction.user_id
         actor = infraction.actor_id
         type_ = infraction.type
@@ -249,7 +367,7 @@ class InfractionScheduler(Scheduler):
 
         log.info(f"Marking infraction #{id_} as inactive (expired)")
 
-        actor_usr = await self.bot.fetch_user(actor)
+        actor_usr = await self._fetch_user(actor, users)
         actor = actor_usr if actor_usr is not None else actor
         log_content = None
         log_text = {
@@ -261,16 +379,16 @@ class InfractionScheduler(Scheduler):
 
         footer = f"ID: {id_}"
 
-        user = await self.bot.fetch_user(user_id)
+        user = await self._fetch_user(user_id, users)
 
-        infractions = get_active_infractions(user, inf_type=type_)
+        infractions = await get_active_infractions(db, user, inf_type=type_)
 
         # Abort pardon action if there is another infraction which is longer
         longest_infraction = max(infractions, key=lambda o: o.stop)
         if longest_infraction.duration <= infraction.duration:
             try:
                 # Get the pardon coroutine for this specific infraction
-                returned_log = await self._pardon_action(infraction)
+                returned_log = await self._pardon_action(infraction, guild)
 
                 if returned_log is not None:
                     # Merge the dicts from pardon action and existing log text
@@ -295,15 +413,16 @@ class InfractionScheduler(Scheduler):
             log_text["Note"] = "Infraction not pardoned: There are longer infractions"
 
         # If multiple active infractions with shorter end_time were found, mark them as inactive in the database
-        # and cancel their expiration tasks.
+        # and cancel their expiration tasks. The updates are queued, so they all end up in a single commit.
         ids = []
         for inf in infractions:
             if inf.stop <= infraction.stop:
                 # Check if duration can be deactivated (is not permanent)
                 # In case it is permanent, check if current infraction is also permanent, if yes, continue anyway
                 if not ((inf.duration == 1_000_000_000 and infraction.duration != 1_000_000_000) or inf.duration == 0):
-                    inf.make_inactive()
-                    self.cancel_task(inf.id)
+                    inf.make_inactive(db)
+                    # Infractions beyond the loaded horizon have no task yet
+                    self.cancel_task((guild.id, inf.id), ignore_missing=True)
                     ids.append(str(inf.id))
 
         if len(ids) > 1:
@@ -344,7 +463,7 @@ class InfractionScheduler(Scheduler):
         # Try to pardon it first
         log_text = await self.pardon_infraction(ctx, infraction, send_log=False)
 
-        remove_infraction(infraction)
+        await remove_infraction(await self.bot.get_db(ctx.guild.id), infraction)
 
         log_title = "Removed and Pardoned"
 
@@ -382,23 +501,123 @@ class InfractionScheduler(Scheduler):
         )
 
     @abstractmethod
-    async def _pardon_action(self, infraction: Infraction) -> t.Optional[t.Dict[str, str]]:
+    async def _pardon_action(self, infraction: Infraction, guild: discord.Guild) -> t.Optional[t.Dict[str, str]]:
         """
-        Execute deactivation steps specific to the infraction's type and return a log dict.
+        Execute deactivation steps specific to the infraction's type in `guild` and return a log dict.
 
         If an infraction type is unsupported, return None instead.
         """
         raise NotImplementedError
 
-    async def _scheduled_task(self, infraction: Infraction) -> None:
+    async def _scheduled_task(self, task: t.Tuple[int, Infraction]) -> None:
         """
-        Marks an infraction expired after the delay from time of scheduling to time of expiration.
+        Queue an infraction for expiration in the guild with given ID, this is started at the time of its expiration.
 
-        At the time of expiration, the infraction is marked as inactive on the website and the
-        expiration task is cancelled.
+        Infractions falling due within `Scheduling.batch_window` seconds of each other are expired together.
         """
-        await time.wait_until(infraction.stop)
+        guild_id, infraction = task
+        if self._is_waiting(guild_id, infraction.id):
+            return
+        self._expired.setdefault(guild_id, []).append(infraction)
+        if self._expire_task is None:
+            self._expire_task = asyncio.create_task(self._expire_later())
+
+    async def _expire_later(self) -> None:
+        await asyncio.sleep(Scheduling.batch_window)
+        expired, self._expired = self._expired, {}
+        self._expire_task = None
+
+        async with self._expire_lock:
+            for guild_id, infractions in expired.items():
+                guild = self.bot.get_guild(guild_id)
+                # The expirations don't fail as tasks, so they're counted here
+                if guild is None:
+                    self.failures += len(infractions)
+                    log.warning(f"Failed to expire {len(infractions)} infractions of unavailable guild {guild_id}")
+                    continue
+                try:
+                    await self.expire_infractions(infractions, guild)
+                except Exception:
+                    self.failures += len(infractions)
+                    log.exception(f"Failed to expire {len(infractions)} infractions of guild {guild_id}")
+
+    async def expire_infractions(self, infractions: t.List[Infraction], guild: t.Optional[discord.Guild] = None) -> None:
+        """
+        Deactivate a batch of expired infractions of `guild` and summarize them in a single mod log entry.
 
-        # Because deactivate_infraction() explicitly cancels this scheduled task, it is shielded
-        # to avoid prematurely cancelling itself.
-        await asyncio.shield(self.deactivate_infraction(infraction))
+        Of the expired infractions of a user with the same type, only the longest one is deactivated,
+        which deactivates the shorter ones as well. The infractions of all of the users are loaded
+        together, every user is fetched only once and at most `Scheduling.expire_concurrency`
+        infractions are deactivated at once. A single infraction gets the usual mod log entry. Infractions
+        which are no longer active, e.g. pardoned by another instance, are skipped.
+        """
+        if not infractions:
+            return
+
+        guild = guild or self.bot.get_guild(constants.Guild.id)
+        db = await self.bot.get_db(guild.id)
+        # Infractions pardoned since they were loaded are skipped, their pending updates are committed first
+        await db.flush()
+        await prefetch_infractions(db, (infraction.user_id for infraction in infractions))
+        active = set()
+        for user_id in {infraction.user_id for infraction in infractions}:
+            active.update(infraction.id for infraction in await get_active_infractions(db, discord.Object(user_id)))
+        infractions = [infraction for infraction in infractions if infraction.id in active]
+
+        if not infractions:
+            return
+        if len(infractions) == 1:
+            log_text = await self.deactivate_infraction(infractions[0], guild=guild)
+            if log_text and "Failure" in log_text:
+                self.failures += 1
+            return
+
+        longest = {}
+        for infraction in infractions:
+            key = (infraction.user_id, infraction.type)
+            if key not in longest or longest[key].stop < infraction.stop:
+                longest[key] = infraction
+
+        users = {}
+        semaphore = asyncio.Semaphore(Scheduling.expire_concurrency)
+
+        async def deactivate(infraction: Infraction) -> t.Optional[t.Dict[str, str]]:
+            async with semaphore:
+                try:
+                    return await self.deactivate_infraction(infraction, send_log=False, users=users, guild=guild)
+                except Exception:
+                    log.exception(f"Failed to deactivate infraction #{infraction.id} ({infraction.type})")
+                    return {"Failure": "Unexpected error, check the logs"}
+
+        results = await asyncio.gather(*(deactivate(infraction) for infraction in longest.values()))
+        failures = {key: log_text["Failure"] for key, log_text in zip(longest, results) if log_text and "Failure" in log_text}
+        self.failures += len(failures)
+
+        lines = []
+        for infraction in sorted(infractions, key=lambda infraction: infraction.id):
+            line = f"#{infraction.id} {infraction.type} of <@{infraction.user_id}>"
+            failure = failures.get((infraction.user_id, infraction.type))
+            if failure:
+                line += f" (failed: {failure})"
+            lines.append(line)
+
+        # Embed descriptions are limited to 2048 characters, the footer still lists all of the IDs
+        text = ""
+        for shown, line in enumerate(lines):
+            if len(text) + len(line) > 1900:
+                text += f"... and {len(lines) - shown} more"
+                break
+            text += f"{line}\n"
+
+        home_guild = self.bot.get_guild(constants.Guild.id)
+        await self.mod_log.send_log_message(
+            icon_url=utils.INFRACTION_ICONS[infractions[0].type][1],
+            colour=Colours.soft_red if failures else Colours.soft_green,
+            title=f"Infractions expired: {len(infractions)}",
+            text=text,
+            footer=textwrap.shorten(
+                f"Infraction IDs: {', '.join(str(infraction.id) for infraction in infractions)}", width=2000, placeholder="..."
+            ),
+            content=home_guild.get_role(constants.Roles.staff).mention if failures else None
+        )
+        log.info(f"Expired {len(infractions)} infractions, {len(failures)} deactivations failed")
@@ -1,11 +1,15 @@
 import asyncio
 import logging
-from typing import Optional, NamedTuple
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Optional, Tuple
 
-from discord import TextChannel
+import discord
+from discord import Member, TextChannel
 from discord.ext import commands
 from discord.ext.commands import Context
 
+from bot.actions import Priority, current_priority
 from bot.bot import Bot
 from bot.cogs.moderation.modlog import ModLog
 from bot.constants import (STAFF_ROLES, Channels, Colours, Emojis, Guild,
@@ -13,17 +17,11 @@ from bot.constants import (STAFF_ROLES, Channels, Colours, Emojis, Guild,
 from bot.converters import SilenceDurationConverter
 from bot.utils.checks import with_role_check
 from bot.utils.scheduling import Scheduler
+from bot.utils.silences import add_silence, get_expiring_silences, remove_silence
 
 log = logging.getLogger(__name__)
 
 
-class TaskData(NamedTuple):
-    """Data for a scheduled task."""
-
-    delay: int
-    ctx: Context
-
-
 class Silence(Scheduler, commands.Cog):
     """Commands for stopping channel messages for `Guest` role in a channel."""
 
@@ -47,14 +45,46 @@ class Silence(Scheduler, commands.Cog):
         self._mod_log_channel = self.bot.get_channel(Channels.mod_log)
         self._get_instance_vars_event.set()
 
-    async def _scheduled_task(self, task: TaskData) -> None:
-        """Calls `self.unsilence` on expired silenced channel to unsilence it."""
-        await asyncio.sleep(task.delay)
-        log.info("Unsilencing channel after set delay.")
+        if self.bot.is_leader:
+            await self._load_silences()
+
+    async def _load_silences(self) -> None:
+        """Schedule the silences stored in the databases, which were started before the bot (re)started."""
+        for guild_id, db in (await self.bot.get_guild_dbs()).items():
+            for silence in await get_expiring_silences(db):
+                self.schedule_task(silence.channel_id, (guild_id, silence.channel_id), at=silence.expiry)
+
+    @commands.Cog.listener()
+    async def on_leadership_acquired(self) -> None:
+        """Take the silences over from the previous leader."""
+        # Until the guild is available, `_get_instance_vars` loads them
+        if self._get_instance_vars_event.is_set():
+            await self._load_silences()
+
+    @commands.Cog.listener()
+    async def on_leadership_lost(self) -> None:
+        """Leave lifting the silences to the new leader."""
+        self.cancel_all()
+
+    async def _scheduled_task(self, task: Tuple[int, int]) -> None:
+        """Unsilence the channel with given ID, of the guild with given ID, once its silence expired."""
+        guild_id, channel_id = task
+        log.info(f"Unsilencing channel {channel_id} after set delay.")
+
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            log.info(f"Silenced channel {channel_id} no longer exists, forgetting its silence.")
+            await remove_silence(await self.bot.get_db(guild_id), channel_id)
+            return
 
-        # Because `self.unsilence` explicitly cancels this scheduled task, it is shielded
+        # Because `self._unsilence` explicitly cancels this scheduled task, it is shielded
         # to avoid prematurely cancelling itself
-        await asyncio.shield(task.ctx.invoke(self.unsilence))
+        await asyncio.shield(self._unsilence_expired(channel))
+
+    async def _unsilence_expired(self, channel: TextChannel) -> None:
+        if await self._unsilence(channel):
+            await channel.send(f"{Emojis.check_mark} unsilenced current channel.")
+            await self._send_unsilence_log(channel, self.bot.user)
 
     @commands.command(aliases=("hush", "mutechat"))
     async def silence(self, ctx: Context, duration: SilenceDurationConverter = 10) -> None:
@@ -72,7 +102,7 @@ class Silence(Scheduler, commands.Cog):
         await self._get_instance_vars_event.wait()
         log.debug(f"{ctx.author} is silencing channel #{ctx.channel}")
 
-        if not await self._silence(ctx.channel, duration=duration):
+        if not await self._silence(ctx.channel, ctx.author, duration=duration):
             await ctx.send(f"{Emojis.cross_mark} current channel is already silenced.")
             return
 
@@ -94,12 +124,7 @@ class Silence(Scheduler, commands.Cog):
             return
         await ctx.send(f"{Emojis.check_mark} silenced current channel for {duration} minute(s).")
 
-        task_data = TaskData(
-            delay=duration*60,
-            ctx=ctx
-        )
-
-        self.schedule_task(ctx.channel.id, task_data)
+        self.schedule_task(ctx.channel.id, (ctx.guild.id, ctx.channel.id), at=datetime.now() + timedelta(minutes=duration))
 
     @commands.command(aliases=("unhush", "unmutechat"))
     async def unsilence(self, ctx: Context) -> None:
@@ -119,11 +144,13 @@ class Silence(Scheduler, commands.Cog):
             return
 
         await ctx.send(f"{Emojis.check_mark} unsilenced current channel.")
+        await self._send_unsilence_log(ctx.channel, ctx.author)
 
-        # Log this to #mod_log channel
+    async def _send_unsilence_log(self, channel: TextChannel, actor: discord.abc.User) -> None:
+        """Log the unsilence of `channel` to #mod_log channel"""
         response = (
-            f"**Channel:** {ctx.channel.mention} (`{ctx.channel.id}`)\n"
-            f"**Actor:** {ctx.author.mention} (`{ctx.author.mention}`)\n"
+            f"**Channel:** {channel.mention} (`{channel.id}`)\n"
+            f"**Actor:** {actor.mention} (`{actor.mention}`)\n"
         )
         await self.mod_log.send_log_message(
             Icons.message_edit, Colours.soft_green,
@@ -132,14 +159,18 @@ class Silence(Scheduler, commands.Cog):
             channel_id=Channels.mod_log
         )
 
-    async def _silence(self, channel: TextChannel, duration: Optional[int]) -> bool:
-        """Silence `channel` for `self._guests_role`"""
+    async def _silence(self, channel: TextChannel, actor: Member, duration: Optional[int]) -> bool:
+        """Silence `channel` for `self._guests_role` and store the silence, so it's lifted even after a restart"""
         current_overwrite = channel.overwrites_for(self._guests_role)
         if current_overwrite.send_messages is False:
             log.info(f"Tried to silence channel #{channel} ({channel.id}) but the channel was already silenced.")
             return False
 
-        await channel.set_permissions(self._guests_role, **dict(current_overwrite, send_messages=False))
+        await self.bot.actions.run("permissions", channel.id, partial(
+            channel.set_permissions, self._guests_role, **dict(current_overwrite, send_messages=False)
+        ))
+        expiry = datetime.now() + timedelta(minutes=duration) if duration else None
+        await add_silence(await self.bot.get_db(channel.guild.id), channel.id, actor.id, expiry)
 
         if duration:
             log.info(f"Silenced #{channel} ({channel.id}) for {duration} minute(s).")
@@ -154,15 +185,27 @@ class Silence(Scheduler, commands.Cog):
         Check if `channel` is silenced through `PermissionOverwrite`, if it is, unsilence it.
         Return `True` if channel permissions were changed, `False` otherwise
         """
+        db = await self.bot.get_db(channel.guild.id)
         current_overwrite = channel.overwrites_for(self._guests_role)
         if current_overwrite.send_messages is False:
-            await channel.set_permissions(self._guests_role, **dict(current_overwrite, send_messages=None))
+            await self.bot.actions.run("permissions", channel.id, partial(
+                channel.set_permissions, self._guests_role, **dict(current_overwrite, send_messages=None)
+            ))
+            # Only forgotten once lifted, so a silence which failed to be lifted is lifted after the next restart
+            await remove_silence(db, channel.id)
             log.info(f"Unsilenced channel #{channel} ({channel.id}).")
             self.cancel_task(channel.id)
             return True
+
+        # The overwrite might have been removed by hand
+        await remove_silence(db, channel.id)
         log.info(f"Tried to unsilence channel ${channel} ({channel.id}) but the channel was not silenced.")
         return False
 
+    async def cog_before_invoke(self, ctx: Context) -> None:
+        """Give the Discord actions of the staff commands priority over the automatic ones."""
+        current_priority.set(Priority.STAFF)
+
     def cog_check(self, ctx: Context) -> bool:
         """Only allow moderators to invoke the commands in this cog."""
         return with_role_check(ctx, *STAFF_ROLES)
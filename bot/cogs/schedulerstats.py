@@ -0,0 +1,73 @@
+import typing as t
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+from discord import Colour, Embed
+from discord.ext.commands import Cog, Context, command
+
+from bot.bot import Bot
+from bot.cogs.dbstats import format_bound
+from bot.constants import STAFF_ROLES
+from bot.decorators import with_role
+from bot.utils.infractions import count_overdue_infractions
+from bot.utils.scheduling import LATE_THRESHOLD, SchedulerMetrics, get_schedulers
+from bot.utils.time import humanize_delta, wait_lag
+
+
+def format_next_due(next_due: t.Optional[datetime], now: datetime) -> str:
+    if next_due is None:
+        return "nothing"
+    delta = humanize_delta(abs(relativedelta(next_due, now)), max_units=2)
+    return f"in {delta}" if next_due >= now else f"**overdue by {delta}**"
+
+
+def format_metrics(metrics: SchedulerMetrics, now: datetime) -> str:
+    lag = metrics.lag
+    lines = [
+        f"**{metrics.name}**",
+        f"{metrics.pending} pending, {metrics.running} running, next due {format_next_due(metrics.next_due, now)}",
+        f"{metrics.failures} failed, clock drift {metrics.drift:+.2f}s",
+    ]
+    if lag.calls:
+        lines.append(
+            f"{lag.calls} started, lag avg {lag.average:.0f}ms, p95 ≤ {format_bound(lag.percentile(95))}, max {lag.max:.0f}ms"
+        )
+    return "\n".join(lines)
+
+
+class SchedulerStats(Cog):
+    """Health of the task schedulers"""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+
+    @command(name="scheduler", aliases=["schedulerstats"])
+    @with_role(*STAFF_ROLES)
+    async def scheduler_command(self, ctx: Context) -> None:
+        """Show the pending tasks of every scheduler, how late they were started and how many of them failed"""
+        now = datetime.now()
+        sections = [format_metrics(scheduler.metrics(), now) for scheduler in get_schedulers()]
+        if wait_lag.calls:
+            sections.append(
+                f"**wait_until**\n{wait_lag.calls} waits, lag avg {wait_lag.average:.0f}ms, "
+                f"p95 ≤ {format_bound(wait_lag.percentile(95))}, max {wait_lag.max:.0f}ms"
+            )
+
+        # Expirations which should have been lifted a while ago, but are still active in any of the databases
+        overdue = 0
+        for db in self.bot.databases.databases:
+            overdue += await count_overdue_infractions(db, now - timedelta(seconds=LATE_THRESHOLD))
+        queued = self.bot.actions.queued()
+        sections.append("\n".join((
+            f"**Instance:** `{self.bot.lease.holder}`, " + ("leader" if self.bot.is_leader else "standby"),
+            f"**Overdue infractions:** {overdue}",
+            "**Queued actions:** " + ", ".join(f"{count} {priority.name.lower()}" for priority, count in queued.items()),
+        )))
+
+        colour = Colour.red() if overdue else Colour.blurple()
+        await ctx.send(embed=Embed(title="Schedulers", description="\n\n".join(sections), colour=colour))
+
+
+def setup(bot: Bot) -> None:
+    """Load the SchedulerStats cog."""
+    bot.add_cog(SchedulerStats(bot))
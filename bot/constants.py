@@ -3,7 +3,7 @@ import os
 from collections.abc import Mapping
 from enum import Enum
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Union
 
 import yaml
 
@@ -212,6 +212,44 @@ class Database(metaclass=YAMLGetter):
     section = "database"
 
     db_name: str
+    flush_interval: float
+    read_connections: int
+    user_cache_size: int
+    pragmas: Dict[str, Union[str, int]]
+    slow_query_ms: float
+
+    shard_by_guild: bool
+    shard_dir: str
+
+    backup_dir: str
+    backup_interval: float
+    backup_count: int
+    backup_pages: int
+    backup_step_sleep: float
+
+
+class Scheduling(metaclass=YAMLGetter):
+    section = "scheduling"
+
+    horizon: float
+    refill_interval: float
+    batch_window: float
+    expire_concurrency: int
+
+
+class Actions(metaclass=YAMLGetter):
+    section = "actions"
+
+    rate: int
+    per: float
+    routes: Dict[str, Dict[str, float]]
+
+
+class Leadership(metaclass=YAMLGetter):
+    section = "leadership"
+
+    lease_duration: float
+    heartbeat_interval: float
 
 
 class AntiSpam(metaclass=YAMLGetter):
@@ -207,6 +207,22 @@ class ISODelta(Converter):
         return seconds
 
 
+class InfractionType(Converter):
+    """Convert the name of an infraction type, optionally in plural, into the type stored in the database."""
+
+    async def convert(self, ctx: Context, argument: str) -> str:
+        """Raise BadArgument if `argument` isn't one of the known infraction types."""
+        # Imported here, importing the moderation package on module level would be circular
+        from bot.cogs.moderation.utils import INFRACTION_ICONS
+
+        inf_type = argument.lower()
+        if inf_type not in INFRACTION_ICONS and inf_type.endswith("s"):
+            inf_type = inf_type[:-1]
+        if inf_type not in INFRACTION_ICONS:
+            raise BadArgument(f"`{argument}` is not an infraction type.")
+        return inf_type
+
+
 class FetchedUser(UserConverter):
     """
     Converts to a 'discord.User' or, if it fails a 'discord.Object'
@@ -1,40 +1,796 @@
-
+import asyncio
 import logging
+import re
 import sqlite3 as lite
+import sys
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
 
-from bot.constants import Database
+from bot.constants import Database, Guild
+from bot.utils.stats import Histogram
 
 log = logging.getLogger(__name__)
 
+RowFactory = t.Callable[[lite.Cursor, tuple], t.Any]
+
+
+def _longest_active(user: str, inf_type: str) -> str:
+    """SQL expression selecting the ID of the longest active infraction of given type of `user` (an SQL expression)"""
+    # Permanent infractions have no expiry and outlast everything else
+    return f"""(SELECT ID FROM infractions WHERE UID={user} AND Active=1 AND Type='{inf_type}'
+                ORDER BY Expiry IS NULL DESC, Expiry DESC, ID DESC LIMIT 1)"""
+
+
+def _refresh_user_state(user: str) -> str:
+    """SQL statements recomputing the `users` row of `user` (an SQL expression) from the active infractions"""
+    return f"""INSERT OR REPLACE INTO users(UID, Muted, Banned)
+                VALUES({user}, {_longest_active(user, "mute")}, {_longest_active(user, "ban")});
+            DELETE FROM users WHERE UID={user} AND Muted IS NULL AND Banned IS NULL;"""
+
+
+# Ordered schema migrations, the position in this list (starting at 1) is the schema version.
+# Released migrations (and the helpers above which they use) must never be changed,
+# schema changes are always added as a new migration.
+MIGRATIONS: t.List[t.Tuple[str, t.Tuple[str, ...]]] = [
+    (
+        "Create initial tables",
+        (
+            """CREATE TABLE IF NOT EXISTS infractions(
+                UID INTEGER,
+                Type TEXT,
+                Reason TEXT,
+                ActorID INTEGER,
+                Start TEXT,
+                Duration INTEGER,
+                Active INTEGER
+            );""",
+            """CREATE TABLE IF NOT EXISTS users(
+                UID INTEGER,
+                Muted INTEGER,
+                Banned INTEGER
+            );""",
+        )
+    ),
+    (
+        "Index infractions by user, active state and type",
+        ("CREATE INDEX IF NOT EXISTS ix_infractions_user ON infractions(UID, Active, Type);", )
+    ),
+    (
+        "Index infractions by active state and type",
+        ("CREATE INDEX IF NOT EXISTS ix_infractions_active ON infractions(Active, Type);", )
+    ),
+    (
+        "Store infraction start as epoch seconds, add an indexed expiry column",
+        (
+            "ALTER TABLE infractions RENAME TO infractions_old;",
+            """CREATE TABLE infractions(
+                UID INTEGER,
+                Type TEXT,
+                Reason TEXT,
+                ActorID INTEGER,
+                Start INTEGER,
+                Duration INTEGER,
+                Active INTEGER,
+                Expiry INTEGER
+            );""",
+            # Start used to be local time formatted with '%Y/%m/%d %H:%M:%S', the rowids are kept since they are the IDs
+            """INSERT INTO infractions(rowid, UID, Type, Reason, ActorID, Start, Duration, Active)
+                SELECT rowid, UID, Type, Reason, ActorID,
+                    CAST(strftime('%s', replace(Start, '/', '-'), 'utc') AS INTEGER), Duration, Active
+                FROM infractions_old;""",
+            # Permanent and instant infractions never expire, their expiry is left NULL
+            "UPDATE infractions SET Expiry = Start + Duration WHERE Duration NOT IN (0, 1000000000);",
+            "DROP TABLE infractions_old;",
+            "CREATE INDEX ix_infractions_user ON infractions(UID, Active, Type);",
+            "CREATE INDEX ix_infractions_active ON infractions(Active, Type);",
+            "CREATE INDEX ix_infractions_expiry ON infractions(Active, Expiry);",
+        )
+    ),
+    (
+        "Index infractions by user alone, for paging through them in ID order",
+        ("CREATE INDEX IF NOT EXISTS ix_infractions_user_id ON infractions(UID);", )
+    ),
+    (
+        "Partition infractions into a table of active ones and an archive of inactive ones",
+        (
+            "ALTER TABLE infractions RENAME TO infractions_old;",
+            # AUTOINCREMENT makes sure that IDs of archived infractions are never given out again
+            """CREATE TABLE infractions(
+                UID INTEGER,
+                Type TEXT,
+                Reason TEXT,
+                ActorID INTEGER,
+                Start INTEGER,
+                Duration INTEGER,
+                Active INTEGER,
+                Expiry INTEGER,
+                ID INTEGER PRIMARY KEY AUTOINCREMENT
+            );""",
+            """CREATE TABLE infractions_archive(
+                UID INTEGER,
+                Type TEXT,
+                Reason TEXT,
+                ActorID INTEGER,
+                Start INTEGER,
+                Duration INTEGER,
+                Active INTEGER,
+                Expiry INTEGER,
+                ID INTEGER PRIMARY KEY
+            );""",
+            # Everything is copied into the active table first, so that the ID sequence starts after the highest ID
+            """INSERT INTO infractions(UID, Type, Reason, ActorID, Start, Duration, Active, Expiry, ID)
+                SELECT UID, Type, Reason, ActorID, Start, Duration, Active, Expiry, rowid FROM infractions_old;""",
+            "INSERT INTO infractions_archive SELECT * FROM infractions WHERE Active=0;",
+            "DELETE FROM infractions WHERE Active=0;",
+            "DROP TABLE infractions_old;",
+            "CREATE INDEX ix_infractions_user ON infractions(UID, Active, Type);",
+            "CREATE INDEX ix_infractions_active ON infractions(Active, Type);",
+            "CREATE INDEX ix_infractions_expiry ON infractions(Active, Expiry);",
+            "CREATE INDEX ix_infractions_user_id ON infractions(UID);",
+            "CREATE INDEX ix_infractions_archive_user ON infractions_archive(UID);",
+            # Inactive infractions are moved into the archive as soon as they are inserted or deactivated
+            """CREATE TRIGGER tr_infractions_archive_inserted AFTER INSERT ON infractions WHEN NEW.Active=0
+            BEGIN
+                INSERT INTO infractions_archive SELECT * FROM infractions WHERE ID=NEW.ID;
+                DELETE FROM infractions WHERE ID=NEW.ID;
+            END;""",
+            """CREATE TRIGGER tr_infractions_archive_deactivated AFTER UPDATE OF Active ON infractions WHEN NEW.Active=0
+            BEGIN
+                INSERT INTO infractions_archive SELECT * FROM infractions WHERE ID=NEW.ID;
+                DELETE FROM infractions WHERE ID=NEW.ID;
+            END;""",
+            # All infractions regardless of their state, for history lookups
+            "CREATE VIEW all_infractions AS SELECT * FROM infractions UNION ALL SELECT * FROM infractions_archive;",
+        )
+    ),
+    (
+        "Keep the users table up to date with the longest active mute and ban of every user",
+        (
+            # Nothing used the table before, its rows are rebuilt from the active infractions
+            "DROP TABLE users;",
+            """CREATE TABLE users(
+                UID INTEGER PRIMARY KEY,
+                Muted INTEGER,
+                Banned INTEGER
+            );""",
+            f"""INSERT INTO users(UID, Muted, Banned)
+                SELECT UID, {_longest_active("active_users.UID", "mute")}, {_longest_active("active_users.UID", "ban")}
+                FROM (SELECT DISTINCT UID FROM infractions WHERE Active=1 AND Type IN ('mute', 'ban')) AS active_users;""",
+            # Deactivated infractions are deleted from this table by the archiving triggers, so this covers them too
+            f"""CREATE TRIGGER tr_users_infraction_added AFTER INSERT ON infractions
+                WHEN NEW.Active=1 AND NEW.Type IN ('mute', 'ban')
+            BEGIN
+                {_refresh_user_state("NEW.UID")}
+            END;""",
+            f"""CREATE TRIGGER tr_users_infraction_removed AFTER DELETE ON infractions
+                WHEN OLD.Type IN ('mute', 'ban')
+            BEGIN
+                {_refresh_user_state("OLD.UID")}
+            END;""",
+        )
+    ),
+    (
+        "Add a full-text index of infraction reasons",
+        (
+            # Type and Start aren't tokenized, they are only stored to filter the matches without a join
+            "CREATE VIRTUAL TABLE infractions_fts USING fts5(Reason, Type UNINDEXED, Start UNINDEXED);",
+            """INSERT INTO infractions_fts(rowid, Reason, Type, Start)
+                SELECT ID, Reason, Type, Start FROM all_infractions;""",
+            # Every infraction is inserted into the active table first, even if it's archived right away
+            """CREATE TRIGGER tr_infractions_fts_inserted AFTER INSERT ON infractions
+            BEGIN
+                INSERT INTO infractions_fts(rowid, Reason, Type, Start) VALUES(NEW.ID, NEW.Reason, NEW.Type, NEW.Start);
+            END;""",
+            # Rows moved into the archive keep their index entry
+            """CREATE TRIGGER tr_infractions_fts_deleted AFTER DELETE ON infractions
+                WHEN NOT EXISTS (SELECT 1 FROM infractions_archive WHERE ID=OLD.ID)
+            BEGIN
+                DELETE FROM infractions_fts WHERE rowid=OLD.ID;
+            END;""",
+            """CREATE TRIGGER tr_infractions_archive_fts_deleted AFTER DELETE ON infractions_archive
+            BEGIN
+                DELETE FROM infractions_fts WHERE rowid=OLD.ID;
+            END;""",
+        )
+    ),
+    (
+        "Store channel silences, so they can be lifted after a restart",
+        (
+            # Expiry is NULL for indefinite silences
+            "CREATE TABLE silences(ChannelID INTEGER PRIMARY KEY, ActorID INTEGER NOT NULL, Expiry INTEGER);",
+        )
+    ),
+    (
+        "Add leases, so only one of several running instances is active",
+        (
+            # Expiry is in epoch seconds, every instance runs on the same host as the database file
+            "CREATE TABLE leases(Name TEXT PRIMARY KEY, Holder TEXT NOT NULL, Expiry REAL NOT NULL);",
+        )
+    ),
+]
+
+
+# Modules which only wrap statements for others, statements are attributed to whoever called into them
+_DATABASE_MODULES = ("bot.database", "bot.utils.infractions", "bot.utils.silences")
+
+
+def find_caller() -> str:
+    """Get the name of the innermost function on the current stack outside of the database modules"""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get("__name__") in _DATABASE_MODULES:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    return f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}"
+
+
+def _normalize_statement(sql: str) -> str:
+    """Collapse whitespace and variable length parameter lists, so that equal statements are grouped together"""
+    sql = " ".join(sql.split())
+    return re.sub(r"IN \(\?(, \?)*\)", "IN (...)", sql)
+
+
+class StatementStatistics(Histogram):
+    """Latency statistics of a single statement"""
+
+    __slots__ = ("callers", )
 
-class SQLite():
     def __init__(self):
-        self.conn = lite.connect(Database.db_name)
+        super().__init__()
+        self.callers: t.Counter[str] = t.Counter()
+
+    def record(self, caller: str, milliseconds: float) -> None:
+        super().record(milliseconds)
+        self.callers[caller] += 1
+
+    def copy(self) -> "StatementStatistics":
+        stats = super().copy()
+        stats.callers = self.callers.copy()
+        return stats
+
+    def merge(self, other: "StatementStatistics") -> None:
+        """Add the calls recorded by `other` to these statistics"""
+        super().merge(other)
+        self.callers.update(other.callers)
+
+
+class QueryStatistics:
+    """
+    Timings of the statements executed on one or more connections, grouped by statement.
+
+    Statements run on several worker threads, so all of the updates are done under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements: t.Dict[str, StatementStatistics] = {}
+
+    def record(self, sql: str, caller: str, milliseconds: float) -> None:
+        sql = _normalize_statement(sql)
+        with self._lock:
+            stats = self._statements.get(sql)
+            if stats is None:
+                stats = self._statements[sql] = StatementStatistics()
+            stats.record(caller, milliseconds)
+
+    @classmethod
+    def combine(cls, statistics: t.Iterable["QueryStatistics"]) -> "QueryStatistics":
+        """Combine the statistics of several databases into new statistics, grouped by statement"""
+        combined = cls()
+        for stats in statistics:
+            with stats._lock:
+                for sql, statement in stats._statements.items():
+                    combined._statements.setdefault(sql, StatementStatistics()).merge(statement)
+        return combined
+
+    def top(self, amount: int) -> t.List[t.Tuple[str, StatementStatistics]]:
+        """Get copies of the statistics of the `amount` statements which took the most time in total"""
+        with self._lock:
+            statements = [(sql, stats.copy()) for sql, stats in self._statements.items()]
+        return sorted(statements, key=lambda item: item[1].total, reverse=True)[:amount]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._statements.clear()
+
+
+class SQLite():
+    def __init__(self, db_name: str = None, read_only: bool = False, stats: QueryStatistics = None):
+        db_name = db_name or Database.db_name
+        self.stats = stats if stats is not None else QueryStatistics()
+        # Set by `AsyncSQLite` while running a statement on behalf of a coroutine, the stack is useless then
+        self.caller: t.Optional[str] = None
+
+        if read_only:
+            # Pooled read-only connections are closed by whichever thread shuts the pool down
+            uri = f"{Path(db_name).absolute().as_uri()}?mode=ro"
+            self.conn = lite.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self.conn = lite.connect(db_name)
         self.cur = self.conn.cursor()
 
+        if not read_only:
+            # In write-ahead logging mode readers don't block the writer and the writer doesn't block readers
+            self.cur.execute("PRAGMA journal_mode=WAL;")
+        for pragma, value in Database.pragmas.items():
+            self.cur.execute(f"PRAGMA {pragma}={value};")
+
     def close(self):
         self.conn.close()
 
-    def execute(self, *args):
-        self.cur.execute(*args)
+    def _timed(self, cur: lite.Cursor, sql: str, args: tuple = (), caller: str = None) -> lite.Cursor:
+        """Execute a statement on `cur` and record how long it took"""
+        started = time.perf_counter()
+        cur.execute(sql, args)
+        self._record(sql, args, (time.perf_counter() - started) * 1000, caller)
+        return cur
+
+    def _record(self, sql: str, args: t.Optional[tuple], milliseconds: float, caller: str = None) -> None:
+        caller = caller or self.caller or find_caller()
+        self.stats.record(sql, caller, milliseconds)
+
+        if milliseconds >= Database.slow_query_ms:
+            message = f"Slow statement from {caller} took {milliseconds:.1f}ms: {_normalize_statement(sql)}"
+            if args is not None:
+                message += f"\nQuery plan:\n{self.explain(sql, args)}"
+            log.warning(message)
+
+    def explain(self, sql: str, args: tuple = ()) -> str:
+        """Get the indented `EXPLAIN QUERY PLAN` output of the statement, without executing it"""
+        try:
+            rows = self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", args).fetchall()
+        except lite.Error as e:
+            return f"  (unavailable: {e})"
+
+        depths = {0: 0}
+        lines = []
+        for node_id, parent_id, _, detail in rows:
+            depths[node_id] = depths.get(parent_id, 0) + 1
+            lines.append(f"{'  ' * depths[node_id]}{detail}")
+        return "\n".join(lines)
+
+    def execute(self, sql: str, args: tuple = ()):
+        self._timed(self.cur, sql, args)
+        self.conn.commit()
+
+    def insert(self, sql: str, args: tuple = ()) -> int:
+        """Execute an INSERT statement, commit it and return the rowid of the inserted row."""
+        self._timed(self.cur, sql, args)
+        self.conn.commit()
+        return self.cur.lastrowid
+
+    def insert_many(self, sql: str, seq_of_args: t.Iterable[tuple]) -> t.List[int]:
+        """Execute an INSERT statement for every set of arguments in a single transaction and return the new rowids."""
+        return self.execute_batch((sql, args) for args in seq_of_args)
+
+    def executemany(self, sql: str, seq_of_args: t.Iterable[tuple]) -> int:
+        """
+        Execute a statement for every set of arguments in a single transaction and return the amount of changed rows.
+
+        Unlike `insert_many`, no rowids are collected, so `seq_of_args` may be a generator of any length.
+        """
+        started = time.perf_counter()
+        try:
+            self.cur.executemany(sql, seq_of_args)
+        except lite.Error:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        # The arguments may have been a generator, so the plan can't be explained
+        self._record(sql, None, (time.perf_counter() - started) * 1000)
+        return self.cur.rowcount
+
+    def execute_batch(
+        self,
+        statements: t.Iterable[t.Tuple[str, tuple]],
+        callers: t.Optional[t.Sequence[str]] = None
+    ) -> t.List[int]:
+        """
+        Execute all `statements` in a single transaction and return the lastrowid after each of them.
+
+        If any of the statements fails, the whole transaction is rolled back. The statements are
+        attributed to the `callers` at the same position, if given.
+        """
+        rowids = []
+        try:
+            for i, (sql, args) in enumerate(statements):
+                self._timed(self.cur, sql, args, callers[i] if callers else None)
+                rowids.append(self.cur.lastrowid)
+        except lite.Error:
+            self.conn.rollback()
+            raise
         self.conn.commit()
+        return rowids
+
+    def _select(self, sql: str, args: tuple, row_factory: t.Optional[RowFactory]) -> lite.Cursor:
+        cur = self.conn.cursor()
+        cur.row_factory = row_factory
+        return self._timed(cur, sql, args)
+
+    def fetchone(self, sql: str, args: tuple = (), row_factory: RowFactory = None) -> t.Any:
+        """
+        Execute a read-only statement and return the first resulting row.
+
+        Rows are tuples unless a `row_factory(cursor, row)` is given to build them.
+        """
+        return self._select(sql, args, row_factory).fetchone()
+
+    def fetchall(self, sql: str, args: tuple = (), row_factory: RowFactory = None) -> t.List[t.Any]:
+        """
+        Execute a read-only statement and return all resulting rows.
+
+        Rows are tuples unless a `row_factory(cursor, row)` is given to build them.
+        """
+        return self._select(sql, args, row_factory).fetchall()
+
+    def iterate(self, sql: str, args: tuple = (), row_factory: RowFactory = None) -> t.Iterator[t.Any]:
+        """
+        Execute a read-only statement and lazily yield the resulting rows.
+
+        Rows are fetched from SQLite while iterating, so even huge results are held in memory one at a time.
+        """
+        return iter(self._select(sql, args, row_factory))
+
+    def backup(self, target: str, pages: int = -1, sleep: float = 0.25) -> None:
+        """
+        Copy the database into the file `target` with SQLite's online backup API.
+
+        The copy is made in steps of `pages` pages (all at once if negative), sleeping for `sleep`
+        seconds in between, so the database is only ever locked for a single step.
+        """
+        destination = lite.connect(target)
+        try:
+            self.conn.backup(destination, pages=pages, sleep=sleep)
+        finally:
+            destination.close()
 
-    def create_init_tables(self):
+    def migrate(self) -> int:
+        """
+        Bring the database schema up to date and return the resulting schema version.
+
+        Every migration from `MIGRATIONS` which wasn't applied yet is executed in its own transaction,
+        together with recording its version in the `schema_version` table.
+        """
+        self.execute("CREATE TABLE IF NOT EXISTS schema_version(version INTEGER NOT NULL);")
+        current_version = self.fetchone("SELECT MAX(version) FROM schema_version;")[0] or 0
+
+        for version, (description, statements) in enumerate(MIGRATIONS, start=1):
+            if version <= current_version:
+                continue
+
+            log.info(f"Applying database migration #{version}: {description}")
+            self.cur.execute("BEGIN;")
+            try:
+                for statement in statements:
+                    self.cur.execute(statement)
+                self.cur.execute("INSERT INTO schema_version VALUES(?);", (version, ))
+            except lite.Error:
+                self.conn.rollback()
+                log.exception(f"Database migration #{version} failed, rolled back")
+                raise
+            self.conn.commit()
+            current_version = version
+
+        log.debug(f"Database schema is at version {current_version}")
+        return current_version
+
+
+class AsyncSQLite:
+    """
+    A long-lived SQLite connection which executes statements on a dedicated worker thread.
+
+    All of the public methods are coroutines, the blocking `sqlite3` calls are handed to a single
+    worker thread, so slow disk I/O never blocks the event loop. Because there is exactly one worker,
+    statements are executed in the order they were submitted and the connection is kept open
+    (warm) between them.
+
+    Writes which don't need to be committed right away can be passed to `queue_write`. Those are
+    collected for `flush_interval` seconds and then committed together in a single transaction
+    (group commit), so a burst of writes costs a single fsync instead of one per statement.
+
+    Reads are executed on a pool of `read_connections` read-only connections, so they run in
+    parallel with each other and with the writer. In-memory databases can't be shared between
+    connections, reads on those (or with a pool size of 0) go through the writer connection instead.
+    """
+
+    def __init__(self, db_name: str = None, flush_interval: float = None, read_connections: int = None):
+        self.db_name = db_name or Database.db_name
+        self.flush_interval = flush_interval if flush_interval is not None else Database.flush_interval
+        self.read_connections = read_connections if read_connections is not None else Database.read_connections
+        if self.db_name == ":memory:":
+            self.read_connections = 0
+
+        self._pending_writes: t.List[t.Tuple[str, tuple, asyncio.Future, str]] = []
+        self._flush_task: t.Optional[asyncio.Task] = None
+        # Resolved once the running group commit landed and its futures were resolved
+        self._flushing: t.Optional[asyncio.Future] = None
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        # Only ever touched from within the worker thread
+        self._db: t.Optional[SQLite] = None
+
+        self._read_executor = None
+        if self.read_connections:
+            self._read_executor = ThreadPoolExecutor(
+                max_workers=self.read_connections, thread_name_prefix="sqlite-read"
+            )
+        # Every thread of the read pool keeps its own connection
+        self._local = threading.local()
+        self._readers: t.List[SQLite] = []
+        self._readers_lock = threading.Lock()
+
+        # Shared by the writer and all of the readers
+        self.stats = QueryStatistics()
+
+    def _connect(self) -> SQLite:
+        if self._db is None:
+            log.debug(f"Opening database connection to {self.db_name}")
+            self._db = SQLite(self.db_name, stats=self.stats)
+        return self._db
+
+    @staticmethod
+    def _call_as(db: SQLite, caller: t.Optional[str], method: str, *args) -> t.Any:
+        """Run `method` of the connection, attributing its statements to `caller`"""
+        db.caller = caller
         try:
-            self.execute("""CREATE TABLE infractions(
-                            UID INTEGER,
-                            Type TEXT,
-                            Reason TEXT,
-                            ActorID INTEGER,
-                            Start TEXT,
-                            Duration INTEGER,
-                            Active INTEGER
-                            );""")
-            self.execute("""CREATE TABLE users(
-                            UID INTEGER,
-                            Muted INTEGER,
-                            Banned INTEGER
-                            );""")
-            log.info("Database tables created")
-        except lite.OperationalError:
-            log.debug("Tables exists")
+            return getattr(db, method)(*args)
+        finally:
+            db.caller = None
+
+    def _call(self, method: str, *args, caller: str = None) -> t.Any:
+        """Run `method` of the underlying `SQLite` connection, opening it first if needed."""
+        return self._call_as(self._connect(), caller, method, *args)
+
+    def _read_call(self, method: str, *args, caller: str = None) -> t.Any:
+        """Run `method` of the current read pool thread's connection, opening it first if needed."""
+        reader = getattr(self._local, "db", None)
+        if reader is None:
+            log.debug(f"Opening read-only database connection to {self.db_name}")
+            reader = self._local.db = SQLite(self.db_name, read_only=True, stats=self.stats)
+            with self._readers_lock:
+                self._readers.append(reader)
+        return self._call_as(reader, caller, method, *args)
+
+    def _close(self) -> None:
+        if self._db is not None:
+            log.debug(f"Closing database connection to {self.db_name}")
+            self._db.close()
+            self._db = None
+
+    async def _run(self, func: t.Callable, *args, **kwargs) -> t.Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def _call_in_order(self, method: str, *args, caller: str = None) -> t.Any:
+        """Run `method` of the connection after committing queued writes, so statements never overtake them."""
+        # The calling coroutine is only on the stack until the first await
+        caller = caller or find_caller()
+        await self.flush()
+        return await self._run(self._call, method, *args, caller=caller)
+
+    async def _read(self, method: str, *args) -> t.Any:
+        """Run read-only `method` on a pooled connection once queued writes are committed."""
+        caller = find_caller()
+        if self._read_executor is None:
+            return await self._call_in_order(method, *args, caller=caller)
+
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._read_executor, partial(self._read_call, method, *args, caller=caller)
+        )
+
+    async def connect(self) -> None:
+        """Open the connection ahead of the first statement."""
+        await self._run(self._connect)
+
+    def queue_write(self, sql: str, args: tuple = ()) -> asyncio.Future:
+        """
+        Queue a write statement to be committed with the next group commit.
+
+        The returned future resolves to the lastrowid of the statement once it was committed, callers
+        which need the write to be durable (or need the rowid) can await it, others may ignore it.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_writes.append((sql, args, future, find_caller()))
+
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush_later())
+        return future
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        # Writes queued from now on have to wait for the next tick
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Commit all of the queued writes in a single transaction.
+
+        If a group commit which took the queued writes is still running, wait for it instead, so
+        whoever flushes before reading always sees every write queued before.
+        """
+        pending, self._pending_writes = self._pending_writes, []
+        if not pending:
+            if self._flushing is not None:
+                # Shielded, a cancelled reader mustn't cancel the barrier of the others
+                await asyncio.shield(self._flushing)
+            return
+
+        # Group commits run one after another on the writer thread, so waiting for the latest one is enough
+        flushing = self._flushing = asyncio.get_running_loop().create_future()
+        log.debug(f"Flushing {len(pending)} queued database writes")
+        try:
+            rowids = await self._run(
+                self._call, "execute_batch",
+                [(sql, args) for sql, args, *_ in pending], [caller for *_, caller in pending]
+            )
+        except Exception as e:
+            log.exception(f"Failed to flush {len(pending)} queued database writes")
+            for _, _, future, _ in pending:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for rowid, (_, _, future, _) in zip(rowids, pending):
+                if not future.done():
+                    future.set_result(rowid)
+        finally:
+            flushing.set_result(None)
+            if self._flushing is flushing:
+                self._flushing = None
+
+    async def execute(self, *args) -> None:
+        """Execute a statement and commit it."""
+        await self._call_in_order("execute", *args)
+
+    async def insert(self, *args) -> int:
+        """Execute an INSERT statement, commit it and return the rowid of the inserted row."""
+        return await self._call_in_order("insert", *args)
+
+    async def insert_many(self, sql: str, seq_of_args: t.Iterable[tuple]) -> t.List[int]:
+        """Execute an INSERT statement for every set of arguments in a single transaction and return the new rowids."""
+        return await self._call_in_order("insert_many", sql, list(seq_of_args))
+
+    async def fetchone(self, sql: str, args: tuple = (), row_factory: RowFactory = None) -> t.Any:
+        """
+        Execute a read-only statement and return the first resulting row.
+
+        The `row_factory` is called on the worker thread, so decoding rows doesn't block the event loop either.
+        """
+        return await self._read("fetchone", sql, args, row_factory)
+
+    async def fetchall(self, sql: str, args: tuple = (), row_factory: RowFactory = None) -> t.List[t.Any]:
+        """
+        Execute a read-only statement and return all resulting rows.
+
+        The `row_factory` is called on the worker thread, so decoding rows doesn't block the event loop either.
+        """
+        return await self._read("fetchall", sql, args, row_factory)
+
+    async def backup(self, target: str, pages: int = None, sleep: float = None) -> None:
+        """
+        Copy the database into the file `target` without blocking other statements.
+
+        The backup runs on a pooled read-only connection in steps of `pages` pages, so neither the event
+        loop nor the writer connection wait for it. Queued writes are committed first, so they are included.
+        """
+        pages = pages if pages is not None else Database.backup_pages
+        sleep = sleep if sleep is not None else Database.backup_step_sleep
+        await self._read("backup", target, pages, sleep)
+
+    async def migrate(self) -> int:
+        """Bring the database schema up to date and return the resulting schema version."""
+        return await self._call_in_order("migrate")
+
+    async def close(self) -> None:
+        """Commit any queued writes, close all connections and stop the worker threads."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+        if self._read_executor is not None:
+            self._read_executor.shutdown(wait=True)
+        with self._readers_lock:
+            for reader in self._readers:
+                reader.close()
+            self._readers.clear()
+
+
+class ShardedDatabase:
+    """
+    Routes every guild to the database which holds its infractions.
+
+    With `shard_by_guild` enabled, every guild gets its own SQLite file in `shard_dir`, so the guilds
+    never contend for the same writer thread or write-ahead log. The home guild (`constants.Guild.id`)
+    keeps using `db_name`, so enabling sharding doesn't move its existing data. Without sharding,
+    all of the guilds share the home database, which doesn't record the guild of an infraction,
+    so only the home guild is moderated then (see `has_own_database`).
+
+    The connection of a shard is opened and migrated on first use and then kept open until `close`.
+    Because the infraction caches are kept per connection, they are per shard as well.
+    """
+
+    def __init__(
+        self,
+        home_guild_id: int = None,
+        db_name: str = None,
+        shard_dir: str = None,
+        shard_by_guild: bool = None,
+        **kwargs
+    ):
+        self.home_guild_id = home_guild_id if home_guild_id is not None else Guild.id
+        self.shard_dir = Path(shard_dir or Database.shard_dir)
+        self.shard_by_guild = shard_by_guild if shard_by_guild is not None else Database.shard_by_guild
+        # Passed on to the `AsyncSQLite` of every shard
+        self._kwargs = kwargs
+
+        self.home = AsyncSQLite(db_name, **kwargs)
+        self._shards: t.Dict[int, AsyncSQLite] = {}
+        self._opening: t.Dict[int, asyncio.Future] = {}
+
+    def has_own_database(self, guild_id: int) -> bool:
+        """Whether the infractions of `guild_id` are kept apart from those of the other guilds"""
+        return self.shard_by_guild or guild_id == self.home_guild_id
+
+    def shard_name(self, guild_id: int) -> str:
+        """Get the file name of the database holding the infractions of `guild_id`."""
+        if not self.shard_by_guild or guild_id == self.home_guild_id:
+            return self.home.db_name
+        home = Path(self.home.db_name)
+        return str(self.shard_dir / f"{home.stem}-{guild_id}{home.suffix or '.db'}")
+
+    @property
+    def databases(self) -> t.List[AsyncSQLite]:
+        """All of the currently open databases, the home database first."""
+        return [self.home, *self._shards.values()]
+
+    @property
+    def stats(self) -> QueryStatistics:
+        """Statement statistics of all of the open databases combined"""
+        return QueryStatistics.combine(db.stats for db in self.databases)
+
+    def reset_stats(self) -> None:
+        for db in self.databases:
+            db.stats.reset()
+
+    async def get(self, guild_id: int) -> AsyncSQLite:
+        """Get the database of `guild_id`, opening and migrating it if it isn't open yet."""
+        if not self.shard_by_guild or guild_id == self.home_guild_id:
+            return self.home
+        if guild_id in self._shards:
+            return self._shards[guild_id]
+
+        if guild_id not in self._opening:
+            self._opening[guild_id] = asyncio.ensure_future(self._open(guild_id))
+        # Shielded, so a cancelled caller doesn't cancel the opening for everyone else waiting on it
+        return await asyncio.shield(self._opening[guild_id])
+
+    async def _open(self, guild_id: int) -> AsyncSQLite:
+        db = AsyncSQLite(self.shard_name(guild_id), **self._kwargs)
+        try:
+            Path(db.db_name).parent.mkdir(parents=True, exist_ok=True)
+            await db.migrate()
+        except BaseException:
+            del self._opening[guild_id]
+            await db.close()
+            raise
+
+        log.info(f"Opened database shard {db.db_name} of guild {guild_id}")
+        self._shards[guild_id] = db
+        del self._opening[guild_id]
+        return db
+
+    async def close(self) -> None:
+        """Close the home database and all of the open shards."""
+        shards = list(self._shards.values())
+        self._shards.clear()
+        await asyncio.gather(self.home.close(), *(shard.close() for shard in shards))
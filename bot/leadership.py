@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import typing as t
+
+from bot.constants import Leadership
+from bot.database import AsyncSQLite
+
+log = logging.getLogger(__name__)
+
+# Name of the lease deciding which instance of the bot is active
+BOT_LEASE = "bot"
+
+
+async def acquire_lease(db: AsyncSQLite, name: str, holder: str, duration: float) -> bool:
+    """
+    Take the lease `name` for `duration` seconds, or renew it, and return whether `holder` holds it.
+
+    The lease is only taken over if nobody holds it or the previous holder let it expire.
+    """
+    now = time.time()
+    await db.execute(
+        """INSERT INTO leases(Name, Holder, Expiry) VALUES(?, ?, ?)
+            ON CONFLICT(Name) DO UPDATE SET Holder=excluded.Holder, Expiry=excluded.Expiry
+            WHERE leases.Holder=excluded.Holder OR leases.Expiry<?""",
+        (name, holder, now + duration, now)
+    )
+    row = await db.fetchone("SELECT Holder FROM leases WHERE Name=?", (name, ))
+    return row is not None and row[0] == holder
+
+
+async def release_lease(db: AsyncSQLite, name: str, holder: str) -> None:
+    """Give up the lease `name`, if it is still held by `holder`."""
+    await db.execute("DELETE FROM leases WHERE Name=? AND Holder=?", (name, holder))
+
+
+class Lease:
+    """
+    Keeps a single instance of the bot active while several of them are running.
+
+    Deploys start the new instance before stopping the old one. The instance holding the lease in the
+    database is the leader, which handles the events and runs the schedulers. The others are standbys,
+    they stay connected with a warm cache and try to take the lease over every `heartbeat_interval`
+    seconds, which succeeds as soon as the leader released it on shutdown or stopped renewing it.
+
+    A leader which fails to renew the lease steps down before it could expire, so two instances never
+    consider themselves leaders at once. Changes are passed to `dispatch` as the `leadership_acquired`
+    and `leadership_lost` events.
+    """
+
+    def __init__(
+        self,
+        db: AsyncSQLite,
+        dispatch: t.Callable[[str], None],
+        duration: float = None,
+        heartbeat_interval: float = None
+    ):
+        self.db = db
+        self.dispatch = dispatch
+        self.duration = duration if duration is not None else Leadership.lease_duration
+        self.heartbeat_interval = heartbeat_interval if heartbeat_interval is not None else Leadership.heartbeat_interval
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+
+        self._leader = asyncio.Event()
+        # Monotonic time at which the last successful renewal was attempted
+        self._renewed = float("-inf")
+        self._task: t.Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader.is_set()
+
+    async def wait_until_leader(self) -> None:
+        """Wait until this instance holds the lease."""
+        await self._leader.wait()
+
+    def start(self) -> None:
+        """Start taking and renewing the lease in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat())
+
+    async def renew(self) -> bool:
+        """Try to take or renew the lease once and return whether this instance is the leader afterwards."""
+        attempted = time.monotonic()
+        try:
+            held = await acquire_lease(self.db, BOT_LEASE, self.holder, self.duration)
+        except Exception:
+            log.exception("Failed to renew the lease")
+            # Whoever takes over waits for the lease to expire, the leader has to step down before that
+            held = self.is_leader and time.monotonic() - self._renewed + self.heartbeat_interval < self.duration
+        else:
+            if held:
+                self._renewed = attempted
+
+        self._set_leader(held)
+        return held
+
+    def _set_leader(self, leader: bool) -> None:
+        if leader == self.is_leader:
+            return
+
+        if leader:
+            log.info(f"Acquired the lease as {self.holder}, this instance is now active")
+            self._leader.set()
+            self.dispatch("leadership_acquired")
+        else:
+            log.warning(f"Lost the lease held as {self.holder}, this instance is now a standby")
+            self._leader.clear()
+            self.dispatch("leadership_lost")
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await self.renew()
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def close(self) -> None:
+        """Stop renewing the lease and release it, so a standby can take over right away."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self.is_leader:
+            self._leader.clear()
+            try:
+                await release_lease(self.db, BOT_LEASE, self.holder)
+            except Exception:
+                log.exception("Failed to release the lease, the standby takes over once it expires")
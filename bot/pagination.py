@@ -54,6 +54,8 @@ class LinePaginator(Paginator):
         self.suffix = suffix
         self.max_size = max_size - len(suffix)
         self.max_lines = max_lines
+        # Joins the lines of a page in `Paginator.close_page` of newer discord.py versions
+        self.linesep = "\n"
         self._current_page = [prefix]
         self._linecount = 0
         self._count = len(prefix) + 1  # prefix + newline
@@ -309,6 +311,104 @@ class LinePaginator(Paginator):
         with suppress(discord.NotFound):
             await message.clear_reactions()
 
+    @classmethod
+    async def paginate_lazily(
+        cls,
+        get_page: t.Callable[[int], t.Awaitable[t.List[str]]],
+        page_count: int,
+        ctx: Context,
+        embed: discord.Embed,
+        prefix: str = "",
+        suffix: str = "",
+        max_size: int = 2000,
+        empty: bool = False,
+        restrict_to_user: User = None,
+        timeout: int = 300,
+        footer_text: str = None,
+        destination: t.Optional[discord.abc.Messageable] = None,
+    ) -> t.Optional[discord.Message]:
+        """
+        Use a set of reactions to provide pagination over pages which are only fetched once they are viewed.
+
+        `get_page` is awaited with the index of the page which should be shown and returns the lines of that
+        page, those are rendered the same way as with `LinePaginator.paginate`. Only the currently viewed page
+        is held in memory, no matter how many pages there are.
+
+        The message is sent with `ctx.send()`, unless a different `destination` is given.
+        """
+        def event_check(reaction_: discord.Reaction, user_: discord.Member) -> bool:
+            """Make sure that this reaction is what we want to operate on."""
+            return all((
+                reaction_.message.id == message.id,
+                str(reaction_.emoji) in PAGINATION_EMOJI,
+                user_.id != ctx.bot.user.id,
+                not restrict_to_user or user_.id == restrict_to_user.id
+            ))
+
+        async def render_page() -> None:
+            """Fetch the lines of `current_page` and set them as the embed description."""
+            lines = await get_page(current_page) or ["(nothing to display)"]
+
+            paginator = cls(prefix=prefix, suffix=suffix, max_size=max_size)
+            for line in lines:
+                paginator.add_line(line, empty=empty)
+            if len(paginator.pages) > 1:
+                log.warning(f"Lazy page {current_page} doesn't fit into {max_size} characters, it was truncated")
+            embed.description = paginator.pages[0]
+
+            if page_count > 1:
+                page_text = f"Page {current_page + 1}/{page_count}"
+                embed.set_footer(text=f"{footer_text} ({page_text})" if footer_text else page_text)
+            elif footer_text:
+                embed.set_footer(text=footer_text)
+
+        destination = destination or ctx
+        page_count = max(page_count, 1)
+        current_page = 0
+
+        await render_page()
+        message = await destination.send(embed=embed)
+
+        if page_count <= 1:
+            log.debug("There's less than two pages, so we won't paginate - sending single page on its own")
+            return message
+
+        for emoji in PAGINATION_EMOJI:
+            await message.add_reaction(emoji)
+
+        while True:
+            try:
+                reaction, user = await ctx.bot.wait_for("reaction_add", timeout=timeout, check=event_check)
+            except asyncio.TimeoutError:
+                log.debug("Timed out waiting for a reaction")
+                break
+
+            if str(reaction.emoji) == DELETE_EMOJI:
+                log.debug("Got delete reaction")
+                return await message.delete()
+
+            # Removing reactions of other users isn't possible in DMs
+            with suppress(discord.HTTPException):
+                await message.remove_reaction(reaction.emoji, user)
+
+            new_page = {
+                FIRST_EMOJI: 0,
+                LEFT_EMOJI: current_page - 1,
+                RIGHT_EMOJI: current_page + 1,
+                LAST_EMOJI: page_count - 1,
+            }[str(reaction.emoji)]
+            if new_page == current_page or not 0 <= new_page < page_count:
+                continue
+
+            current_page = new_page
+            log.debug(f"Changing to page {current_page + 1}/{page_count}")
+            await render_page()
+            await message.edit(embed=embed)
+
+        log.debug("Ending pagination and clearing reactions.")
+        with suppress(discord.HTTPException):
+            await message.clear_reactions()
+
 
 class ImagePaginator(Paginator):
     """
@@ -0,0 +1,256 @@
+"""
+Bulk export and import of the `infractions` table.
+
+Usage:
+    python -m bot.tools.infractions export infractions.jsonl
+    python -m bot.tools.infractions import infractions.csv [--keep-ids]
+
+Rows are streamed through generators in both directions, so the memory usage doesn't depend on the
+amount of infractions. The format is picked from the file extension (`.jsonl` or `.csv`), unless it's
+given with `--format`.
+
+Imports bypass the bot, so a running bot won't notice imported infractions until it is restarted.
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import sqlite3
+import typing as t
+from pathlib import Path
+
+from bot.cogs.moderation.utils import INFRACTION_ICONS
+from bot.database import SQLite
+
+log = logging.getLogger(__name__)
+
+# Exported fields, paired with the columns of the `infractions` table they are stored in
+FIELDS = ("id", "user_id", "type", "reason", "actor_id", "start", "duration", "active")
+COLUMNS = ("ID", "UID", "Type", "Reason", "ActorID", "Start", "Duration", "Active")
+
+# Imported rows committed per transaction
+CHUNK_SIZE = 10_000
+# IDs looked up per query when checking kept IDs for collisions, stays well below SQLite's limit of bound parameters
+ID_BATCH_SIZE = 500
+
+FORMATS = ("jsonl", "csv")
+
+Record = t.Dict[str, t.Any]
+
+
+class InvalidRecord(ValueError):
+    """Raised when an imported record doesn't fit the `infractions` table."""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"Record {line}: {message}")
+        self.line = line
+
+
+def iter_records(db: SQLite) -> t.Iterator[Record]:
+    """Lazily yield every active and archived infraction as a record, in the order of their IDs"""
+    sql = f"SELECT {', '.join(COLUMNS)} FROM all_infractions ORDER BY ID;"
+    for row in db.iterate(sql):
+        yield dict(zip(FIELDS, row))
+
+
+def write_jsonl(records: t.Iterable[Record], file: t.TextIO) -> int:
+    """Write records as one JSON object per line, return the amount of written records"""
+    count = 0
+    for count, record in enumerate(records, start=1):
+        file.write(json.dumps(record, ensure_ascii=False))
+        file.write("\n")
+    return count
+
+
+def write_csv(records: t.Iterable[Record], file: t.TextIO) -> int:
+    """Write records as CSV with a header row, return the amount of written records"""
+    writer = csv.DictWriter(file, fieldnames=FIELDS)
+    writer.writeheader()
+    count = 0
+    for count, record in enumerate(records, start=1):
+        writer.writerow(record)
+    return count
+
+
+def read_jsonl(file: t.TextIO) -> t.Iterator[Record]:
+    """Lazily read records from JSON lines, empty lines are skipped"""
+    for line_no, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise InvalidRecord(line_no, f"invalid JSON ({e})")
+        if not isinstance(record, dict):
+            raise InvalidRecord(line_no, "expected a JSON object")
+        yield record
+
+
+def read_csv(file: t.TextIO) -> t.Iterator[Record]:
+    """Lazily read records from CSV with a header row"""
+    yield from csv.DictReader(file)
+
+
+WRITERS: t.Dict[str, t.Callable[[t.Iterable[Record], t.TextIO], int]] = {"jsonl": write_jsonl, "csv": write_csv}
+READERS: t.Dict[str, t.Callable[[t.TextIO], t.Iterator[Record]]] = {"jsonl": read_jsonl, "csv": read_csv}
+
+
+def _get_integer(record: Record, field: str, line: int) -> int:
+    value = record.get(field)
+    # Fast path for JSON, booleans are refused rather than silently becoming 0 or 1
+    if type(value) is int:
+        return value
+    if value is None or value == "":
+        raise InvalidRecord(line, f"missing field {field}")
+    if isinstance(value, bool):
+        raise InvalidRecord(line, f"{field} must be an integer")
+    # CSV fields are always strings
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidRecord(line, f"{field} must be an integer, got {value!r}")
+
+
+def validate(record: Record, line: int, keep_ids: bool = False) -> tuple:
+    """
+    Check that the record fits the `infractions` table and convert it into the values of a row.
+
+    The values are in the column order of the table, followed by the ID if `keep_ids` is set.
+    """
+    type_ = record.get("type")
+    if type_ not in INFRACTION_ICONS:
+        raise InvalidRecord(line, f"unknown infraction type {type_!r}")
+    reason = record.get("reason")
+    if not isinstance(reason, str) or not reason:
+        raise InvalidRecord(line, "missing field reason" if reason in (None, "") else "reason must be a string")
+
+    start = _get_integer(record, "start", line)
+    duration = _get_integer(record, "duration", line)
+    active = _get_integer(record, "active", line)
+    if active not in (0, 1):
+        raise InvalidRecord(line, f"active must be 0 or 1, got {active}")
+    if duration < 0:
+        raise InvalidRecord(line, "duration can't be negative")
+
+    # Permanent and instant infractions never expire, same as in the `infractions` table migration
+    expiry = None
+    if duration not in (0, 1_000_000_000):
+        expiry = start + duration
+
+    row = (_get_integer(record, "user_id", line), type_, reason, _get_integer(record, "actor_id", line),
+           start, duration, active, expiry)
+    if keep_ids:
+        row += (_get_integer(record, "id", line), )
+    return row
+
+
+def check_ids(db: SQLite, chunk: t.List[t.Tuple[int, tuple]]) -> None:
+    """
+    Refuse kept IDs which are taken, by an active or an archived infraction or by another record of the chunk.
+
+    The chunk consists of line numbers paired with the validated rows, the ID is the last value of a row.
+    Records of earlier chunks are already committed, so they are found in the database.
+    """
+    lines = {}
+    for line, row in chunk:
+        id_ = row[-1]
+        if id_ in lines:
+            raise InvalidRecord(line, f"ID {id_} is already used by record {lines[id_]}")
+        lines[id_] = line
+
+    ids = list(lines)
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[i:i + ID_BATCH_SIZE]
+        placeholders = ", ".join("?" * len(batch))
+        # Both tables have to be checked, an active record would be inserted next to an archived one with its ID
+        taken = db.fetchall(f"SELECT ID FROM all_infractions WHERE ID IN ({placeholders}) ORDER BY ID;", tuple(batch))
+        if taken:
+            id_ = taken[0][0]
+            raise InvalidRecord(lines[id_], f"ID {id_} already exists in the database")
+
+
+def import_records(
+    db: SQLite,
+    records: t.Iterable[Record],
+    keep_ids: bool = False,
+    chunk_size: int = CHUNK_SIZE
+) -> int:
+    """
+    Validate and insert records into the `infractions` table, return the amount of imported records.
+
+    Every chunk of `chunk_size` records is inserted with a single `executemany` in its own transaction,
+    an invalid record stops the import with the chunks before it committed. Without `keep_ids`,
+    the imported infractions get new IDs. With it, records whose ID is already taken are refused.
+    Inactive infractions end up in the archive table like any other.
+    """
+    if keep_ids:
+        sql = "INSERT INTO infractions(UID, Type, Reason, ActorID, Start, Duration, Active, Expiry, ID) " \
+              "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?);"
+    else:
+        sql = "INSERT INTO infractions(UID, Type, Reason, ActorID, Start, Duration, Active, Expiry) " \
+              "VALUES(?, ?, ?, ?, ?, ?, ?, ?);"
+
+    rows = ((line, validate(record, line, keep_ids)) for line, record in enumerate(records, start=1))
+
+    total = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        if keep_ids:
+            check_ids(db, chunk)
+        db.executemany(sql, [row for _, row in chunk])
+        total += len(chunk)
+        log.debug(f"Imported {total} infractions")
+    return total
+
+
+def get_format(path: str, format_: t.Optional[str]) -> str:
+    """Get the format given explicitly or by the extension of the file"""
+    if format_:
+        return format_
+    suffix = Path(path).suffix.lstrip(".").lower()
+    if suffix not in FORMATS:
+        raise SystemExit(f"Can't tell the format of {path!r}, use --format with one of: {', '.join(FORMATS)}")
+    return suffix
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m bot.tools.infractions", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="database file, defaults to the configured database")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    export_parser = subparsers.add_parser("export", help="stream all infractions into a file")
+    export_parser.add_argument("file", help="output file")
+    export_parser.add_argument("--format", choices=FORMATS)
+
+    import_parser = subparsers.add_parser("import", help="stream infractions from a file into the database")
+    import_parser.add_argument("file", help="input file")
+    import_parser.add_argument("--format", choices=FORMATS)
+    import_parser.add_argument("--keep-ids", action="store_true", help="keep the IDs of the records")
+    import_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="records per transaction")
+
+    args = parser.parse_args(argv)
+    format_ = get_format(args.file, args.format)
+
+    db = SQLite(args.db)
+    try:
+        db.migrate()
+        if args.action == "export":
+            with open(args.file, "w", newline="", encoding="utf-8") as file:
+                count = WRITERS[format_](iter_records(db), file)
+            log.info(f"Exported {count} infractions")
+        else:
+            with open(args.file, newline="", encoding="utf-8") as file:
+                try:
+                    count = import_records(db, READERS[format_](file), args.keep_ids, args.chunk_size)
+                except (InvalidRecord, sqlite3.IntegrityError) as e:
+                    raise SystemExit(f"Import stopped, {e}")
+            log.info(f"Imported {count} infractions")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
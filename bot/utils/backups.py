@@ -0,0 +1,87 @@
+import asyncio
+import gzip
+import logging
+import shutil
+import time
+import typing as t
+from datetime import datetime, timezone
+from pathlib import Path
+
+from bot import constants
+from bot.database import AsyncSQLite
+
+log = logging.getLogger(__name__)
+
+SUFFIX = ".db.gz"
+# UTC time of the backup in its file name
+NAME_TIME_FORMAT = "%Y%m%d-%H%M%S"
+
+
+class BackupResult(t.NamedTuple):
+    path: Path
+    size: int
+    duration: float
+
+
+def _compress(source: Path, target: Path) -> None:
+    """Gzip `source` into `target` and delete `source`"""
+    with source.open("rb") as src, gzip.open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, length=1024 * 1024)
+    source.unlink()
+
+
+def get_backups(directory: Path, stem: str = "*") -> t.List[Path]:
+    """Get the backups of the database named `stem` in `directory`, oldest first"""
+    # The timestamp is matched exactly, so the backups of `users` don't include those of the `users-<guild>` shards
+    return sorted(directory.glob(f"{stem}-{'[0-9]' * 8}-{'[0-9]' * 6}{SUFFIX}"))
+
+
+def get_last_backup_time(directory: Path, stem: str) -> t.Optional[datetime]:
+    """Get the (aware, UTC) time of the newest backup of the database named `stem` in `directory`, if it has any"""
+    backups = get_backups(directory, stem)
+    if not backups:
+        return None
+    timestamp = backups[-1].name[len(stem) + 1:-len(SUFFIX)]
+    return datetime.strptime(timestamp, NAME_TIME_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def rotate_backups(directory: Path, keep: int, stem: str = "*") -> t.List[Path]:
+    """Delete all but the `keep` newest backups of the database named `stem` in `directory`, return the deleted ones"""
+    backups = get_backups(directory, stem)
+    removed = backups[:-keep] if keep > 0 else backups
+    for path in removed:
+        log.debug(f"Removing old database backup {path}")
+        path.unlink()
+    return removed
+
+
+async def create_backup(db: AsyncSQLite, directory: str = None, keep: int = None) -> BackupResult:
+    """
+    Make a compressed snapshot of the database in `directory` and rotate the older ones.
+
+    The snapshot is taken with the online backup API on the database's read pool, compressing and
+    rotating are done on the default executor, so the event loop is never blocked.
+    """
+    directory = Path(directory or constants.Database.backup_dir)
+    keep = keep if keep is not None else constants.Database.backup_count
+
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = Path(db.db_name).stem
+    name = f"{stem}-{datetime.utcnow().strftime(NAME_TIME_FORMAT)}"
+    snapshot = directory / f"{name}.db"
+    target = directory / f"{name}{SUFFIX}"
+
+    try:
+        await db.backup(str(snapshot))
+        await loop.run_in_executor(None, _compress, snapshot, target)
+    finally:
+        if snapshot.exists():
+            snapshot.unlink()
+    await loop.run_in_executor(None, rotate_backups, directory, keep, stem)
+
+    result = BackupResult(target, target.stat().st_size, time.perf_counter() - started)
+    log.info(f"Backed up the database into {result.path} ({result.size} bytes) in {result.duration:.2f}s")
+    return result
@@ -1,50 +1,323 @@
+import asyncio
 import datetime
 import logging
+import sqlite3
+import threading
+import typing as t
+import weakref
+from collections import Counter, OrderedDict, defaultdict
 
 from dateutil.relativedelta import relativedelta
 
 from bot import constants
-from bot.cogs.moderation.utils import UserSnowflake
-from bot.database import SQLite
+from bot.database import AsyncSQLite
 from bot.utils import time
 
+if t.TYPE_CHECKING:
+    # Imported only for annotations, importing the moderation package here would be circular
+    from bot.cogs.moderation.utils import UserSnowflake
+
 log = logging.getLogger(__name__)
 
+# Columns selected to construct an `Infraction`, in the order of its `__init__` arguments
+COLUMN_NAMES = ("UID", "Type", "Reason", "ActorID", "Start", "Duration", "Active", "ID")
+COLUMNS = ", ".join(COLUMN_NAMES)
+INSERT_COMMAND = """INSERT INTO infractions(UID, Type, Reason, ActorID, Start, Duration, Active, Expiry)
+    VALUES(?, ?, ?, ?, ?, ?, ?, ?);"""
+
+# Active infractions are kept in `ACTIVE_TABLE`, the database moves inactive ones into an archive table
+# as soon as they are inserted or deactivated. `HISTORY_TABLE` is a view of both of them.
+ACTIVE_TABLE = "infractions"
+HISTORY_TABLE = "all_infractions"
+# Amount of users counted by a single query, stays well below SQLite's limit of bound parameters
+COUNT_BATCH_SIZE = 500
+
+
+# Description of the last cursor decoded by `Infraction.from_row` on a thread and the positions of its columns,
+# the row factories run on the database threads
+_last_columns = threading.local()
+
+
+def _find_column_indices(description: tuple) -> t.Tuple[t.Optional[int], ...]:
+    """Positions of `COLUMN_NAMES` in the rows of a cursor with `description`, `None` for columns not selected"""
+    positions = {column[0]: index for index, column in enumerate(description)}
+    return tuple(positions.get(column) for column in COLUMN_NAMES)
+
+
+def _column_indices(description: tuple) -> t.Tuple[t.Optional[int], ...]:
+    """Positions of `COLUMN_NAMES` in the rows of a cursor, only found once for all the rows of a statement"""
+    # A cursor returns the same description object for every row, so it's compared by identity, not hashed
+    if getattr(_last_columns, "description", None) is not description:
+        _last_columns.indices = _find_column_indices(description)
+        _last_columns.description = description
+    return _last_columns.indices
+
+
+class CacheInfo(t.NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class UserInfractionCache:
+    """
+    Bounded LRU cache of the infraction lists of individual users.
+
+    Every write to a user's infractions has to `invalidate` that user. Since a read may still be in
+    flight while a write invalidates the user, `put` only stores the result if nothing was invalidated
+    since the `version` the read started at.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+
+        self._infractions: t.OrderedDict[int, list] = OrderedDict()
+
+    def get(self, user_id: int, count: bool = True) -> t.Optional[list]:
+        """
+        Get the cached infractions of the user, or `None` if they aren't cached.
+
+        Lookups which only probe the cache pass `count=False`, so they don't count as hits or misses.
+        """
+        infractions = self._infractions.get(user_id)
+        if infractions is None:
+            self.misses += count
+            return None
+
+        self.hits += count
+        self._infractions.move_to_end(user_id)
+        return infractions
+
+    def put(self, user_id: int, infractions: list, version: int) -> None:
+        """Cache the infractions of the user if they weren't invalidated since `version`"""
+        if version != self.version or self.maxsize <= 0:
+            return
+
+        self._infractions[user_id] = infractions
+        self._infractions.move_to_end(user_id)
+        if len(self._infractions) > self.maxsize:
+            self._infractions.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop the cached infractions of the user"""
+        self.version += 1
+        self._infractions.pop(user_id, None)
+
+    def clear(self) -> None:
+        self.version += 1
+        self._infractions.clear()
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._infractions))
+
+    @staticmethod
+    def combine(infos: t.Iterable[CacheInfo]) -> CacheInfo:
+        """Add up the statistics of several caches"""
+        return CacheInfo(*map(sum, zip(CacheInfo(0, 0, 0, 0), *infos)))
+
+
+# Every database has its own cache, they are dropped together with the database
+_caches: "weakref.WeakKeyDictionary[AsyncSQLite, UserInfractionCache]" = weakref.WeakKeyDictionary()
+
+
+def get_cache(db: AsyncSQLite) -> UserInfractionCache:
+    """Get the per-user infraction cache of the database"""
+    cache = _caches.get(db)
+    if cache is None:
+        cache = _caches[db] = UserInfractionCache(constants.Database.user_cache_size)
+    return cache
+
+
+class UserState(t.NamedTuple):
+    """The longest active mute and ban of a user, as kept in the `users` table"""
+
+    user_id: int
+    muted_id: t.Optional[int]
+    # Epoch seconds, `None` for permanent infractions
+    muted_until: t.Optional[int]
+    banned_id: t.Optional[int]
+    banned_until: t.Optional[int]
+
+    @staticmethod
+    def _is_restricted(inf_id: t.Optional[int], until: t.Optional[int]) -> bool:
+        # Expired infractions stay in the table until the scheduler deactivates them
+        return inf_id is not None and (until is None or until > datetime.datetime.now().timestamp())
+
+    @property
+    def is_muted(self) -> bool:
+        return self._is_restricted(self.muted_id, self.muted_until)
+
+    @property
+    def is_banned(self) -> bool:
+        return self._is_restricted(self.banned_id, self.banned_until)
+
+
+USER_STATE_QUERY = """SELECT users.UID, users.Muted, mute.Expiry, users.Banned, ban.Expiry FROM users
+    LEFT JOIN infractions AS mute ON mute.ID=users.Muted
+    LEFT JOIN infractions AS ban ON ban.ID=users.Banned"""
+
+
+class UserStateMirror:
+    """
+    In-memory copy of the `users` table, which the database keeps up to date with the active infractions.
+
+    The whole table is loaded on first use. Writes to the infractions of a user have to `invalidate`
+    that user, whose row is then read again on the next lookup. As with `UserInfractionCache`, a row
+    read before an invalidation doesn't clear it.
+    """
+
+    def __init__(self):
+        self.version = 0
+        # Counts the times the whole table was dropped, so reads started before it aren't stored
+        self.generation = 0
+        self.states: t.Optional[t.Dict[int, UserState]] = None
+        self.stale: t.Set[int] = set()
+
+    def invalidate(self, user_id: int) -> None:
+        self.version += 1
+        self.stale.add(user_id)
+
+    def clear(self) -> None:
+        """Drop the whole table, it is loaded again on the next lookup"""
+        self.version += 1
+        self.generation += 1
+        self.states = None
+        self.stale.clear()
+
+    def update(self, user_id: int, state: t.Optional[UserState], version: int) -> None:
+        """Store the freshly read state of the user, `None` if the user has no row"""
+        if self.states is None:
+            # The table was dropped meanwhile
+            return
+        if state is None:
+            self.states.pop(user_id, None)
+        else:
+            self.states[user_id] = state
+        if version == self.version:
+            self.stale.discard(user_id)
+
+
+_user_states: "weakref.WeakKeyDictionary[AsyncSQLite, UserStateMirror]" = weakref.WeakKeyDictionary()
+
+
+def get_user_states(db: AsyncSQLite) -> UserStateMirror:
+    """Get the in-memory mirror of the `users` table of the database"""
+    mirror = _user_states.get(db)
+    if mirror is None:
+        mirror = _user_states[db] = UserStateMirror()
+    return mirror
+
+
+def _user_state_from_row(cursor: sqlite3.Cursor, row: tuple) -> UserState:
+    return UserState(*row)
+
+
+async def get_user_state(db: AsyncSQLite, user_id: int) -> t.Optional[UserState]:
+    """Get the longest active mute and ban of the user, `None` if the user has neither"""
+    mirror = get_user_states(db)
+    # The table may be dropped by `clear` during any of the reads, everything is read again then
+    while True:
+        generation = mirror.generation
+        if mirror.states is None:
+            # Users invalidated while loading stay stale, so they are read again below
+            states = await db.fetchall(USER_STATE_QUERY, row_factory=_user_state_from_row)
+            if generation != mirror.generation:
+                continue
+            mirror.states = {state.user_id: state for state in states}
+
+        if user_id in mirror.stale:
+            version = mirror.version
+            state = await db.fetchone(
+                f"{USER_STATE_QUERY} WHERE users.UID=?", (user_id, ), row_factory=_user_state_from_row)
+            if generation != mirror.generation:
+                continue
+            mirror.update(user_id, state, version)
+
+        return mirror.states.get(user_id)
+
+
+def clear_caches(db: AsyncSQLite) -> None:
+    """Drop everything kept in memory about the infractions in the database, e.g. after another process wrote to it"""
+    get_cache(db).clear()
+    get_user_states(db).clear()
+
+
+def _invalidate(db: AsyncSQLite, user_id: int, write: asyncio.Future) -> None:
+    """
+    Drop everything kept in memory about the infractions of the user, after queueing the `write` to them.
+
+    Everything is dropped again once the write was committed, as a read running meanwhile could have
+    cached the rows from before it under the new version.
+    """
+    def drop(_: asyncio.Future = None) -> None:
+        get_cache(db).invalidate(user_id)
+        get_user_states(db).invalidate(user_id)
+
+    drop()
+    write.add_done_callback(drop)
+
 
 class Infraction:
+    """
+    A single infraction record.
+
+    Records are built straight from database rows by `Infraction.from_row`, so they only store the raw
+    column values. The start datetime, stop time and active state are decoded/derived on first access.
+    """
+
+    __slots__ = ("user_id", "type", "reason", "actor_id", "duration", "id", "_start", "_active")
+
     def __init__(self,
                  user_id: int,
                  inf_type: str,
                  reason: str,
                  actor_id: int,
-                 start: datetime.datetime,
+                 start: t.Union[datetime.datetime, int],
                  duration: int,
                  active: int = None,
-                 rowid: int = None,
-                 write_to_db: bool = False
+                 rowid: int = None
                  ) -> None:
 
         self.user_id = user_id
         self.type = inf_type
         self.reason = reason if reason is not None else "N/A"
         self.actor_id = actor_id
-
-        if type(start) == datetime.datetime:
-            self.start = start
-        # For easier convertion from database
-        elif type(start) == str:
-            self.start = datetime.datetime.strptime(
-                start, constants.Time.time_format)
-
+        # Either a datetime or epoch seconds from the database, decoded by `start` when needed
+        self._start = start
         self.duration = duration
-        self.stop = self.start + datetime.timedelta(0, self.duration)
-        if active is None:
-            self.is_active = self.active
-        else:
-            self.is_active = bool(active)
+        self._active = active
         self.id = rowid
-        if write_to_db:
-            self.add_to_database()
+
+    @classmethod
+    def from_row(cls, cursor: sqlite3.Cursor, row: tuple) -> "Infraction":
+        """
+        Build an infraction from a database row, to be used as `sqlite3` row factory.
+
+        Only the selected subset of `COLUMNS` is filled in, the rest is left as `None`.
+        """
+        # The mapping is the same for every row of a statement, so it's only built once per description
+        return cls(*[row[index] if index is not None else None for index in _column_indices(cursor.description)])
+
+    @property
+    def start(self) -> datetime.datetime:
+        if not isinstance(self._start, datetime.datetime):
+            self._start = datetime.datetime.fromtimestamp(self._start)
+        return self._start
+
+    @property
+    def stop(self) -> datetime.datetime:
+        return self.start + datetime.timedelta(0, self.duration)
+
+    @property
+    def is_active(self) -> bool:
+        """Active state stored in the database, or determined from the duration for new infractions"""
+        if self._active is None:
+            self._active = self.active
+        return bool(self._active)
 
     @property
     def active(self) -> bool:
@@ -72,130 +345,368 @@ class Infraction:
     def time_since_start(self) -> str:
         return time.time_since(self.start, max_units=2)
 
-    def add_to_database(self) -> None:
+    @property
+    def expiry(self) -> t.Optional[int]:
+        """Epoch seconds at which the infraction expires, `None` for permanent and instant infractions"""
+        if self.duration in (0, 1_000_000_000):
+            return None
+        return int(self.stop.timestamp())
+
+    @property
+    def row(self) -> tuple:
+        """Values of this infraction in the column order of the `infractions` table"""
+        return (self.user_id, self.type, self.reason, self.actor_id,
+                int(self.start.timestamp()), self.duration, int(self.is_active), self.expiry)
+
+    async def add_to_database(self, db: AsyncSQLite) -> None:
         """Add infraction to the database"""
         log.debug(
             f"Adding infraction {self.type} to {self.user_id} by {self.actor_id}, reason: {self.reason} ; {self.str_start} [{self.duration}]")
 
         # In order to prevent SQL Injections use `?` as placeholder and let SQLite handle the input
-        sql_write_command = """INSERT INTO infractions VALUES(?, ?, ?, ?, ?, ?, ?);"""
-        sql_write_args = (self.user_id, self.type, self.reason, self.actor_id,
-                          self.str_start, self.duration, int(self.is_active))
-
-        sql_find_command = """SELECT rowid FROM infractions WHERE(
-                        UID=? and Type=? and Reason=? and ActorID=? and Start=? and Duration=? and Active=?
-        );"""
-        sql_find_args = (self.user_id, self.type, self.reason, self.actor_id,
-                         self.str_start, self.duration, int(self.is_active))
-
-        db = SQLite()
-        db.execute(sql_write_command, sql_write_args)
-        db.execute(sql_find_command, sql_find_args)
-        self.id = db.cur.fetchone()[0]
-        db.close()
-
-    def make_inactive(self) -> None:
-        """Set infraction Active state to 0 in database"""
+        future = db.queue_write(INSERT_COMMAND, self.row)
+        _invalidate(db, self.user_id, future)
+        self.id = await future
+
+    def make_inactive(self, db: AsyncSQLite) -> asyncio.Future:
+        """
+        Set infraction Active state to 0 in database
+
+        The change is committed with the next group commit, await the returned future to wait for it.
+        """
         log.debug(
             f"Deactivating infraction #{self.id}: {self.type} to {self.user_id}, reason: {self.reason}; {self.str_start} [{self.duration}]")
 
-        sql_command = """UPDATE infractions SET Active=0 WHERE rowid=?;"""
+        sql_command = """UPDATE infractions SET Active=0 WHERE ID=?;"""
         sql_args = (self.id, )
 
-        db = SQLite()
-        db.execute(sql_command, sql_args)
-        db.close()
+        future = db.queue_write(sql_command, sql_args)
+        _invalidate(db, self.user_id, future)
+        return future
 
 
-def get_infraction_by_row(row_id: int) -> Infraction:
-    db = SQLite()
-    db.execute("SELECT *, rowid FROM infractions WHERE rowid=?", (row_id, ))
-    try:
-        infraction = Infraction(*db.cur.fetchone())
-        log.debug(f"Getting infraction #{row_id}")
-    except TypeError:
-        infraction = False
-    db.close()
+async def add_infractions(db: AsyncSQLite, infractions: t.List[Infraction]) -> None:
+    """Add multiple infractions to the database in a single transaction and set their IDs"""
+    log.debug(f"Adding {len(infractions)} infractions")
 
+    futures = [db.queue_write(INSERT_COMMAND, infraction.row) for infraction in infractions]
+    for infraction, future in zip(infractions, futures):
+        _invalidate(db, infraction.user_id, future)
+
+    row_ids = await asyncio.gather(*futures)
+    for infraction, row_id in zip(infractions, row_ids):
+        infraction.id = row_id
+
+
+async def _fetch_infractions(
+    db: AsyncSQLite,
+    where: str,
+    args: tuple = (),
+    inf_type: str = None,
+    suffix: str = "",
+    suffix_args: tuple = (),
+    table: str = HISTORY_TABLE
+) -> list:
+    """
+    Get infractions matching the `where` clause (and optionally of `inf_type`) from database
+
+    Queries which only need active infractions should pass `ACTIVE_TABLE`, so the archive isn't searched.
+    """
+    sql_command = f"SELECT {COLUMNS} FROM {table} WHERE {where}"
+    if inf_type:
+        sql_command += " AND Type=?"
+        args += (inf_type, )
+    sql_command += suffix
+    args += suffix_args
+
+    return await db.fetchall(sql_command, args, row_factory=Infraction.from_row)
+
+
+async def get_infraction_by_row(db: AsyncSQLite, row_id: int) -> Infraction:
+    infraction = await db.fetchone(
+        f"SELECT {COLUMNS} FROM {HISTORY_TABLE} WHERE ID=?", (row_id, ), row_factory=Infraction.from_row)
+    if infraction is None:
+        return False
+
+    log.debug(f"Getting infraction #{row_id}")
     return infraction
 
 
-def get_all_active_infractions(inf_type: str = None) -> list:
-    log.debug("Getting all active infractions")
+async def get_expiring_infractions(
+    db: AsyncSQLite,
+    before: t.Optional[datetime.datetime] = None,
+    limit: t.Optional[int] = None
+) -> list:
+    """
+    Get active infractions which have an expiry, ordered by the time they expire.
 
-    # Get all infractions from database
-    db = SQLite()
-    db.execute("SELECT *, rowid FROM infractions WHERE Active=1;")
-    infractions = [infraction for infraction in db.cur.fetchall()]
-    db.close()
+    When `before` is given, only infractions expiring before that time are returned. When `limit`
+    is given, only that many of the soonest expiring infractions are returned.
+    """
+    log.debug(f"Getting active infractions expiring before {before} (limit: {limit})")
 
-    # Convert infractions to Infraction class
-    all_infractions = [Infraction(*infraction) for infraction in infractions]
+    where = "Active=1 AND Expiry IS NOT NULL"
+    args = ()
+    if before is not None:
+        where += " AND Expiry<?"
+        args += (int(before.timestamp()), )
 
-    if inf_type:
-        return [infraction for infraction in all_infractions if infraction.type == inf_type]
-    else:
-        return all_infractions
+    suffix = " ORDER BY Expiry"
+    suffix_args = ()
+    if limit is not None:
+        suffix += " LIMIT ?"
+        suffix_args += (limit, )
 
+    return await _fetch_infractions(db, where, args, suffix=suffix, suffix_args=suffix_args, table=ACTIVE_TABLE)
 
-def get_infractions(user: UserSnowflake, inf_type: str = None) -> list:
-    log.debug(f"Getting infractions of {user}")
 
-    # Get all infractions from database
-    db = SQLite()
-    db.execute("SELECT *, rowid FROM infractions WHERE UID=?", (user.id, ))
-    infractions = [infraction for infraction in db.cur.fetchall()]
-    db.close()
+async def count_overdue_infractions(db: AsyncSQLite, before: datetime.datetime) -> int:
+    """Count the infractions which expired before `before`, but are still active"""
+    row = await db.fetchone(
+        f"SELECT COUNT(*) FROM {ACTIVE_TABLE} WHERE Active=1 AND Expiry<?", (int(before.timestamp()), )
+    )
+    return row[0]
 
-    # Convert infractions to Infraction class
-    all_infractions = [Infraction(*infraction) for infraction in infractions]
 
-    if inf_type:
-        return [infraction for infraction in all_infractions if infraction.type == inf_type]
-    else:
-        return all_infractions
+async def _get_user_infractions(db: AsyncSQLite, user: "UserSnowflake") -> list:
+    """Get all infractions of the user, from the cache if possible"""
+    cache = get_cache(db)
+    infractions = cache.get(user.id)
+    if infractions is None:
+        version = cache.version
+        infractions = await _fetch_infractions(db, "UID=?", (user.id, ))
+        cache.put(user.id, infractions, version)
 
+    return infractions
 
-def get_active_infractions(user: UserSnowflake, inf_type: str = None) -> list:
-    log.debug(f"Getting active infractions of {user}")
 
-    # Get all infractions from database
-    db = SQLite()
-    db.execute(
-        "SELECT *, rowid FROM infractions WHERE UID=? AND Active=1", (user.id, ))
-    infractions = [infraction for infraction in db.cur.fetchall()]
-    db.close()
+async def prefetch_infractions(db: AsyncSQLite, user_ids: t.Iterable[int]) -> None:
+    """
+    Load the infractions of many users into the cache at once.
 
-    # Convert infractions to Infraction class
-    all_infractions = [Infraction(*infraction) for infraction in infractions]
+    Users which are already cached are skipped, the others are looked up in batches, each with a single query.
+    """
+    cache = get_cache(db)
+    user_ids = [user_id for user_id in set(user_ids) if cache.get(user_id, count=False) is None]
 
-    if inf_type:
-        return [infraction for infraction in all_infractions if infraction.type == inf_type]
-    else:
-        return all_infractions
+    for i in range(0, len(user_ids), COUNT_BATCH_SIZE):
+        batch = user_ids[i:i + COUNT_BATCH_SIZE]
+        version = cache.version
+        placeholders = ", ".join("?" * len(batch))
+        infractions = await _fetch_infractions(db, f"UID IN ({placeholders})", tuple(batch))
+
+        by_user = {user_id: [] for user_id in batch}
+        for infraction in infractions:
+            by_user[infraction.user_id].append(infraction)
+        for user_id, user_infractions in by_user.items():
+            cache.put(user_id, user_infractions, version)
 
 
-def get_inactive_infractions(user: UserSnowflake, inf_type: str = None) -> list:
-    log.debug(f"Getting inactive infractions of {user}")
+async def get_infractions(db: AsyncSQLite, user: "UserSnowflake", inf_type: str = None) -> list:
+    log.debug(f"Getting infractions of {user}")
 
-    # Get all infractions from database
-    db = SQLite()
-    db.execute(
-        "SELECT *, rowid FROM infractions WHERE UID=? AND Active=0", (user.id, ))
-    infractions = [infraction for infraction in db.cur.fetchall()]
-    db.close()
+    infractions = await _get_user_infractions(db, user)
+    return [infraction for infraction in infractions if not inf_type or infraction.type == inf_type]
 
-    # Convert infractions to Infraction class
-    all_infractions = [Infraction(*infraction) for infraction in infractions]
 
-    if inf_type:
-        return [infraction for infraction in all_infractions if infraction.type == inf_type]
-    else:
-        return all_infractions
+async def get_active_infractions(db: AsyncSQLite, user: "UserSnowflake", inf_type: str = None) -> list:
+    log.debug(f"Getting active infractions of {user}")
+
+    infractions = await _get_user_infractions(db, user)
+    return [
+        infraction for infraction in infractions
+        if infraction.is_active and (not inf_type or infraction.type == inf_type)
+    ]
+
+
+async def get_infractions_page(
+    db: AsyncSQLite,
+    user: "UserSnowflake",
+    limit: int,
+    before: t.Optional[int] = None,
+    after: t.Optional[int] = None,
+    offset: int = 0
+) -> list:
+    """
+    Get up to `limit` infractions of the user, newest first, using the infraction IDs as keyset.
+
+    With `before`, the infractions directly older than the infraction with that ID are returned,
+    with `after` the ones directly newer than it. Without either, `offset` newer infractions are skipped.
+    """
+    if after is not None:
+        infractions = await _fetch_infractions(
+            db, "UID=? AND ID>?", (user.id, after), suffix=" ORDER BY ID LIMIT ?", suffix_args=(limit, ))
+        return infractions[::-1]
+
+    where = "UID=?"
+    args = (user.id, )
+    if before is not None:
+        where += " AND ID<?"
+        args += (before, )
+
+    if offset:
+        return await _fetch_infractions(
+            db, where, args, suffix=" ORDER BY ID DESC LIMIT ? OFFSET ?", suffix_args=(limit, offset))
+    return await _fetch_infractions(db, where, args, suffix=" ORDER BY ID DESC LIMIT ?", suffix_args=(limit, ))
+
+
+class UserInfractionPages:
+    """
+    Fixed size pages over the infractions of a user, newest first, fetched by keyset queries.
+
+    Only the ID bounds of the visited pages are remembered. Those are enough to fetch the page next to
+    a visited page, the first and the last page, which are all the moves of a reaction paginator.
+    Empty pages have no bounds, e.g. when infractions were removed since they were counted, so the
+    pages past them are fetched by their offset instead.
+    """
+
+    def __init__(self, db: AsyncSQLite, user: "UserSnowflake", total: int, per_page: int):
+        self.db = db
+        self.user = user
+        self.total = total
+        self.per_page = per_page
+        self.page_count = max(-(-total // per_page), 1)
+
+        # Page index: (ID of the newest, ID of the oldest infraction on that page)
+        self._bounds: t.Dict[int, t.Tuple[int, int]] = {}
+
+    async def get(self, page: int) -> list:
+        """Get the infractions on the page with given index"""
+        if page == 0:
+            infractions = await get_infractions_page(self.db, self.user, self.per_page)
+        elif page - 1 in self._bounds:
+            infractions = await get_infractions_page(
+                self.db, self.user, self.per_page, before=self._bounds[page - 1][1])
+        elif page + 1 in self._bounds:
+            infractions = await get_infractions_page(
+                self.db, self.user, self.per_page, after=self._bounds[page + 1][0])
+        elif page == self.page_count - 1:
+            # The last page holds whatever remains after the full pages
+            remaining = self.total - page * self.per_page
+            infractions = await get_infractions_page(self.db, self.user, remaining, after=0)
+        else:
+            infractions = await get_infractions_page(self.db, self.user, self.per_page, offset=page * self.per_page)
+
+        if infractions:
+            self._bounds[page] = (infractions[0].id, infractions[-1].id)
+        return infractions
 
 
-def remove_infraction(infraction: Infraction) -> None:
+def _match_expression(query: str) -> str:
+    """Turn free text into an FTS5 query matching reasons which contain all of its words"""
+    # Quoting every word keeps characters like `-`, `:` or `*` from being parsed as query syntax
+    return " ".join(f'"{word}"' for word in query.replace('"', '""').split())
+
+
+def _search_filter(
+    query: str,
+    inf_type: str = None,
+    since: t.Optional[datetime.datetime] = None
+) -> t.Tuple[str, tuple]:
+    where = "infractions_fts MATCH ?"
+    args = (_match_expression(query), )
+    if inf_type:
+        where += " AND Type=?"
+        args += (inf_type, )
+    if since is not None:
+        where += " AND Start>=?"
+        args += (int(since.timestamp()), )
+    return where, args
+
+
+async def count_search_results(
+    db: AsyncSQLite,
+    query: str,
+    inf_type: str = None,
+    since: t.Optional[datetime.datetime] = None
+) -> int:
+    """Count the infractions whose reason contains all words of `query`"""
+    where, args = _search_filter(query, inf_type, since)
+    return (await db.fetchone(f"SELECT COUNT(*) FROM infractions_fts WHERE {where}", args))[0]
+
+
+async def search_infractions(
+    db: AsyncSQLite,
+    query: str,
+    inf_type: str = None,
+    since: t.Optional[datetime.datetime] = None,
+    limit: int = 10,
+    offset: int = 0
+) -> t.List[t.Tuple["Infraction", str]]:
+    """
+    Search infractions whose reason contains all words of `query`, best matches first.
+
+    Optionally only infractions of `inf_type`, or given `since` some time are searched. Every
+    infraction is returned with a snippet of its reason, with the matching words in bold.
+    """
+    log.debug(f"Searching infractions for {query!r} (type: {inf_type}, since: {since})")
+
+    where, args = _search_filter(query, inf_type, since)
+    hits = await db.fetchall(
+        f"SELECT rowid, snippet(infractions_fts, 0, '**', '**', '...', 16) FROM infractions_fts "
+        f"WHERE {where} ORDER BY rank LIMIT ? OFFSET ?",
+        args + (limit, offset)
+    )
+    if not hits:
+        return []
+
+    ids = tuple(row_id for row_id, _ in hits)
+    infractions = await _fetch_infractions(db, f"ID IN ({', '.join('?' * len(ids))})", ids)
+    by_id = {infraction.id: infraction for infraction in infractions}
+    return [(by_id[row_id], snippet) for row_id, snippet in hits if row_id in by_id]
+
+
+def _count_infractions(infractions: t.Iterable[Infraction]) -> t.Counter[t.Tuple[str, bool]]:
+    return Counter((infraction.type, infraction.is_active) for infraction in infractions)
+
+
+async def get_infraction_counts(db: AsyncSQLite, user: "UserSnowflake") -> t.Counter[t.Tuple[str, bool]]:
+    """
+    Count infractions of the user, grouped by their type and active state.
+
+    The returned counter is keyed by `(type, is_active)` tuples. It is computed from the cached
+    infractions if the user is cached, otherwise by the database, without loading the rows.
+    """
+    log.debug(f"Counting infractions of {user}")
+
+    infractions = get_cache(db).get(user.id, count=False)
+    if infractions is not None:
+        return _count_infractions(infractions)
+
+    return (await get_infraction_counts_for_users(db, (user.id, )))[user.id]
+
+
+async def get_infraction_counts_for_users(
+    db: AsyncSQLite,
+    user_ids: t.Iterable[int]
+) -> t.DefaultDict[int, t.Counter[t.Tuple[str, bool]]]:
+    """
+    Count infractions of many users at once, grouped by user, type and active state.
+
+    Users are looked up in batches, each with a single `GROUP BY` query.
+    """
+    user_ids = list(user_ids)
+    counts = defaultdict(Counter)
+
+    for i in range(0, len(user_ids), COUNT_BATCH_SIZE):
+        batch = user_ids[i:i + COUNT_BATCH_SIZE]
+        placeholders = ", ".join("?" * len(batch))
+        rows = await db.fetchall(
+            f"SELECT UID, Type, Active, COUNT(*) FROM {HISTORY_TABLE} WHERE UID IN ({placeholders}) "
+            "GROUP BY UID, Type, Active",
+            tuple(batch)
+        )
+        for user_id, inf_type, active, count in rows:
+            counts[user_id][(inf_type, bool(active))] += count
+
+    return counts
+
+
+def remove_infraction(db: AsyncSQLite, infraction: Infraction) -> asyncio.Future:
+    """Delete the infraction from the database with the next group commit"""
     row_id = infraction.id
-    db = SQLite()
-    db.execute("DELETE FROM infractions WHERE rowid=?", (row_id, ))
-    db.close()
+    # Both deletes end up in the same group commit
+    db.queue_write("DELETE FROM infractions_archive WHERE ID=?", (row_id, ))
+    future = db.queue_write("DELETE FROM infractions WHERE ID=?", (row_id, ))
+    _invalidate(db, infraction.user_id, future)
+    return future
@@ -1,24 +1,83 @@
 import asyncio
 import contextlib
+import contextvars
+import heapq
+import itertools
 import logging
+import time
 import typing as t
+import weakref
 from abc import abstractmethod
+from datetime import datetime
 from functools import partial
 
 from bot.utils import CogABCMeta
+from bot.utils.stats import FiringLag
+from bot.utils.time import MAX_SLEEP
 
 log = logging.getLogger(__name__)
 
+# Marks the heap entries of cancelled tasks, those are only dropped once they reach the top of the heap
+_REMOVED = object()
+
+# Tasks started later than this many seconds after their deadline are logged as a warning
+LATE_THRESHOLD = 60
+# Differences between the wall clock and the monotonic clock over this many seconds are logged
+DRIFT_THRESHOLD = 1
+
+_schedulers: "weakref.WeakSet[Scheduler]" = weakref.WeakSet()
+
+
+class SchedulerMetrics(t.NamedTuple):
+    name: str
+    pending: int
+    running: int
+    next_due: t.Optional[datetime]
+    lag: FiringLag
+    failures: int
+    drift: float
+
+
+def get_schedulers() -> t.List["Scheduler"]:
+    """Get all of the existing schedulers, ordered by the name of their cog"""
+    return sorted(_schedulers, key=lambda scheduler: scheduler.cog_name)
+
 
 class Scheduler(metaclass=CogABCMeta):
-    """Task scheduler."""
+    """
+    Task scheduler.
+
+    Tasks scheduled `at` a deadline don't get a coroutine until the deadline is reached. Until then,
+    they are kept as small entries of a single heap ordered by the deadline, and one timer of the
+    event loop is armed for the earliest of them.
+
+    Deadlines are epoch seconds, while the timer runs on the loop's monotonic clock. The timer is
+    re-armed at least every `MAX_SLEEP` seconds and the deadlines are compared with the wall clock
+    every time, so clock corrections are caught up with. The difference between both clocks over the
+    last timer period is kept as `drift`.
+    """
 
     def __init__(self):
         # Keep track of the child cog's name so the logs are clear.
         self.cog_name = self.__class__.__name__
 
+        # Tasks which are already running
         self._scheduled_tasks: t.Dict[t.Hashable, asyncio.Task] = {}
 
+        # Tasks waiting for their deadline, as [deadline, sequence, task ID, task data] heap entries
+        self._timers: t.Dict[t.Hashable, list] = {}
+        self._heap: t.List[list] = []
+        # Breaks ties between equal deadlines, so the task IDs and data are never compared
+        self._sequence = itertools.count()
+        self._timer: t.Optional[asyncio.TimerHandle] = None
+
+        self.lag = FiringLag()
+        self.failures = 0
+        self.drift = 0.0
+        # Wall clock and loop time at which the timer was armed
+        self._armed_at: t.Optional[t.Tuple[float, float]] = None
+        _schedulers.add(self)
+
     @abstractmethod
     async def _scheduled_task(self, task_object: t.Any) -> None:
         """
@@ -28,20 +87,34 @@ class Scheduler(metaclass=CogABCMeta):
         code, then clean up the task..
         """
 
-    def schedule_task(self, task_id: t.Hashable, task_data: t.Any) -> None:
+    def schedule_task(self, task_id: t.Hashable, task_data: t.Any, at: t.Optional[datetime] = None) -> None:
         """
         Schedules a task.
 
-        `task_data` is passed to the `Scheduler._scheduled_task()` coroutine.
+        `task_data` is passed to the `Scheduler._scheduled_task()` coroutine, which is started `at`
+        the given (local) time, or right away if it's not given.
         """
         log.debug(f"{self.cog_name}: scheduling task #{task_id}...")
 
-        if task_id in self._scheduled_tasks:
+        if task_id in self._scheduled_tasks or task_id in self._timers:
             log.debug(
                 f"{self.cog_name}: did not schedule task #{task_id}; task was already scheduled."
             )
             return
 
+        if at is None:
+            self._start_task(task_id, task_data)
+            return
+
+        entry = [at.timestamp(), next(self._sequence), task_id, task_data]
+        self._timers[task_id] = entry
+        heapq.heappush(self._heap, entry)
+        # Only a new earliest deadline moves the timer
+        if self._heap[0] is entry:
+            self._arm_timer()
+        log.debug(f"{self.cog_name}: scheduled task #{task_id} at {at}.")
+
+    def _start_task(self, task_id: t.Hashable, task_data: t.Any) -> None:
         task = asyncio.create_task(self._scheduled_task(task_data))
         task.add_done_callback(partial(self._task_done_callback, task_id))
 
@@ -55,6 +128,18 @@ class Scheduler(metaclass=CogABCMeta):
         If `ignore_missing` is True, a warning will not be sent if a task isn't found.
         """
         log.debug(f"{self.cog_name}: cancelling task #{task_id}...")
+
+        entry = self._timers.pop(task_id, None)
+        if entry is not None:
+            entry[2] = _REMOVED
+            entry[3] = None
+            # Don't let the heap fill up with cancelled entries which are far from its top
+            if len(self._heap) > 2 * len(self._timers):
+                self._heap = [entry for entry in self._heap if entry[2] is not _REMOVED]
+                heapq.heapify(self._heap)
+            log.debug(f"{self.cog_name}: unscheduled pending task #{task_id}.")
+            return
+
         task = self._scheduled_tasks.get(task_id)
 
         if not task:
@@ -72,9 +157,66 @@ class Scheduler(metaclass=CogABCMeta):
         """Unschedule all known tasks."""
         log.debug(f"{self.cog_name}: unscheduling all tasks")
 
+        self._timers.clear()
+        self._heap.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
         for task_id in self._scheduled_tasks.copy():
             self.cancel_task(task_id, ignore_missing=True)
 
+    def metrics(self) -> SchedulerMetrics:
+        """Get the amount of pending and running tasks, the next deadline, the firing lag and the failures"""
+        # Drop the cancelled entries, so the top of the heap is the next deadline
+        while self._heap and self._heap[0][2] is _REMOVED:
+            heapq.heappop(self._heap)
+        next_due = datetime.fromtimestamp(self._heap[0][0]) if self._heap else None
+
+        return SchedulerMetrics(
+            self.cog_name, len(self._timers), len(self._scheduled_tasks), next_due, self.lag.copy(), self.failures,
+            self.drift
+        )
+
+    def _arm_timer(self) -> None:
+        """Arm the timer for the earliest deadline, replacing the previous timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._heap:
+            loop = asyncio.get_event_loop()
+            now = time.time()
+            delay = min(max(self._heap[0][0] - now, 0), MAX_SLEEP)
+            self._armed_at = (now, loop.time())
+            # A fresh context, so the tasks don't inherit the context variables of whoever armed the timer
+            self._timer = loop.call_later(delay, self._on_timer, context=contextvars.Context())
+
+    def _on_timer(self) -> None:
+        """Start the tasks whose deadline was reached and arm the timer for the next one."""
+        self._timer = None
+        now = time.time()
+
+        if self._armed_at is not None:
+            armed_wall, armed_loop = self._armed_at
+            self.drift = (now - armed_wall) - (asyncio.get_event_loop().time() - armed_loop)
+            if abs(self.drift) > DRIFT_THRESHOLD:
+                log.info(f"{self.cog_name}: the wall clock moved {self.drift:+.1f}s against the monotonic clock.")
+
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, task_id, task_data = heapq.heappop(self._heap)
+            if task_id is _REMOVED:
+                continue
+            del self._timers[task_id]
+
+            lag = now - deadline
+            self.lag.record(lag * 1000)
+            if lag > LATE_THRESHOLD:
+                log.warning(f"{self.cog_name}: task #{task_id} started {lag:.0f}s after its deadline.")
+            self._start_task(task_id, task_data)
+
+        self._arm_timer()
+
     def _task_done_callback(self, task_id: t.Hashable, done_task: asyncio.Task) -> None:
         """
         Delete the task and raise its exception if one exists.
@@ -109,6 +251,7 @@ class Scheduler(metaclass=CogABCMeta):
             exception = done_task.exception()
             # Log the exception if one exists.
             if exception:
+                self.failures += 1
                 log.error(
                     f"{self.cog_name}: error in task #{task_id} {id(done_task)}!",
                     exc_info=exception
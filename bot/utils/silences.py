@@ -0,0 +1,42 @@
+import datetime
+import logging
+import typing as t
+
+from bot.database import AsyncSQLite
+
+log = logging.getLogger(__name__)
+
+
+class SilenceRecord(t.NamedTuple):
+    channel_id: int
+    actor_id: int
+    expiry: t.Optional[datetime.datetime]
+
+    @classmethod
+    def from_row(cls, _cursor, row: tuple) -> "SilenceRecord":
+        """Row factory decoding the stored epoch seconds"""
+        channel_id, actor_id, expiry = row
+        return cls(channel_id, actor_id, datetime.datetime.fromtimestamp(expiry) if expiry is not None else None)
+
+
+async def add_silence(db: AsyncSQLite, channel_id: int, actor_id: int, expiry: t.Optional[datetime.datetime]) -> None:
+    """Store the silence of `channel_id`, `expiry` is None for indefinite silences."""
+    log.debug(f"Storing silence of channel {channel_id} until {expiry}")
+    await db.execute(
+        "INSERT OR REPLACE INTO silences(ChannelID, ActorID, Expiry) VALUES(?, ?, ?)",
+        (channel_id, actor_id, int(expiry.timestamp()) if expiry is not None else None)
+    )
+
+
+async def remove_silence(db: AsyncSQLite, channel_id: int) -> None:
+    """Forget the silence of `channel_id`."""
+    log.debug(f"Removing silence of channel {channel_id}")
+    await db.execute("DELETE FROM silences WHERE ChannelID=?", (channel_id, ))
+
+
+async def get_expiring_silences(db: AsyncSQLite) -> t.List[SilenceRecord]:
+    """Get the stored silences which have an expiry, soonest first."""
+    return await db.fetchall(
+        "SELECT ChannelID, ActorID, Expiry FROM silences WHERE Expiry IS NOT NULL ORDER BY Expiry",
+        row_factory=SilenceRecord.from_row
+    )
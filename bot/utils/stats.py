@@ -0,0 +1,57 @@
+import typing as t
+
+
+class Histogram:
+    """Count, total, maximum and bucketed distribution of durations in milliseconds"""
+
+    # Upper bounds of the histogram buckets in milliseconds, the last bucket is unbounded
+    BUCKETS: t.Tuple[float, ...] = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+    __slots__ = ("calls", "total", "max", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.BUCKETS) + 1)
+
+    def record(self, milliseconds: float) -> None:
+        self.calls += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+        self.buckets[next((i for i, bound in enumerate(self.BUCKETS) if milliseconds <= bound), -1)] += 1
+
+    def copy(self) -> "Histogram":
+        histogram = type(self)()
+        histogram.calls, histogram.total, histogram.max = self.calls, self.total, self.max
+        histogram.buckets = self.buckets.copy()
+        return histogram
+
+    def merge(self, other: "Histogram") -> None:
+        """Add the durations recorded by `other` to this histogram"""
+        self.calls += other.calls
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.buckets = [mine + theirs for mine, theirs in zip(self.buckets, other.buckets)]
+
+    @property
+    def average(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """Upper bound of the histogram bucket containing the given percentile, `inf` for the last bucket"""
+        rank = self.calls * percent / 100
+        seen = 0
+        for bound, count in zip(self.BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class FiringLag(Histogram):
+    """Histogram of how late waits ended after their deadline, in milliseconds"""
+
+    BUCKETS = (1, 10, 100, 1000, 5000, 30_000, 60_000, 300_000)
+
+    __slots__ = ()
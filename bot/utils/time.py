@@ -1,10 +1,19 @@
 import asyncio
 import datetime
+import time as clock
 from typing import Optional
 
 import dateutil.parser
 from dateutil.relativedelta import relativedelta
 
+from bot.utils.stats import FiringLag
+
+# Longest single sleep, longer waits are re-checked against the wall clock after every one of them
+MAX_SLEEP = 300
+
+# How late the waits of `wait_until` ended
+wait_lag = FiringLag()
+
 
 def _stringify_time_unit(value: int, unit: str) -> str:
     """
@@ -89,15 +98,27 @@ async def wait_until(time: datetime.datetime, start: Optional[datetime.datetime]
     """
     Wait until a given time.
 
-    :param time: A datetime.datetime object to wait until.
-    :param start: The start from which to calculate the waiting duration. Defaults to UTC time.
+    The deadline is kept as epoch seconds and the wait is split into sleeps of at most `MAX_SLEEP`
+    seconds on the event loop's monotonic clock. The remaining time is re-computed from the wall
+    clock after every sleep, so a clock corrected (or a machine suspended) during a long wait doesn't
+    make it end hours early or late. How late the wait ended is recorded in `wait_lag`.
+
+    :param time: A datetime.datetime object to wait until, naive ones are in local time.
+    :param start: The start from which to calculate the waiting duration. Defaults to the current time.
     """
-    delay = time - (start or datetime.datetime.now())
-    delay_seconds = delay.total_seconds()
+    if start is not None:
+        deadline = clock.time() + (time - start).total_seconds()
+    else:
+        deadline = time.timestamp()
+
+    while True:
+        remaining = deadline - clock.time()
+        # Incorporate a small delay so we don't rapid-fire the event due to time precision errors
+        if remaining <= 1.0:
+            break
+        await asyncio.sleep(min(remaining, MAX_SLEEP))
 
-    # Incorporate a small delay so we don't rapid-fire the event due to time precision errors
-    if delay_seconds > 1.0:
-        await asyncio.sleep(delay_seconds)
+    wait_lag.record(max(clock.time() - deadline, 0) * 1000)
 
 
 def until_expiration(
@@ -0,0 +1,278 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from discord.ext import tasks
+
+from bot.cogs.moderation.scheduler import InfractionScheduler
+from bot import constants
+from bot.constants import Scheduling
+from bot.database import AsyncSQLite
+from bot.utils import infractions
+from tests.helpers import MockBot, MockGuild, MockUser
+
+
+HOME = constants.Guild.id
+
+
+class ExpiringScheduler(InfractionScheduler):
+    """Infraction scheduler which pardons without doing anything on Discord."""
+
+    mod_log = MagicMock(send_log_message=AsyncMock())
+
+    async def _pardon_action(self, infraction: infractions.Infraction, guild: MockGuild) -> dict:
+        return {}
+
+
+class LoadExpirationsTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for loading the infraction expirations within the horizon."""
+
+    async def asyncSetUp(self):
+        self.bot = MockBot()
+        self.bot.db = AsyncSQLite(":memory:")
+        self.bot.get_db = AsyncMock(return_value=self.bot.db)
+        self.bot.get_guild_dbs = AsyncMock(return_value={HOME: self.bot.db})
+        await self.bot.db.migrate()
+        with patch.object(tasks.Loop, "start"):
+            self.scheduler = ExpiringScheduler(self.bot)
+
+    async def asyncTearDown(self):
+        self.scheduler.cancel_all()
+        await self.bot.db.close()
+
+    async def add_infraction(self, inf_type: str, hours: float) -> infractions.Infraction:
+        start = datetime.now().replace(microsecond=0)
+        duration = 1_000_000_000 if hours is None else int(hours * 3600)
+        infraction = infractions.Infraction(1, inf_type, "spam", 2, start, duration, active=1)
+        await infraction.add_to_database(self.bot.db)
+        return infraction
+
+    async def test_only_expirations_within_horizon_are_scheduled(self):
+        """Expirations beyond the horizon and permanent infractions should stay in the database."""
+        soon = await self.add_infraction("mute", 1)
+        await self.add_infraction("ban", Scheduling.horizon * 2)
+        await self.add_infraction("ban", None)
+
+        await self.scheduler.load_expirations()
+
+        self.assertEqual(list(self.scheduler._timers), [(HOME, soon.id)])
+        self.assertAlmostEqual(
+            self.scheduler._loaded_until, datetime.now() + timedelta(hours=Scheduling.horizon), delta=timedelta(seconds=5)
+        )
+
+    async def test_refill_keeps_scheduled_expirations(self):
+        """Loading the next window should add the newly due expirations without rescheduling the loaded ones."""
+        soon = await self.add_infraction("mute", 1)
+        await self.scheduler.load_expirations()
+        entry = self.scheduler._timers[(HOME, soon.id)]
+        later = await self.add_infraction("mute", 2)
+
+        await self.scheduler.load_expirations()
+
+        self.assertIs(self.scheduler._timers[(HOME, soon.id)], entry)
+        self.assertEqual(sorted(self.scheduler._timers), [(HOME, soon.id), (HOME, later.id)])
+
+    async def test_expirations_of_every_guild_are_scheduled(self):
+        """Infractions of other guilds should be scheduled apart, even though their IDs are the same."""
+        other = AsyncSQLite(":memory:")
+        await other.migrate()
+        self.addAsyncCleanup(other.close)
+        self.bot.get_guild_dbs.return_value = {HOME: self.bot.db, 2: other}
+        home = await self.add_infraction("mute", 1)
+        infraction = infractions.Infraction(1, "ban", "spam", 2, datetime.now(), 3600)
+        await infraction.add_to_database(other)
+
+        await self.scheduler.load_expirations()
+
+        self.assertEqual(home.id, infraction.id)
+        self.assertEqual(self.scheduler._timers[(2, infraction.id)][3][0], 2)
+        self.assertEqual(sorted(self.scheduler._timers), [(2, infraction.id), (HOME, home.id)])
+
+    async def test_standby_leaves_expirations_to_leader(self):
+        """A standby shouldn't load expirations, and a leader losing the lease should drop the loaded ones."""
+        await self.add_infraction("mute", 1)
+        self.bot.is_leader = False
+        await self.scheduler.load_expirations()
+        self.assertEqual(self.scheduler._timers, {})
+
+        self.bot.is_leader = True
+        await self.scheduler.load_expirations()
+        await self.scheduler.on_leadership_lost()
+
+        self.assertEqual(self.scheduler._timers, {})
+        self.assertEqual(self.scheduler._loaded_until, datetime.min)
+
+    async def test_lease_lost_during_load(self):
+        """Expirations loaded after the lease was lost shouldn't be scheduled."""
+        await self.add_infraction("mute", 1)
+
+        async def lose_lease() -> dict:
+            self.bot.is_leader = False
+            return {HOME: self.bot.db}
+
+        self.bot.get_guild_dbs.side_effect = lose_lease
+        await self.scheduler.load_expirations()
+
+        self.assertEqual(self.scheduler._timers, {})
+        self.assertEqual(self.scheduler._loaded_until, datetime.min)
+
+    async def test_new_leader_drops_cached_infractions(self):
+        """Infractions cached before another instance led should be read again once the lease is acquired."""
+        self.bot.databases = MagicMock(databases=[self.bot.db])
+        infraction = await self.add_infraction("mute", 1)
+        user = MockUser(id=1)
+        await infractions.get_active_infractions(self.bot.db, user)
+        # Written by the other instance, so nothing here is invalidated
+        await self.bot.db.execute("UPDATE infractions SET Active=0 WHERE ID=?", (infraction.id, ))
+
+        await self.scheduler.on_leadership_acquired()
+
+        self.assertEqual(await infractions.get_active_infractions(self.bot.db, user), [])
+        self.assertIsNone(await infractions.get_user_state(self.bot.db, 1))
+
+
+class ExpireInfractionsTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for expiring infractions which fall due together as a batch."""
+
+    async def asyncSetUp(self):
+        self.bot = MockBot()
+        self.bot.db = AsyncSQLite(":memory:")
+        self.bot.get_db = AsyncMock(return_value=self.bot.db)
+        await self.bot.db.migrate()
+        with patch.object(tasks.Loop, "start"):
+            self.scheduler = ExpiringScheduler(self.bot)
+        self.scheduler.mod_log = MagicMock(send_log_message=AsyncMock())
+        self.guild = MockGuild(id=HOME)
+        self.bot.get_guild.return_value = self.guild
+        self.bot.fetch_user.side_effect = lambda user_id: MockUser(id=user_id)
+
+    async def asyncTearDown(self):
+        await self.bot.db.close()
+
+    async def add_expired(self, user_id: int, inf_type: str, duration: int) -> infractions.Infraction:
+        start = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+        infraction = infractions.Infraction(user_id, inf_type, "raid", 3, start, duration, active=1)
+        await infraction.add_to_database(self.bot.db)
+        return infraction
+
+    async def test_batch_shares_lookups_and_log(self):
+        """A batch should fetch every user once, deactivate all infractions and send a single mod log entry."""
+        batch = [
+            await self.add_expired(1, "mute", 60),
+            await self.add_expired(1, "mute", 120),
+            await self.add_expired(2, "ban", 60),
+        ]
+
+        await self.scheduler.expire_infractions(batch)
+        await self.bot.db.flush()
+
+        self.assertEqual(await infractions.get_expiring_infractions(self.bot.db), [])
+        self.assertEqual(sorted(call.args[0] for call in self.bot.fetch_user.await_args_list), [1, 2, 3])
+        self.scheduler.mod_log.send_log_message.assert_awaited_once()
+        kwargs = self.scheduler.mod_log.send_log_message.await_args.kwargs
+        self.assertEqual(kwargs["title"], "Infractions expired: 3")
+        self.assertEqual(kwargs["footer"], "Infraction IDs: 1, 2, 3")
+
+    async def test_failed_deactivation_is_reported(self):
+        """A failed deactivation shouldn't stop the rest of the batch and should be noted in the log entry."""
+        batch = [await self.add_expired(1, "mute", 60), await self.add_expired(2, "ban", 60)]
+
+        with patch.object(ExpiringScheduler, "_pardon_action", side_effect=[RuntimeError, {}]):
+            await self.scheduler.expire_infractions(batch)
+
+        kwargs = self.scheduler.mod_log.send_log_message.await_args.kwargs
+        self.assertIn("#1 mute of <@1> (failed: ", kwargs["text"])
+        self.assertIn("#2 ban of <@2>\n", kwargs["text"])
+        self.assertEqual(self.scheduler.failures, 1)
+
+    async def test_failed_batch_is_counted(self):
+        """Every infraction of a batch which failed to expire should count as a failure of the scheduler."""
+        batch = [await self.add_expired(user_id, "mute", 60) for user_id in range(2)]
+
+        with patch.object(Scheduling, "batch_window", 0.01), \
+                patch.object(ExpiringScheduler, "expire_infractions", side_effect=RuntimeError):
+            for infraction in batch:
+                await self.scheduler._scheduled_task((HOME, infraction))
+            await asyncio.sleep(0.05)
+
+        self.assertEqual(self.scheduler.metrics().failures, 2)
+
+    async def test_expirations_are_coalesced(self):
+        """Expirations falling due within the batch window should be expired with a single call."""
+        batch = [await self.add_expired(user_id, "mute", 60) for user_id in range(3)]
+
+        with patch.object(Scheduling, "batch_window", 0.01), \
+                patch.object(ExpiringScheduler, "expire_infractions", autospec=True) as expire_infractions:
+            for infraction in batch:
+                await self.scheduler._scheduled_task((HOME, infraction))
+            await asyncio.sleep(0.05)
+
+        expire_infractions.assert_awaited_once_with(self.scheduler, batch, self.guild)
+
+    async def test_cancelled_expiration_leaves_batch(self):
+        """An infraction pardoned while waiting for its batch shouldn't be expired with it."""
+        batch = [await self.add_expired(user_id, "mute", 60) for user_id in range(2)]
+
+        with patch.object(Scheduling, "batch_window", 0.01), \
+                patch.object(ExpiringScheduler, "expire_infractions", autospec=True) as expire_infractions:
+            for infraction in batch:
+                await self.scheduler._scheduled_task((HOME, infraction))
+            self.scheduler.cancel_task((HOME, batch[0].id), ignore_missing=True)
+            await asyncio.sleep(0.05)
+
+        expire_infractions.assert_awaited_once_with(self.scheduler, batch[1:], self.guild)
+
+    async def test_waiting_expiration_is_not_rescheduled(self):
+        """Loading the expirations while a batch waits shouldn't add its infractions to the batch again."""
+        batch = [await self.add_expired(user_id, "mute", 60) for user_id in range(2)]
+        self.bot.get_guild_dbs = AsyncMock(return_value={HOME: self.bot.db})
+
+        with patch.object(Scheduling, "batch_window", 0.01), \
+                patch.object(ExpiringScheduler, "expire_infractions", autospec=True) as expire_infractions:
+            for infraction in batch:
+                await self.scheduler._scheduled_task((HOME, infraction))
+            await self.scheduler.load_expirations()
+            await self.scheduler._scheduled_task((HOME, batch[0]))
+            await asyncio.sleep(0.05)
+
+        self.assertEqual(self.scheduler._timers, {})
+        expire_infractions.assert_awaited_once_with(self.scheduler, batch, self.guild)
+
+    async def test_lost_lease_drops_waiting_batch(self):
+        """A batch waiting to be expired should be left to the new leader once the lease is lost."""
+        batch = [await self.add_expired(user_id, "mute", 60) for user_id in range(2)]
+
+        with patch.object(Scheduling, "batch_window", 0.01), \
+                patch.object(ExpiringScheduler, "expire_infractions", autospec=True) as expire_infractions:
+            for infraction in batch:
+                await self.scheduler._scheduled_task((HOME, infraction))
+            await self.scheduler.on_leadership_lost()
+            await asyncio.sleep(0.05)
+
+        expire_infractions.assert_not_awaited()
+        self.assertEqual(self.scheduler.metrics().failures, 0)
+
+    async def test_inactive_infractions_are_skipped(self):
+        """Infractions deactivated since they were loaded shouldn't be expired again."""
+        batch = [await self.add_expired(user_id, "mute", 60) for user_id in range(3)]
+        pardoned = (await infractions.get_active_infractions(self.bot.db, MockUser(id=0)))[0]
+        pardoned.make_inactive(self.bot.db)
+
+        await self.scheduler.expire_infractions(batch)
+
+        self.scheduler.mod_log.send_log_message.assert_awaited_once()
+        kwargs = self.scheduler.mod_log.send_log_message.await_args.kwargs
+        self.assertEqual(kwargs["title"], "Infractions expired: 2")
+        self.assertEqual(kwargs["footer"], "Infraction IDs: 2, 3")
+
+    async def test_infractions_are_lifted_in_their_guild(self):
+        """Expired infractions of another guild should be lifted in that guild."""
+        guild = MockGuild(id=2)
+        batch = [await self.add_expired(1, "ban", 60)]
+
+        with patch.object(ExpiringScheduler, "_pardon_action", autospec=True, return_value={}) as pardon_action:
+            await self.scheduler.expire_infractions(batch, guild)
+
+        pardon_action.assert_awaited_once_with(self.scheduler, batch[0], guild)
+        self.bot.get_db.assert_awaited_with(2)
@@ -0,0 +1,79 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import discord
+from discord import PermissionOverwrite
+
+from bot.cogs.moderation.silence import Silence
+from bot.constants import Guild
+from bot.database import AsyncSQLite
+from bot.utils import silences
+from tests.helpers import MockBot, MockRole, MockTextChannel
+
+
+class SilenceCogTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the restart safe silences of the `Silence` cog."""
+
+    async def asyncSetUp(self):
+        self.bot = MockBot()
+        self.bot.db = AsyncSQLite(":memory:")
+        self.bot.get_db = AsyncMock(return_value=self.bot.db)
+        self.bot.get_guild_dbs = AsyncMock(return_value={Guild.id: self.bot.db})
+        await self.bot.db.migrate()
+        self.cog = Silence(self.bot)
+
+    async def asyncTearDown(self):
+        self.cog.cancel_all()
+        await self.bot.db.close()
+
+    async def test_stored_silences_are_rescheduled(self):
+        """Timed silences stored before a restart should be scheduled once the guild is available."""
+        expiry = (datetime.now() + timedelta(minutes=5)).replace(microsecond=0)
+        await silences.add_silence(self.bot.db, 1, 10, expiry)
+        await silences.add_silence(self.bot.db, 2, 10, None)
+
+        await self.cog._get_instance_vars()
+
+        self.assertEqual(list(self.cog._timers), [1])
+        self.assertEqual(self.cog._timers[1][0], expiry.timestamp())
+
+    async def test_silences_of_every_guild_are_rescheduled(self):
+        """The silences stored in the database of every guild should be scheduled with the guild they belong to."""
+        other = AsyncSQLite(":memory:")
+        await other.migrate()
+        self.addAsyncCleanup(other.close)
+        self.bot.get_guild_dbs.return_value = {Guild.id: self.bot.db, 2: other}
+        expiry = datetime.now() + timedelta(minutes=5)
+        await silences.add_silence(self.bot.db, 1, 10, expiry)
+        await silences.add_silence(other, 3, 10, expiry)
+
+        await self.cog._load_silences()
+
+        self.assertEqual(self.cog._timers[1][3], (Guild.id, 1))
+        self.assertEqual(self.cog._timers[3][3], (2, 3))
+
+    async def test_silence_of_deleted_channel_is_forgotten(self):
+        """An expired silence of a channel which no longer exists should be removed from the database."""
+        await silences.add_silence(self.bot.db, 1, 10, datetime.now())
+        self.bot.get_channel.return_value = None
+
+        await self.cog._scheduled_task((Guild.id, 1))
+
+        self.assertEqual(await silences.get_expiring_silences(self.bot.db), [])
+
+    async def test_silence_is_kept_until_lifted(self):
+        """A silence should stay stored when lifting it fails, and be forgotten once it was lifted."""
+        await silences.add_silence(self.bot.db, 1, 10, datetime.now())
+        self.cog._guests_role = MockRole()
+        channel = MockTextChannel(id=1)
+        channel.overwrites_for.return_value = PermissionOverwrite(send_messages=False)
+        self.bot.actions.run = AsyncMock(side_effect=discord.HTTPException(MagicMock(status=503), "unavailable"))
+
+        with self.assertRaises(discord.HTTPException):
+            await self.cog._unsilence(channel)
+        self.assertEqual(len(await silences.get_expiring_silences(self.bot.db)), 1)
+
+        self.bot.actions.run.side_effect = None
+        self.assertTrue(await self.cog._unsilence(channel))
+        self.assertEqual(await silences.get_expiring_silences(self.bot.db), [])
@@ -0,0 +1,74 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock
+
+from bot.actions import ActionExecutor, Priority, current_priority
+
+
+class ActionExecutorTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the rate limited executor of Discord actions."""
+
+    async def asyncSetUp(self):
+        self.executor = ActionExecutor(rate=1, per=0.05, routes={"ban": {"rate": 3, "per": 0.05}})
+        self.started = []
+
+    async def asyncTearDown(self):
+        await self.executor.close()
+
+    def action(self, name: str):
+        async def action() -> str:
+            self.started.append(name)
+            return name
+        return action
+
+    async def test_higher_priority_goes_first(self):
+        """Queued staff actions should be started before the automatic and background ones."""
+        futures = [
+            self.executor.submit("roles", 1, self.action("first guest"), Priority.BACKGROUND),
+            self.executor.submit("roles", 1, self.action("second guest"), Priority.BACKGROUND),
+            self.executor.submit("roles", 1, self.action("expiry"), Priority.AUTOMATIC),
+            self.executor.submit("roles", 1, self.action("staff"), Priority.STAFF),
+        ]
+
+        await asyncio.gather(*futures)
+
+        self.assertEqual(self.started, ["staff", "expiry", "first guest", "second guest"])
+
+    async def test_routes_are_rate_limited(self):
+        """A route should start no more actions than its bucket allows, separately for every major ID."""
+        started = time.monotonic()
+        await asyncio.gather(*(self.executor.run("ban", 1, self.action(str(i))) for i in range(3)))
+        await self.executor.run("ban", 2, self.action("other guild"))
+        self.assertLess(time.monotonic() - started, 0.04)
+
+        await self.executor.run("ban", 1, self.action("limited"))
+        self.assertGreaterEqual(time.monotonic() - started, 0.01)
+
+    async def test_duplicate_actions_are_coalesced(self):
+        """Queued actions with the same key should be executed once, taking the highest priority."""
+        self.executor.submit("roles", 1, self.action("blocker"))
+        duplicate = AsyncMock(return_value="added")
+        results = asyncio.gather(
+            self.executor.run("roles", 1, duplicate, Priority.BACKGROUND, key=("add_role", 5)),
+            self.executor.run("roles", 1, self.action("expiry"), Priority.AUTOMATIC),
+            self.executor.run("roles", 1, duplicate, Priority.STAFF, key=("add_role", 5)),
+        )
+
+        self.assertEqual(await results, ["added", "expiry", "added"])
+        duplicate.assert_awaited_once()
+        self.assertEqual(self.started, ["blocker", "expiry"])
+        self.assertEqual(self.executor.queued(), {priority: 0 for priority in Priority})
+
+    async def test_exceptions_reach_the_caller(self):
+        """An exception of an action should be raised to everyone waiting for it."""
+        with self.assertRaises(RuntimeError):
+            await self.executor.run("ban", 1, AsyncMock(side_effect=RuntimeError))
+
+    async def test_priority_defaults_to_context(self):
+        """Actions submitted without a priority should use the priority of the current context."""
+        self.executor.submit("roles", 1, self.action("automatic"))
+        current_priority.set(Priority.STAFF)
+        await self.executor.run("roles", 1, self.action("staff"))
+
+        self.assertEqual(self.started, ["staff"])
@@ -10,6 +10,7 @@ from bot.converters import (
     DiceThrow,
     Duration,
     ISODelta,
+    InfractionType,
 )
 
 
@@ -257,3 +258,23 @@ class ConverterTests(unittest.TestCase):
                 with self.assertRaises(BadArgument, msg=exception_message):
                     asyncio.run(converter.convert(
                         self.context, datetime_string))
+
+    def test_infraction_type_converter(self):
+        """InfractionType converter accepts known types in any case and in plural."""
+        test_values = (
+            ("ban", "ban"),
+            ("Mutes", "mute"),
+            ("WARN", "warn"),
+        )
+
+        converter = InfractionType()
+        for argument, expected in test_values:
+            with self.subTest(argument=argument):
+                self.assertEqual(asyncio.run(converter.convert(self.context, argument)), expected)
+
+    def test_infraction_type_converter_for_invalid(self):
+        """InfractionType converter raises BadArgument for words which aren't infraction types."""
+        converter = InfractionType()
+        for argument in ("scam", "s", "bans2"):
+            with self.subTest(argument=argument), self.assertRaises(BadArgument):
+                asyncio.run(converter.convert(self.context, argument))
@@ -0,0 +1,326 @@
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+from bot.constants import Database
+from bot.database import MIGRATIONS, AsyncSQLite, ShardedDatabase, SQLite, StatementStatistics
+
+
+class AsyncSQLiteTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the `AsyncSQLite` database service."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncSQLite(":memory:")
+        await self.db.migrate()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def test_statements_share_one_connection(self):
+        """Rows written by one statement should be visible to the next, as the connection stays open."""
+        await self.db.execute("INSERT INTO users VALUES(?, ?, ?)", (1, 0, 0))
+        await self.db.execute("INSERT INTO users VALUES(?, ?, ?)", (2, 1, 0))
+
+        rows = await self.db.fetchall("SELECT UID FROM users ORDER BY UID")
+        self.assertEqual(rows, [(1, ), (2, )])
+
+    async def test_fetchone_returns_none_for_no_rows(self):
+        """`fetchone` should return `None` when the statement matched nothing."""
+        self.assertIsNone(await self.db.fetchone("SELECT * FROM users WHERE UID=?", (42, )))
+
+    async def test_statements_run_on_worker_thread(self):
+        """Statements should never be executed on the thread running the event loop."""
+        main_thread = threading.get_ident()
+        worker_thread = await self.db._run(threading.get_ident)
+
+        self.assertNotEqual(main_thread, worker_thread)
+
+
+class MigrationTests(unittest.TestCase):
+    """Tests for the schema migration runner."""
+
+    def setUp(self):
+        self.db = SQLite(":memory:")
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_migrate_applies_all_migrations(self):
+        """A fresh database should be migrated to the latest version, recording every step."""
+        self.assertEqual(self.db.migrate(), len(MIGRATIONS))
+
+        versions = self.db.fetchall("SELECT version FROM schema_version ORDER BY version;")
+        self.assertEqual(versions, [(version, ) for version in range(1, len(MIGRATIONS) + 1)])
+
+    def test_migrate_is_idempotent(self):
+        """Running the migrations again should not apply anything twice."""
+        self.db.migrate()
+        self.db.migrate()
+
+        count = self.db.fetchone("SELECT COUNT(*) FROM schema_version;")[0]
+        self.assertEqual(count, len(MIGRATIONS))
+
+    def test_migrate_keeps_existing_unversioned_tables(self):
+        """Databases created before versioning should keep their data."""
+        self.db.execute("CREATE TABLE infractions(UID INTEGER, Type TEXT, Reason TEXT, ActorID INTEGER, "
+                        "Start TEXT, Duration INTEGER, Active INTEGER);")
+        self.db.execute("INSERT INTO infractions VALUES(1, 'warn', 'spam', 2, '2020/01/01 00:00:00', 0, 1);")
+
+        self.db.migrate()
+
+        self.assertEqual(self.db.fetchone("SELECT COUNT(*) FROM infractions;")[0], 1)
+
+    def test_migrate_converts_start_to_epoch(self):
+        """Textual local start times should be converted to epoch seconds and get an expiry."""
+        self.db.execute("CREATE TABLE infractions(UID INTEGER, Type TEXT, Reason TEXT, ActorID INTEGER, "
+                        "Start TEXT, Duration INTEGER, Active INTEGER);")
+        self.db.execute("INSERT INTO infractions VALUES(1, 'mute', 'spam', 2, '2020/01/01 12:00:00', 60, 1);")
+        self.db.execute("INSERT INTO infractions VALUES(1, 'ban', 'spam', 2, '2020/01/01 12:00:00', 1000000000, 1);")
+
+        self.db.migrate()
+
+        start = int(datetime(2020, 1, 1, 12, 0, 0).timestamp())
+        self.assertEqual(
+            self.db.fetchall("SELECT rowid, Start, Expiry FROM infractions ORDER BY rowid;"),
+            [(1, start, start + 60), (2, start, None)]
+        )
+
+    def test_migrate_archives_inactive_infractions(self):
+        """Inactive infractions should be moved into the archive, without their IDs ever being reused."""
+        self.db.execute("CREATE TABLE infractions(UID INTEGER, Type TEXT, Reason TEXT, ActorID INTEGER, "
+                        "Start TEXT, Duration INTEGER, Active INTEGER);")
+        self.db.execute("INSERT INTO infractions VALUES(1, 'mute', 'spam', 2, '2020/01/01 12:00:00', 60, 1);")
+        self.db.execute("INSERT INTO infractions VALUES(1, 'warn', 'spam', 2, '2020/01/01 12:00:00', 0, 0);")
+
+        self.db.migrate()
+        new_id = self.db.insert(
+            "INSERT INTO infractions(UID, Type, Reason, ActorID, Start, Duration, Active) VALUES(1, 'warn', 'spam', 2, 0, 0, 1);")
+
+        self.assertEqual(self.db.fetchall("SELECT ID FROM infractions ORDER BY ID;"), [(1, ), (3, )])
+        self.assertEqual(self.db.fetchall("SELECT ID FROM infractions_archive;"), [(2, )])
+        self.assertEqual(new_id, 3)
+
+    def test_deactivated_infractions_are_archived(self):
+        """Inserting or deactivating an inactive infraction should move it into the archive."""
+        self.db.migrate()
+        insert = "INSERT INTO infractions(UID, Type, Reason, ActorID, Start, Duration, Active) VALUES(1, 'warn', 'spam', 2, 0, 0, ?);"
+        inactive_id = self.db.insert(insert, (0, ))
+        active_id = self.db.insert(insert, (1, ))
+
+        self.db.execute("UPDATE infractions SET Active=0 WHERE ID=?;", (active_id, ))
+
+        self.assertEqual(self.db.fetchone("SELECT COUNT(*) FROM infractions;"), (0, ))
+        self.assertEqual(self.db.fetchall("SELECT ID FROM all_infractions ORDER BY ID;"), [(inactive_id, ), (active_id, )])
+
+    def test_user_lookups_use_index(self):
+        """Looking up active infractions of a user should not scan the whole table."""
+        self.db.migrate()
+
+        plan = self.db.fetchall(
+            "EXPLAIN QUERY PLAN SELECT *, rowid FROM infractions WHERE UID=? AND Active=1", (1, ))
+        self.assertIn("ix_infractions_user", " ".join(row[-1] for row in plan))
+
+
+class WriteQueueTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the group commit write queue of `AsyncSQLite`."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncSQLite(":memory:", flush_interval=0.01)
+        await self.db.migrate()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def test_queued_writes_are_committed_together(self):
+        """Writes queued within one tick should be committed in a single transaction."""
+        with patch.object(SQLite, "execute_batch", autospec=True, side_effect=SQLite.execute_batch) as execute_batch:
+            rowids = await asyncio.gather(*(
+                self.db.queue_write("INSERT INTO users VALUES(?, ?, ?)", (uid, 0, 0)) for uid in range(1, 11)
+            ))
+
+        execute_batch.assert_called_once()
+        self.assertEqual(rowids, list(range(1, 11)))
+
+    async def test_reads_see_queued_writes(self):
+        """A read should never return data older than a write queued before it."""
+        self.db.queue_write("INSERT INTO users VALUES(?, ?, ?)", (1, 0, 0))
+
+        self.assertEqual(await self.db.fetchone("SELECT COUNT(*) FROM users"), (1, ))
+
+    async def test_failed_flush_rolls_back_and_sets_exception(self):
+        """A failing statement should roll back the whole batch and fail every waiting future."""
+        good = self.db.queue_write("INSERT INTO users VALUES(?, ?, ?)", (1, 0, 0))
+        bad = self.db.queue_write("INSERT INTO missing_table VALUES(?)", (1, ))
+
+        with self.assertLogs("bot.database", level="ERROR"):
+            await self.db.flush()
+
+        for future in (good, bad):
+            with self.subTest(future=future), self.assertRaises(sqlite3.OperationalError):
+                future.result()
+        self.assertEqual(await self.db.fetchone("SELECT COUNT(*) FROM users"), (0, ))
+
+    async def test_close_commits_queued_writes(self):
+        """Closing the database should not lose writes which were still queued."""
+        future = self.db.queue_write("INSERT INTO users VALUES(?, ?, ?)", (1, 0, 0))
+
+        await self.db.close()
+
+        self.assertEqual(future.result(), 1)
+        # Re-open so that tearDown can close it again
+        self.db = AsyncSQLite(":memory:")
+
+
+class ReadPoolTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the WAL mode read connection pool of `AsyncSQLite`."""
+
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = AsyncSQLite(str(Path(self.tmp_dir.name, "test.db")), read_connections=2)
+        await self.db.migrate()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmp_dir.cleanup()
+
+    async def test_database_uses_wal(self):
+        """The writer connection should switch the database to write-ahead logging."""
+        self.assertEqual(await self.db.fetchone("PRAGMA journal_mode;"), ("wal", ))
+
+    async def test_reads_run_on_read_only_connections(self):
+        """Reads should be executed on the read pool, whose connections refuse to write."""
+        await self.db.fetchone("SELECT 1;")
+        self.assertEqual(len(self.db._readers), 1)
+
+        with self.assertRaises(sqlite3.OperationalError):
+            await self.db._read("execute", "INSERT INTO users VALUES(1, 0, 0);")
+
+    async def test_reads_see_committed_writes(self):
+        """Pooled connections should see writes committed by the writer connection."""
+        await self.db.queue_write("INSERT INTO users VALUES(?, ?, ?)", (1, 0, 0))
+
+        self.assertEqual(await self.db.fetchall("SELECT UID FROM users"), [(1, )])
+
+    async def test_reads_wait_for_running_group_commit(self):
+        """A read issued while a group commit is running should see its writes."""
+        execute_batch = SQLite.execute_batch
+
+        def slow_batch(db, *args):
+            time.sleep(0.05)
+            return execute_batch(db, *args)
+
+        self.db.queue_write("INSERT INTO users VALUES(?, ?, ?)", (1, 0, 0))
+        with patch.object(SQLite, "execute_batch", autospec=True, side_effect=slow_batch):
+            flush = asyncio.create_task(self.db.flush())
+            await asyncio.sleep(0.01)
+
+            self.assertEqual(await self.db.fetchone("SELECT COUNT(*) FROM users"), (1, ))
+            await flush
+
+
+class QueryStatisticsTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the statement timing of the database layer."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncSQLite(":memory:")
+        await self.db.migrate()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def test_statements_are_attributed_to_caller(self):
+        """Reads and queued writes should be recorded under the coroutine which issued them."""
+        await self.db.queue_write("INSERT INTO users VALUES(?, ?, ?)", (1, 0, 0))
+        await self.db.fetchall("SELECT UID FROM users WHERE UID IN (?, ?)", (1, 2))
+        await self.db.fetchall("SELECT UID FROM users WHERE UID IN (?, ?, ?)", (1, 2, 3))
+
+        stats = dict(self.db.stats.top(100))
+        caller = f"{__name__}.test_statements_are_attributed_to_caller"
+
+        self.assertEqual(stats["INSERT INTO users VALUES(?, ?, ?)"].callers, {caller: 1})
+        self.assertEqual(stats["SELECT UID FROM users WHERE UID IN (...)"].callers, {caller: 2})
+
+    async def test_slow_statements_are_logged_with_plan(self):
+        """Statements over the threshold should be logged together with their query plan."""
+        with patch.object(Database, "slow_query_ms", 0), self.assertLogs("bot.database", "WARNING") as logs:
+            await self.db.fetchall("SELECT * FROM infractions WHERE UID=?", (1, ))
+
+        self.assertIn("Query plan:", logs.output[0])
+        self.assertIn("USING INDEX", logs.output[0])
+
+    def test_percentiles_use_histogram_buckets(self):
+        """Percentiles should be reported as the upper bound of the bucket they fall into."""
+        stats = StatementStatistics()
+        for milliseconds in (0.05, 0.2, 0.2, 3, 2000):
+            stats.record("caller", milliseconds)
+
+        self.assertEqual(stats.percentile(50), 0.25)
+        self.assertEqual(stats.percentile(80), 5)
+        self.assertEqual(stats.percentile(100), float("inf"))
+
+
+class ShardedDatabaseTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the routing of guilds to their database shards."""
+
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.shards = ShardedDatabase(
+            home_guild_id=1,
+            db_name=str(Path(self.tmp_dir.name, "users.db")),
+            shard_dir=str(Path(self.tmp_dir.name, "shards")),
+            shard_by_guild=True,
+            read_connections=1,
+        )
+        await self.shards.home.migrate()
+
+    async def asyncTearDown(self):
+        await self.shards.close()
+        self.tmp_dir.cleanup()
+
+    async def test_guilds_get_own_migrated_files(self):
+        """Every guild except the home one should get its own, migrated database file."""
+        home = await self.shards.get(1)
+        shard = await self.shards.get(2)
+
+        self.assertIs(home, self.shards.home)
+        self.assertEqual(Path(shard.db_name), Path(self.tmp_dir.name, "shards", "users-2.db"))
+        await shard.insert("INSERT INTO users VALUES(?, ?, ?)", (5, None, None))
+        self.assertEqual(await shard.fetchall("SELECT UID FROM users"), [(5, )])
+        self.assertEqual(await home.fetchall("SELECT UID FROM users"), [])
+
+    async def test_shard_is_opened_once(self):
+        """Concurrent requests for a shard should all get the same, single connection."""
+        shards = await asyncio.gather(*(self.shards.get(2) for _ in range(5)))
+
+        self.assertEqual(len({id(shard) for shard in shards}), 1)
+        self.assertIs(await self.shards.get(2), shards[0])
+        self.assertEqual(self.shards.databases, [self.shards.home, shards[0]])
+
+    async def test_without_sharding_all_guilds_share_home(self):
+        """With sharding disabled, every guild should be routed to the home database."""
+        self.shards.shard_by_guild = False
+
+        self.assertIs(await self.shards.get(2), self.shards.home)
+        self.assertFalse(Path(self.tmp_dir.name, "shards").exists())
+        # The shared database doesn't record the guild of an infraction, so only the home guild is moderated
+        self.assertTrue(self.shards.has_own_database(1))
+        self.assertFalse(self.shards.has_own_database(2))
+
+    async def test_stats_are_combined_across_shards(self):
+        """The statistics of the shards should be combined by statement, resetting should clear all of them."""
+        shard = await self.shards.get(2)
+        for db in (self.shards.home, shard, shard):
+            await db.fetchall("SELECT UID FROM users WHERE UID=?", (1, ))
+
+        (sql, stats), = [item for item in self.shards.stats.top(100) if "FROM users" in item[0]]
+        self.assertEqual(stats.calls, 3)
+        self.assertEqual(sum(stats.buckets), 3)
+
+        self.shards.reset_stats()
+        self.assertEqual(self.shards.stats.top(100), [])
@@ -0,0 +1,76 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from bot.database import AsyncSQLite
+from bot.leadership import BOT_LEASE, Lease, acquire_lease
+
+
+class LeaseTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the lease keeping a single instance of the bot active."""
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        db_name = str(Path(self.directory.name, "users.db"))
+        # Every instance has its own connection to the shared database file
+        self.dbs = [AsyncSQLite(db_name, read_connections=1), AsyncSQLite(db_name, read_connections=1)]
+        await self.dbs[0].migrate()
+        self.old = Lease(self.dbs[0], MagicMock(), duration=0.2, heartbeat_interval=0.05)
+        self.new = Lease(self.dbs[1], MagicMock(), duration=0.2, heartbeat_interval=0.05)
+
+    async def asyncTearDown(self):
+        for lease in (self.old, self.new):
+            await lease.close()
+        for db in self.dbs:
+            await db.close()
+        self.directory.cleanup()
+
+    async def test_only_one_instance_leads(self):
+        """The first instance should lead, the second one should stay a standby while the lease is renewed."""
+        self.assertTrue(await self.old.renew())
+        self.assertFalse(await self.new.renew())
+        self.assertTrue(await self.old.renew())
+
+        self.old.dispatch.assert_called_once_with("leadership_acquired")
+        self.new.dispatch.assert_not_called()
+
+    async def test_standby_takes_over_released_lease(self):
+        """A lease released on shutdown should be taken over by the standby at its next heartbeat."""
+        await self.old.renew()
+        self.new.start()
+        await asyncio.sleep(0.02)
+        self.assertFalse(self.new.is_leader)
+
+        await self.old.close()
+        await asyncio.wait_for(self.new.wait_until_leader(), timeout=0.15)
+
+    async def test_expired_lease_is_taken_over(self):
+        """A leader which stopped renewing the lease should lose it to the standby once it expired."""
+        await self.old.renew()
+        self.assertFalse(await acquire_lease(self.dbs[1], BOT_LEASE, self.new.holder, 0.2))
+
+        await asyncio.sleep(0.25)
+
+        self.assertTrue(await self.new.renew())
+
+    async def test_leader_steps_down_before_lease_expires(self):
+        """A leader failing to renew should step down before a standby could take the expired lease over."""
+        await self.old.renew()
+
+        with patch("bot.leadership.acquire_lease", side_effect=RuntimeError):
+            self.assertTrue(await self.old.renew())
+            await asyncio.sleep(0.15)
+            self.assertFalse(await self.old.renew())
+
+        self.old.dispatch.assert_called_with("leadership_lost")
+
+    async def test_heartbeat_statements_are_attributed_to_lease(self):
+        """Statements of the heartbeat should be attributed to the lease functions, not to the event loop."""
+        self.dbs[0].stats.reset()
+        self.old.start()
+        await asyncio.sleep(0.02)
+
+        callers = {caller for _, stats in self.dbs[0].stats.top(10) for caller in stats.callers}
+        self.assertEqual(callers, {"bot.leadership.acquire_lease"})
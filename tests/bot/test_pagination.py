@@ -1,6 +1,11 @@
-from unittest import TestCase
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import AsyncMock
+
+from discord import Embed
 
 from bot import pagination
+from tests.helpers import MockContext, MockMember, MockMessage, MockReaction
 
 
 class LinePaginatorTests(TestCase):
@@ -22,6 +27,58 @@ class LinePaginatorTests(TestCase):
         self.paginator.add_line("x" * (self.paginator.max_size - 3))
 
 
+class LazyLinePaginatorTests(IsolatedAsyncioTestCase):
+    """Tests for paginating over pages which are fetched once they are viewed."""
+
+    def setUp(self):
+        self.ctx = MockContext()
+        self.message = MockMessage()
+        self.ctx.send.return_value = self.message
+        self.get_page = AsyncMock(side_effect=lambda page: [f"line of page {page}"])
+
+    def react(self, *emojis: str) -> None:
+        """Make the paginator see reactions with `emojis`, followed by a timeout."""
+        reactions = [(MockReaction(emoji=emoji, message=self.message), MockMember()) for emoji in emojis]
+        self.ctx.bot.wait_for.side_effect = [*reactions, asyncio.TimeoutError]
+
+    async def test_single_page_is_sent_without_reactions(self):
+        """A single page should be sent on its own, without waiting for reactions."""
+        embed = Embed()
+        await pagination.LinePaginator.paginate_lazily(self.get_page, 1, self.ctx, embed, footer_text="footer")
+
+        self.get_page.assert_awaited_once_with(0)
+        self.ctx.send.assert_awaited_once_with(embed=embed)
+        self.assertEqual(embed.description, "\nline of page 0\n")
+        self.assertEqual(embed.footer.text, "footer")
+        self.message.add_reaction.assert_not_called()
+        self.ctx.bot.wait_for.assert_not_called()
+
+    async def test_only_viewed_pages_are_fetched(self):
+        """Pages should be fetched once they are moved to, moves past the first or last page are ignored."""
+        embed = Embed()
+        self.react(pagination.LEFT_EMOJI, pagination.RIGHT_EMOJI, pagination.LAST_EMOJI, pagination.RIGHT_EMOJI)
+
+        await pagination.LinePaginator.paginate_lazily(self.get_page, 5, self.ctx, embed)
+
+        self.assertEqual([call.args[0] for call in self.get_page.await_args_list], [0, 1, 4])
+        self.assertEqual(self.message.edit.await_count, 2)
+        self.assertEqual(embed.description, "\nline of page 4\n")
+        self.assertEqual(embed.footer.text, "Page 5/5")
+        self.message.clear_reactions.assert_awaited_once()
+
+    async def test_pages_are_sent_to_destination(self):
+        """The pages should be sent to the destination instead of the context, if it's given."""
+        destination = MockMember()
+        destination.send.return_value = self.message
+        self.react(pagination.DELETE_EMOJI)
+
+        await pagination.LinePaginator.paginate_lazily(self.get_page, 2, self.ctx, Embed(), destination=destination)
+
+        destination.send.assert_awaited_once()
+        self.ctx.send.assert_not_called()
+        self.message.delete.assert_awaited_once()
+
+
 class ImagePaginatorTests(TestCase):
     """Tests functionality of the `ImagePaginator`."""
 
@@ -0,0 +1,85 @@
+import io
+import unittest
+from unittest.mock import patch
+
+from bot.database import SQLite
+from bot.tools import infractions
+from bot.utils.infractions import INSERT_COMMAND
+
+
+class InfractionTransferTests(unittest.TestCase):
+    """Tests for the bulk export and import of infractions."""
+
+    def setUp(self):
+        self.db = SQLite(":memory:")
+        self.db.migrate()
+        self.db.insert_many(INSERT_COMMAND, [
+            (1, "mute", "spam, with a comma", 2, 1577880000, 60, 0, 1577880060),
+            (3, "ban", "raid", 2, 1577880000, 1_000_000_000, 1, None),
+        ])
+
+    def tearDown(self):
+        self.db.close()
+
+    def round_trip(self, format_: str) -> list:
+        file = io.StringIO()
+        infractions.WRITERS[format_](infractions.iter_records(self.db), file)
+        file.seek(0)
+
+        target = SQLite(":memory:")
+        target.migrate()
+        try:
+            infractions.import_records(target, infractions.READERS[format_](file), keep_ids=True)
+            return target.fetchall("SELECT * FROM all_infractions ORDER BY ID;")
+        finally:
+            target.close()
+
+    def test_round_trip_keeps_rows(self):
+        """Exported infractions should be imported unchanged, including their IDs and expiry."""
+        expected = self.db.fetchall("SELECT * FROM all_infractions ORDER BY ID;")
+
+        for format_ in infractions.FORMATS:
+            with self.subTest(format=format_):
+                self.assertEqual(self.round_trip(format_), expected)
+
+    def test_import_commits_in_chunks(self):
+        """Every chunk of records should be inserted with a single `executemany` call."""
+        records = ({**record, "id": None} for record in list(infractions.iter_records(self.db)) * 3)
+
+        with patch.object(SQLite, "executemany", autospec=True, side_effect=SQLite.executemany) as executemany:
+            count = infractions.import_records(self.db, records, chunk_size=4)
+
+        self.assertEqual(count, 6)
+        self.assertEqual(executemany.call_count, 2)
+        self.assertEqual(self.db.fetchone("SELECT COUNT(*) FROM all_infractions;"), (8, ))
+
+    def test_taken_ids_are_refused(self):
+        """Kept IDs already used by an active or archived infraction, or by another record, should be refused."""
+        valid = {"user_id": 1, "type": "warn", "reason": "spam", "actor_id": 2, "start": 0, "duration": 0, "active": 1}
+        test_cases = (
+            ([{**valid, "id": 1}], "ID 1 already exists"),
+            ([{**valid, "id": 2, "active": 0}], "ID 2 already exists"),
+            ([{**valid, "id": 5}, {**valid, "id": 5, "active": 0}], "ID 5 is already used by record 1"),
+        )
+
+        for records, message in test_cases:
+            with self.subTest(records=records), self.assertRaisesRegex(infractions.InvalidRecord, message):
+                infractions.import_records(self.db, records, keep_ids=True)
+
+        self.assertEqual(self.db.fetchone("SELECT COUNT(*) FROM all_infractions;"), (2, ))
+
+    def test_invalid_records_are_refused(self):
+        """Records which don't fit the table should stop the import, keeping the committed chunks."""
+        valid = {"user_id": 1, "type": "warn", "reason": "spam", "actor_id": 2, "start": 0, "duration": 0, "active": 1}
+        test_cases = (
+            ({**valid, "type": "hug"}, "unknown infraction type"),
+            ({**valid, "active": 2}, "active must be 0 or 1"),
+            ({**valid, "start": "yesterday"}, "start must be an integer"),
+            ({**valid, "reason": None}, "missing field reason"),
+        )
+
+        for record, message in test_cases:
+            with self.subTest(record=record), self.assertRaisesRegex(infractions.InvalidRecord, message):
+                infractions.import_records(self.db, [valid, record], chunk_size=1)
+
+        self.assertEqual(self.db.fetchone("SELECT COUNT(*) FROM all_infractions;"), (2 + len(test_cases), ))
@@ -0,0 +1,78 @@
+import gzip
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+
+from bot.database import AsyncSQLite
+from bot.utils import backups
+
+
+class BackupTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the compressed and rotated database backups."""
+
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmp_dir.name, "backups")
+        self.db = AsyncSQLite(str(Path(self.tmp_dir.name, "test.db")), read_connections=1)
+        await self.db.migrate()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmp_dir.cleanup()
+
+    async def test_backup_contains_queued_writes(self):
+        """The decompressed snapshot should be a database with every write queued before the backup."""
+        self.db.queue_write("INSERT INTO users VALUES(?, ?, ?)", (1, 0, 0))
+
+        result = await backups.create_backup(self.db, self.directory, keep=3)
+
+        self.assertEqual(result.size, result.path.stat().st_size)
+        restored = Path(self.tmp_dir.name, "restored.db")
+        with gzip.open(result.path) as src:
+            restored.write_bytes(src.read())
+        conn = sqlite3.connect(restored)
+        try:
+            self.assertEqual(conn.execute("SELECT UID FROM users").fetchall(), [(1, )])
+        finally:
+            conn.close()
+
+    async def test_backup_leaves_only_compressed_file(self):
+        """The uncompressed snapshot should be removed once it is compressed."""
+        await backups.create_backup(self.db, self.directory, keep=3)
+
+        self.assertEqual([path.suffixes[-2:] for path in self.directory.iterdir()], [[".db", ".gz"]])
+
+    def test_rotate_keeps_newest(self):
+        """Only the `keep` newest backups should be kept."""
+        self.directory.mkdir()
+        names = [f"test-2020010{day}-000000{backups.SUFFIX}" for day in range(1, 5)]
+        for name in names:
+            (self.directory / name).touch()
+
+        backups.rotate_backups(self.directory, keep=2, stem="test")
+
+        self.assertEqual([path.name for path in backups.get_backups(self.directory)], names[2:])
+
+    def test_last_backup_time_is_read_from_name(self):
+        """The time of the newest backup of a database should be taken from its name, ignoring other databases."""
+        self.directory.mkdir()
+        for name in ("test-20200101-120000", "test-20200102-013000", "test-2-20200103-000000"):
+            (self.directory / f"{name}{backups.SUFFIX}").touch()
+
+        self.assertEqual(
+            backups.get_last_backup_time(self.directory, "test"), datetime(2020, 1, 2, 1, 30, tzinfo=timezone.utc)
+        )
+        self.assertIsNone(backups.get_last_backup_time(self.directory, "other"))
+
+    def test_rotate_keeps_backups_of_other_databases(self):
+        """Rotating the backups of one database should leave those of its guild shards alone."""
+        self.directory.mkdir()
+        shard = f"test-2-20200101-000000{backups.SUFFIX}"
+        (self.directory / shard).touch()
+        (self.directory / f"test-20200102-000000{backups.SUFFIX}").touch()
+
+        backups.rotate_backups(self.directory, keep=0, stem="test")
+
+        self.assertEqual([path.name for path in backups.get_backups(self.directory)], [shard])
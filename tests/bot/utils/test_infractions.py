@@ -0,0 +1,430 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from bot.database import AsyncSQLite, SQLite
+from bot.utils import infractions
+
+
+class InfractionDatabaseTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for reading and writing infractions through `bot.utils.infractions`."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncSQLite(":memory:")
+        await self.db.migrate()
+        self.start = datetime(2020, 1, 1, 12, 0, 0)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    def make_infraction(self, user_id: int = 1, inf_type: str = "warn", duration: int = 0) -> infractions.Infraction:
+        return infractions.Infraction(user_id, inf_type, "spam", 2, self.start, duration, active=1)
+
+    async def test_add_to_database_sets_id_of_duplicate_rows(self):
+        """Identical infractions should each receive the ID of their own row."""
+        first = self.make_infraction()
+        second = self.make_infraction()
+
+        await first.add_to_database(self.db)
+        await second.add_to_database(self.db)
+
+        self.assertEqual((first.id, second.id), (1, 2))
+
+    async def test_add_infractions_sets_ids(self):
+        """Bulk inserted infractions should receive the IDs of their rows, in order."""
+        batch = [self.make_infraction(user_id) for user_id in range(1, 4)]
+
+        await infractions.add_infractions(self.db, batch)
+
+        for infraction in batch:
+            with self.subTest(user_id=infraction.user_id):
+                stored = await infractions.get_infraction_by_row(self.db, infraction.id)
+                self.assertEqual(stored.user_id, infraction.user_id)
+
+    async def test_get_expiring_infractions_orders_by_expiry(self):
+        """Only active infractions with an expiry should be returned, soonest first."""
+        await infractions.add_infractions(self.db, [
+            self.make_infraction(1, "mute", 600),
+            self.make_infraction(2, "ban", 1_000_000_000),
+            self.make_infraction(3, "mute", 60),
+            self.make_infraction(4, "warn", 0),
+        ])
+
+        expiring = await infractions.get_expiring_infractions(self.db)
+
+        self.assertEqual([infraction.user_id for infraction in expiring], [3, 1])
+
+    async def test_count_overdue_infractions(self):
+        """Only active infractions which expired before the given time should be counted."""
+        await infractions.add_infractions(self.db, [
+            self.make_infraction(inf_type="mute", duration=60),
+            self.make_infraction(inf_type="mute", duration=600),
+            self.make_infraction(inf_type="ban", duration=1_000_000_000),
+        ])
+
+        self.assertEqual(await infractions.count_overdue_infractions(self.db, self.start + timedelta(minutes=5)), 1)
+
+    async def test_get_expiring_infractions_filters_in_database(self):
+        """`before` and `limit` should restrict which of the expiring infractions are returned."""
+        await infractions.add_infractions(self.db, [
+            self.make_infraction(user_id, "mute", user_id * 60) for user_id in range(1, 6)
+        ])
+
+        test_cases = (
+            ({"before": self.start + timedelta(seconds=150)}, [1, 2]),
+            ({"limit": 3}, [1, 2, 3]),
+            ({"before": self.start + timedelta(seconds=270), "limit": 1}, [1]),
+        )
+
+        for kwargs, expected in test_cases:
+            with self.subTest(kwargs=kwargs):
+                expiring = await infractions.get_expiring_infractions(self.db, **kwargs)
+                self.assertEqual([infraction.user_id for infraction in expiring], expected)
+
+    async def test_active_queries_skip_archive(self):
+        """Deactivated infractions should only be found by the history queries."""
+        batch = [self.make_infraction(1, "mute", 600), self.make_infraction(2, "mute", 600)]
+        await infractions.add_infractions(self.db, batch)
+        await batch[0].make_inactive(self.db)
+
+        active = await infractions.get_expiring_infractions(self.db)
+        history = await infractions.get_infractions(self.db, MagicMock(id=1))
+
+        self.assertEqual([infraction.id for infraction in active], [batch[1].id])
+        self.assertEqual([(infraction.id, infraction.is_active) for infraction in history], [(batch[0].id, False)])
+
+    async def test_remove_infraction_from_archive(self):
+        """Removing an archived infraction should delete it from the archive."""
+        infraction = self.make_infraction(1, "warn")
+        await infraction.add_to_database(self.db)
+        await infraction.make_inactive(self.db)
+
+        await infractions.remove_infraction(self.db, infraction)
+
+        self.assertFalse(await infractions.get_infraction_by_row(self.db, infraction.id))
+
+    async def test_get_infraction_counts_groups_by_type_and_state(self):
+        """Counts should be split by type and active state without loading the rows."""
+        batch = [self.make_infraction(1, "mute", 600), self.make_infraction(1, "mute", 600), self.make_infraction(1, "warn")]
+        await infractions.add_infractions(self.db, batch)
+        await batch[0].make_inactive(self.db)
+
+        with patch.object(infractions, "_fetch_infractions") as fetch:
+            counts = await infractions.get_infraction_counts(self.db, MagicMock(id=1))
+
+        fetch.assert_not_called()
+        self.assertEqual(counts, {("mute", True): 1, ("mute", False): 1, ("warn", True): 1})
+
+    async def test_get_infraction_counts_for_users(self):
+        """Batched counts should be keyed by user, and be empty for users without infractions."""
+        await infractions.add_infractions(self.db, [self.make_infraction(user_id) for user_id in (1, 2, 2)])
+
+        counts = await infractions.get_infraction_counts_for_users(self.db, (1, 2, 3))
+
+        self.assertEqual(counts[1], {("warn", True): 1})
+        self.assertEqual(counts[2], {("warn", True): 2})
+        self.assertEqual(counts[3], {})
+
+
+class UserInfractionPagesTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for keyset paging through the infractions of a user."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncSQLite(":memory:")
+        await self.db.migrate()
+        # Rows of another user are interleaved, so that the page bounds can't rely on consecutive IDs
+        await infractions.add_infractions(self.db, [
+            infractions.Infraction(user_id, "warn", "spam", 2, datetime.now(), 0) for _ in range(7) for user_id in (1, 2)
+        ])
+        self.pages = infractions.UserInfractionPages(self.db, MagicMock(id=1), total=7, per_page=3)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def page_ids(self, page: int) -> list:
+        return [infraction.id for infraction in await self.pages.get(page)]
+
+    async def test_pages_are_newest_first(self):
+        """Walking forwards should return every infraction of the user exactly once, newest first."""
+        self.assertEqual(self.pages.page_count, 3)
+        self.assertEqual(
+            [await self.page_ids(page) for page in range(3)],
+            [[13, 11, 9], [7, 5, 3], [1]]
+        )
+
+    async def test_pages_can_be_walked_backwards_from_last(self):
+        """Jumping to the last page and walking back should give the same pages."""
+        self.assertEqual(
+            [await self.page_ids(page) for page in (2, 1, 0)],
+            [[1], [7, 5, 3], [13, 11, 9]]
+        )
+
+    async def test_pages_past_empty_page_are_reachable(self):
+        """Pages next to an empty page should still be fetched, e.g. after infractions were removed."""
+        for infraction in await infractions.get_infractions(self.db, MagicMock(id=1)):
+            if infraction.id > 3:
+                infractions.remove_infraction(self.db, infraction)
+        await self.db.flush()
+        self.pages = infractions.UserInfractionPages(self.db, MagicMock(id=1), total=7, per_page=1)
+
+        # The fourth page is next to no page with bounds
+        self.assertEqual([await self.page_ids(page) for page in (0, 1, 2, 3)], [[3], [1], [], []])
+
+
+class InfractionSearchTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the full-text search over infraction reasons."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncSQLite(":memory:")
+        await self.db.migrate()
+        self.start = datetime(2020, 1, 1, 12, 0, 0)
+        self.batch = [
+            infractions.Infraction(1, "ban", "posted a scam link", 2, self.start, 600),
+            infractions.Infraction(2, "warn", "scam", 2, self.start + timedelta(days=10), 0),
+            infractions.Infraction(3, "mute", "spamming links", 2, self.start, 600, active=1),
+        ]
+        await infractions.add_infractions(self.db, self.batch)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def search_ids(self, query: str, **kwargs) -> list:
+        return [infraction.id for infraction, _ in await infractions.search_infractions(self.db, query, **kwargs)]
+
+    async def test_search_matches_all_words(self):
+        """Only infractions containing every word should match, archived ones included."""
+        self.assertEqual(await self.search_ids("scam link"), [self.batch[0].id])
+        self.assertEqual(await infractions.count_search_results(self.db, "scam"), 2)
+
+    async def test_search_filters(self):
+        """Type and start time filters should restrict the matches."""
+        test_cases = (
+            ({"inf_type": "warn"}, [self.batch[1].id]),
+            ({"since": self.start + timedelta(days=1)}, [self.batch[1].id]),
+            ({"inf_type": "mute"}, []),
+        )
+
+        for kwargs, expected in test_cases:
+            with self.subTest(kwargs=kwargs):
+                self.assertEqual(await self.search_ids("scam", **kwargs), expected)
+
+    async def test_search_highlights_and_escapes(self):
+        """Matches should be highlighted, and query syntax characters should be searched literally."""
+        results = await infractions.search_infractions(self.db, 'scam "link')
+
+        self.assertEqual(results[0][1], "posted a **scam** **link**")
+        self.assertEqual(await self.search_ids("spamming-links"), [self.batch[2].id])
+
+    async def test_removed_infractions_are_unindexed(self):
+        """Deleting an infraction, active or archived, should remove it from the search index."""
+        for infraction in self.batch[1:]:
+            await infractions.remove_infraction(self.db, infraction)
+
+        self.assertEqual(await self.db.fetchone("SELECT COUNT(*) FROM infractions_fts"), (1, ))
+
+
+class UserStateTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the materialized mute and ban state of users."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncSQLite(":memory:")
+        await self.db.migrate()
+        self.start = datetime.now()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def add(self, inf_type: str, duration: int) -> infractions.Infraction:
+        infraction = infractions.Infraction(1, inf_type, "spam", 2, self.start, duration)
+        await infraction.add_to_database(self.db)
+        return infraction
+
+    async def test_state_tracks_longest_active_infraction(self):
+        """The state should point at the longest active mute, falling back as mutes are deactivated."""
+        short = await self.add("mute", 600)
+        permanent = await self.add("mute", 1_000_000_000)
+        await self.add("warn", 0)
+
+        state = await infractions.get_user_state(self.db, 1)
+        self.assertEqual((state.muted_id, state.muted_until, state.banned_id), (permanent.id, None, None))
+        self.assertTrue(state.is_muted)
+
+        await permanent.make_inactive(self.db)
+        state = await infractions.get_user_state(self.db, 1)
+        self.assertEqual((state.muted_id, state.muted_until), (short.id, short.expiry))
+
+        await infractions.remove_infraction(self.db, short)
+        self.assertIsNone(await infractions.get_user_state(self.db, 1))
+
+    async def test_lookups_use_mirror(self):
+        """Once loaded, users without writes should be looked up without querying the database."""
+        await self.add("ban", 600)
+        await infractions.get_user_state(self.db, 1)
+
+        with patch.object(self.db, "fetchone") as fetchone, patch.object(self.db, "fetchall") as fetchall:
+            state = await infractions.get_user_state(self.db, 1)
+            missing = await infractions.get_user_state(self.db, 2)
+
+        fetchone.assert_not_called()
+        fetchall.assert_not_called()
+        self.assertTrue(state.is_banned)
+        self.assertIsNone(missing)
+
+    async def test_mirror_cleared_during_lookup(self):
+        """A lookup during which the mirror is cleared should load the table again instead of failing."""
+        await infractions.get_user_state(self.db, 1)
+        await self.add("ban", 600)
+        fetchone = self.db.fetchone
+
+        async def fetch_then_clear(*args, **kwargs) -> tuple:
+            row = await fetchone(*args, **kwargs)
+            infractions.clear_caches(self.db)
+            return row
+
+        # The cleared table is loaded again as a whole, so the user isn't fetched on its own again
+        with patch.object(self.db, "fetchone", side_effect=fetch_then_clear):
+            state = await infractions.get_user_state(self.db, 1)
+
+        self.assertTrue(state.is_banned)
+        self.assertIsNotNone(infractions.get_user_states(self.db).states)
+
+    def test_expired_infractions_are_not_restricting(self):
+        """Infractions past their expiry shouldn't count, even before the scheduler deactivates them."""
+        state = infractions.UserState(1, 1, int(self.start.timestamp()) - 1, None, None)
+
+        self.assertFalse(state.is_muted)
+        self.assertFalse(state.is_banned)
+
+
+class InfractionRecordTests(unittest.TestCase):
+    """Tests for the `Infraction` record type."""
+
+    def setUp(self):
+        self.db = SQLite(":memory:")
+        self.db.migrate()
+        self.db.execute(infractions.INSERT_COMMAND, (1, "mute", "spam", 2, 1577880000, 60, 1, 1577880060))
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_from_row_decodes_start_lazily(self):
+        """Records built by the row factory should keep the raw timestamp until `start` is accessed."""
+        infraction = self.db.fetchone(
+            f"SELECT {infractions.COLUMNS} FROM infractions", row_factory=infractions.Infraction.from_row)
+
+        self.assertEqual(infraction._start, 1577880000)
+        self.assertEqual(infraction.start, datetime.fromtimestamp(1577880000))
+        self.assertEqual(infraction.stop, datetime.fromtimestamp(1577880060))
+        self.assertTrue(infraction.is_active)
+
+    def test_from_row_accepts_column_subset(self):
+        """The row factory should work with only some of the columns selected."""
+        infraction = self.db.fetchone(
+            "SELECT Type, ID FROM infractions", row_factory=infractions.Infraction.from_row)
+
+        self.assertEqual((infraction.type, infraction.id, infraction.user_id), ("mute", 1, None))
+
+    def test_column_positions_are_reused(self):
+        """The column positions should be computed once per statement, not for every row."""
+        self.db.execute(infractions.INSERT_COMMAND, (2, "warn", "spam", 2, 1577880000, 0, 0, None))
+
+        with patch.object(infractions, "_find_column_indices", wraps=infractions._find_column_indices) as find:
+            rows = self.db.fetchall(
+                f"SELECT {infractions.COLUMNS} FROM all_infractions", row_factory=infractions.Infraction.from_row)
+
+        self.assertEqual(len(rows), 2)
+        find.assert_called_once()
+
+    def test_records_have_no_instance_dict(self):
+        """Records should use slots instead of a per-instance `__dict__`."""
+        infraction = infractions.Infraction(1, "warn", "spam", 2, datetime.now(), 0)
+
+        self.assertFalse(hasattr(infraction, "__dict__"))
+
+
+class UserInfractionCacheTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the per-user infraction cache."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncSQLite(":memory:")
+        await self.db.migrate()
+        self.cache = infractions.get_cache(self.db)
+        self.user = MagicMock(id=1)
+
+        self.infraction = infractions.Infraction(1, "mute", "spam", 2, datetime.now(), 600)
+        await self.infraction.add_to_database(self.db)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def test_repeated_lookups_hit_cache(self):
+        """Only the first lookup of a user should query the database."""
+        with patch.object(self.db, "fetchall", wraps=self.db.fetchall) as fetchall:
+            await infractions.get_infractions(self.db, self.user)
+            await infractions.get_active_infractions(self.db, self.user)
+            await infractions.get_infractions(self.db, self.user, "mute")
+
+        fetchall.assert_called_once()
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    async def test_writes_invalidate_cache(self):
+        """Deactivating an infraction should be visible to the next lookup."""
+        self.assertEqual(len(await infractions.get_active_infractions(self.db, self.user)), 1)
+
+        await self.infraction.make_inactive(self.db)
+
+        self.assertEqual(await infractions.get_active_infractions(self.db, self.user), [])
+
+    async def test_reads_during_commit_are_not_kept(self):
+        """Rows cached by a read running while a write was committed should be dropped once it landed."""
+        await infractions.get_active_infractions(self.db, self.user)
+        write = self.infraction.make_inactive(self.db)
+        # A read which ran before the write landed, but finished after it was queued
+        self.cache.put(self.user.id, [self.infraction], self.cache.version)
+
+        await write
+
+        self.assertEqual(await infractions.get_active_infractions(self.db, self.user), [])
+
+    async def test_prefetch_loads_users_with_one_query(self):
+        """Prefetching should cache every user, including those without infractions, with a single query."""
+        with patch.object(self.db, "fetchall", wraps=self.db.fetchall) as fetchall:
+            await infractions.prefetch_infractions(self.db, [1, 2, 1])
+            prefetched = await infractions.get_infractions(self.db, self.user)
+            await infractions.get_infractions(self.db, MagicMock(id=2))
+
+        fetchall.assert_called_once()
+        self.assertEqual([infraction.id for infraction in prefetched], [self.infraction.id])
+
+    async def test_probes_are_not_counted(self):
+        """Prefetching and counting should not count their cache lookups as hits or misses."""
+        await infractions.prefetch_infractions(self.db, [1, 2])
+        await infractions.prefetch_infractions(self.db, [1, 2])
+        await infractions.get_infraction_counts(self.db, self.user)
+
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 0))
+
+    def test_cache_statistics_are_combined(self):
+        """The statistics of several caches should be added up."""
+        infos = [infractions.CacheInfo(1, 2, 10, 3), infractions.CacheInfo(4, 0, 10, 5)]
+
+        self.assertEqual(infractions.UserInfractionCache.combine(infos), infractions.CacheInfo(5, 2, 20, 8))
+
+    def test_cache_evicts_least_recently_used(self):
+        """The cache should not hold more users than its maximum size."""
+        cache = infractions.UserInfractionCache(maxsize=2)
+        for user_id in range(3):
+            cache.put(user_id, [], cache.version)
+
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.info().currsize, 2)
+
+    def test_put_ignores_results_of_invalidated_reads(self):
+        """A read which started before an invalidation should not be cached."""
+        cache = infractions.UserInfractionCache(maxsize=2)
+        version = cache.version
+
+        cache.invalidate(1)
+        cache.put(1, [], version)
+
+        self.assertIsNone(cache.get(1))
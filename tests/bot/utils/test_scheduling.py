@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+
+from unittest.mock import patch
+
+from bot.utils.scheduling import Scheduler, get_schedulers
+from bot.utils.time import MAX_SLEEP
+
+
+class RecordingScheduler(Scheduler):
+    """Scheduler which records the data of the tasks it runs."""
+
+    def __init__(self):
+        super().__init__()
+        self.ran = []
+
+    async def _scheduled_task(self, task_object) -> None:
+        if task_object == "fail":
+            raise RuntimeError
+        self.ran.append(task_object)
+
+
+class SchedulerTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for the heap based task scheduler."""
+
+    def setUp(self):
+        self.scheduler = RecordingScheduler()
+
+    def in_seconds(self, seconds: float) -> datetime:
+        return datetime.now() + timedelta(seconds=seconds)
+
+    async def test_tasks_run_in_deadline_order(self):
+        """Tasks should be started in the order of their deadlines, not the order they were scheduled in."""
+        for task_id, seconds in ((1, 0.06), (2, 0.02), (3, 0.04), (4, -5)):
+            self.scheduler.schedule_task(task_id, task_id, at=self.in_seconds(seconds))
+
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(self.scheduler.ran, [4, 2, 3, 1])
+        self.assertEqual(self.scheduler._heap, [])
+
+    async def test_pending_tasks_have_no_coroutine(self):
+        """Until its deadline, a task should only be a heap entry with a single shared timer."""
+        for task_id in range(100):
+            self.scheduler.schedule_task(task_id, task_id, at=self.in_seconds(60 + task_id))
+
+        self.assertEqual(self.scheduler._scheduled_tasks, {})
+        self.assertEqual(len(self.scheduler._heap), 100)
+        self.assertAlmostEqual(self.scheduler._timer.when() - asyncio.get_running_loop().time(), 60, delta=1)
+        self.scheduler.cancel_all()
+
+    async def test_cancel_pending_task(self):
+        """A cancelled task should never start, even if its entry is still in the heap."""
+        self.scheduler.schedule_task(1, 1, at=self.in_seconds(0.02))
+        self.scheduler.schedule_task(2, 2, at=self.in_seconds(0.03))
+        self.scheduler.schedule_task(3, 3, at=self.in_seconds(0.04))
+        self.scheduler.cancel_task(1)
+
+        await asyncio.sleep(0.08)
+
+        self.assertEqual(self.scheduler.ran, [2, 3])
+
+    async def test_cancelled_entries_are_compacted(self):
+        """Cancelled entries shouldn't accumulate in the heap."""
+        for task_id in range(100):
+            self.scheduler.schedule_task(task_id, task_id, at=self.in_seconds(60))
+        for task_id in range(90):
+            self.scheduler.cancel_task(task_id)
+
+        self.assertLessEqual(len(self.scheduler._heap), 20)
+        self.assertEqual(sorted(entry[2] for entry in self.scheduler._heap if entry[3] is not None), list(range(90, 100)))
+        self.scheduler.cancel_all()
+
+    async def test_duplicate_task_id_is_ignored(self):
+        """Scheduling an already pending task ID again should keep the original task."""
+        self.scheduler.schedule_task(1, "first", at=self.in_seconds(0.01))
+        self.scheduler.schedule_task(1, "second")
+
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(self.scheduler.ran, ["first"])
+
+    async def test_long_timers_are_rearmed(self):
+        """A far deadline should be re-checked against the wall clock, catching up with clock jumps."""
+        self.scheduler.schedule_task(1, 1, at=self.in_seconds(3600))
+        self.assertAlmostEqual(self.scheduler._timer.when() - asyncio.get_running_loop().time(), MAX_SLEEP, delta=1)
+
+        # The wall clock jumps past the deadline before the timer fires
+        jumped = self.scheduler._armed_at[0] + 3600
+        with patch("bot.utils.scheduling.time.time", return_value=jumped):
+            self.scheduler._timer.cancel()
+            self.scheduler._on_timer()
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(self.scheduler.ran, [1])
+        self.assertGreater(self.scheduler.metrics().drift, 3500)
+
+    async def test_metrics_describe_pending_and_started_tasks(self):
+        """Metrics should count pending tasks and failures, report the next deadline and how late tasks started."""
+        self.scheduler.schedule_task(1, "fail", at=self.in_seconds(-2))
+        self.scheduler.schedule_task(2, 2, at=self.in_seconds(0))
+        later = self.in_seconds(60)
+        self.scheduler.schedule_task(3, 3, at=later)
+        self.scheduler.schedule_task(4, 4, at=self.in_seconds(30))
+        self.scheduler.cancel_task(4)
+
+        await asyncio.sleep(0.05)
+        metrics = self.scheduler.metrics()
+
+        self.assertEqual((metrics.pending, metrics.running, metrics.failures), (1, 0, 1))
+        self.assertEqual(metrics.next_due, later)
+        self.assertEqual(metrics.lag.calls, 2)
+        self.assertGreaterEqual(metrics.lag.max, 2000)
+        self.assertIn(self.scheduler, get_schedulers())
+        self.scheduler.cancel_all()
@@ -0,0 +1,38 @@
+import unittest
+from datetime import datetime
+
+from bot.database import AsyncSQLite
+from bot.utils import silences
+
+
+class SilenceStorageTests(unittest.IsolatedAsyncioTestCase):
+    """Tests for storing channel silences in the database."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncSQLite(":memory:")
+        await self.db.migrate()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def test_expiring_silences_are_ordered_by_expiry(self):
+        """Only silences with an expiry should be returned, soonest first, with their expiry decoded."""
+        await silences.add_silence(self.db, 1, 10, datetime(2020, 1, 2))
+        await silences.add_silence(self.db, 2, 10, None)
+        await silences.add_silence(self.db, 3, 10, datetime(2020, 1, 1))
+
+        self.assertEqual(await silences.get_expiring_silences(self.db), [
+            silences.SilenceRecord(3, 10, datetime(2020, 1, 1)),
+            silences.SilenceRecord(1, 10, datetime(2020, 1, 2)),
+        ])
+
+    async def test_silence_is_replaced_and_removed(self):
+        """Silencing a channel again should replace its silence, removing it should forget it."""
+        await silences.add_silence(self.db, 1, 10, datetime(2020, 1, 1))
+        await silences.add_silence(self.db, 1, 11, datetime(2020, 1, 3))
+
+        self.assertEqual(await silences.get_expiring_silences(self.db), [silences.SilenceRecord(1, 11, datetime(2020, 1, 3))])
+
+        await silences.remove_silence(self.db, 1)
+
+        self.assertEqual(await silences.get_expiring_silences(self.db), [])
@@ -0,0 +1,19 @@
+import unittest
+
+from bot.utils.stats import FiringLag
+
+
+class HistogramTests(unittest.TestCase):
+    """Tests for the duration histograms."""
+
+    def test_merged_histograms_keep_their_buckets(self):
+        """Merging should add up the recorded durations, a copy shouldn't change with the original."""
+        lag = FiringLag()
+        for milliseconds in (0.5, 50, 2000):
+            lag.record(milliseconds)
+        copy = lag.copy()
+        lag.merge(copy)
+
+        self.assertEqual((lag.calls, lag.max, lag.average), (6, 2000, 2050.5 / 3))
+        self.assertEqual(lag.percentile(50), 100)
+        self.assertEqual(copy.calls, 3)
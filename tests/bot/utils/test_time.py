@@ -52,16 +52,31 @@ class TimeTests(unittest.TestCase):
                 "max_units must be positive"
             )
 
+    @patch("bot.utils.time.clock.time", return_value=1000.0)
     @patch("asyncio.sleep", new_callable=AsyncMock)
-    def test_wait_until(self, mock):
+    def test_wait_until(self, mock, clock):
         """Testing wait_until."""
         start = datetime(2019, 1, 1, 0, 0)
         then = datetime(2019, 1, 1, 0, 10)
+        mock.side_effect = lambda seconds: setattr(clock, "return_value", clock.return_value + seconds)
 
         # No return value
         self.assertIs(asyncio.run(time.wait_until(then, start)), None)
 
-        mock.assert_called_once_with(10 * 60)
+        # Long waits are split, so the clock is re-checked in between
+        self.assertEqual([call.args[0] for call in mock.call_args_list], [time.MAX_SLEEP, 10 * 60 - time.MAX_SLEEP])
+
+    @patch("bot.utils.time.clock.time", return_value=1000.0)
+    @patch("asyncio.sleep", new_callable=AsyncMock)
+    def test_wait_until_follows_clock_jumps(self, mock, clock):
+        """A wall clock moved forward during the wait should shorten the rest of it."""
+        then = datetime.fromtimestamp(1000 + 3600)
+        # The clock jumps 50 minutes ahead during the first sleep
+        mock.side_effect = lambda seconds: setattr(clock, "return_value", clock.return_value + seconds + 3000)
+
+        asyncio.run(time.wait_until(then))
+
+        self.assertEqual([call.args[0] for call in mock.call_args_list], [time.MAX_SLEEP, 300])
 
     def test_until_expiration_with_duration_none_expiry(self):
         """until_expiration should work for None expiry."""